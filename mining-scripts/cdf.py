@@ -1,48 +1,157 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 # Produces graph of Cummulative Distribution Function,
-# given a file of numbers, one per line.
+# given files of numbers, one per line (or the first number of each line).
 # Expected input would is hs-activity-count.txt as produced by hs-getActivity.sh
+# (or files written by activity.Activity.to_file).
 
-# Graph is in new window. Additionally, prints input numbers to stdout.
+# Graph is in new window, unless saved with --save; --csv writes the curve.
+# Additionally, prints input numbers to stdout, when shown.
+#   $ python3 cdf.py [--save cdf.png] [--csv cdf.csv] counts.txt [counts2.txt...]
 
 import sys
+import csv
 
-from bisect import bisect_left
-from scipy.stats import norm
-import matplotlib.pyplot as plt
+import numpy as np
 
 
-class discrete_cdf:
-    def __init__(self, data):
-        self._data = data # must be sorted
-        self._data_len = float(len(data))
+class ECDF:
+    """The empirical distribution of some numbers, as their sorted distinct
+    :values: and the :counts: of each. ECDFs can be updated with more numbers,
+    and merged, so that those of many files (or processes) can be combined.
+    """
+    def __init__(self, data=()):
+        self.values = np.array([], dtype=np.int64)
+        self.counts = np.array([], dtype=np.int64)
+        self._cumulative = None
+        self.update(data)
 
-    def __call__(self, point):
-        return (len(self._data[:bisect_left(self._data, point)]) /
-                self._data_len)
+    def __len__(self):
+        """The number of numbers"""
+        return int(self.counts.sum())
 
+    def __repr__(self):
+        return "ECDF(<{n} values> <{d} distinct>)".format(
+                n=len(self), d=len(self.values))
 
-def show_cdf(data):
-    cdf = discrete_cdf(data)
-    xvalues = range(0, max(data))
-    yvalues = [cdf(point) for point in xvalues]
-    plt.plot(xvalues, yvalues)
-    plt.show()
+    def update(self, data):
+        """Adds the numbers of :data: (an iterable, or array)"""
+        if not isinstance(data, np.ndarray):
+            data = np.array(list(data))
+        if len(data):
+            self._add(*np.unique(data, return_counts=True))
+        return self
 
+    def merge(self, other):
+        """Adds the numbers of :other: ECDF"""
+        self._add(other.values, other.counts)
+        return self
 
-if __name__ == '__main__':
-    if len(sys.argv) == 0:
-      print('Usage: python cdf.py file-with-the-numbers')
-      sys.exit(0)
+    def __add__(self, other):
+        return ECDF().merge(self).merge(other)
+
+    def _add(self, values, counts):
+        values = np.concatenate([self.values, values])
+        counts = np.concatenate([self.counts, counts])
+        self.values, inverse = np.unique(values, return_inverse=True)
+        self.counts = np.bincount(inverse, counts,
+                len(self.values)).astype(np.int64)
+        self._cumulative = None
+
+    @property
+    def cumulative(self):
+        """How many numbers are at most each value"""
+        if self._cumulative is None:
+            self._cumulative = np.cumsum(self.counts)
+        return self._cumulative
+
+    def __call__(self, points):
+        """The fraction of the numbers less than each of :points: (or point)"""
+        below = np.concatenate([[0], self.cumulative])[
+                np.searchsorted(self.values, points, side="left")]
+        return below / float(len(self))
+
+    def curve(self):
+        """The distinct values, and the fraction of the numbers at most each"""
+        return self.values, self.cumulative / float(len(self))
+
+    def quantile(self, q):
+        """The least values at or above which are the fractions :q: of the
+        numbers
+        """
+        rank = np.ceil(np.asarray(q) * len(self)).astype(np.int64)
+        i = np.searchsorted(self.cumulative, np.maximum(rank, 1), side="left")
+        return self.values[np.minimum(i, len(self.values) - 1)]
+
+    def to_csv(self, filename):
+        """Writes the curve, with the count of each value"""
+        x, y = self.curve()
+        with open(filename, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["x", "count", "cdf"])
+            writer.writerows(zip(x.tolist(), self.counts.tolist(), y.tolist()))
+
+    def graph(self, save=None):
+        """Plots the curve, as steps at the distinct values (rather than a
+        point per number in 0..max, as show_cdf did). With :save:, the graph
+        is written to that file, without pyplot (nor a display); otherwise it
+        is shown.
+        """
+        xvalues, yvalues = self.curve()
+        if save:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            fig.add_subplot().step(xvalues, yvalues, where="post")
+            fig.savefig(save)
+        else:
+            import matplotlib.pyplot as plt
+            plt.step(xvalues, yvalues, where="post")
+            plt.show()
 
-    content0, data=list(), list()
 
-    with open(sys.argv[1]) as f:
-      content0 = f.readlines()
+# The former (bisect over sorted data) implementation's name; sorts the data
+discrete_cdf = ECDF
 
-    for i in content0:
-      data.append(int(i))
-    print('{0}'.format(data))
 
-    show_cdf(data)
+def read_counts(filename):
+    """The numbers of a file, the first on each (non-empty) line"""
+    with open(filename) as f:
+        return np.array([line.split(None, 1)[0] for line in f if line.strip()],
+                dtype=np.int64)
+
+
+def file_cdf(filenames):
+    """The ECDF of the numbers of all the files, read one at a time"""
+    cdf = ECDF()
+    for filename in filenames:
+        cdf.update(read_counts(filename))
+    return cdf
+
+
+def show_cdf(data, save=None):
+    ECDF(data).graph(save)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for option in ["--save", "--csv"]:
+        if option in args:
+            i = args.index(option)
+            options[option] = args[i+1]
+            del args[i:i+2]
+    if len(args) == 0:
+      print('Usage: python3 cdf.py [--save file.png] [--csv file.csv] '
+              'file-with-the-numbers...')
+      sys.exit(0)
+
+    cdf = file_cdf(args)
+    if "--csv" in options:
+        cdf.to_csv(options["--csv"])
+    if "--save" in options:
+        cdf.graph(options["--save"])
+    elif "--csv" not in options:
+        print('{0}'.format(np.repeat(cdf.values, cdf.counts).tolist()))
+        cdf.graph()
@@ -3,15 +3,19 @@
 #   assertion
 
 
+import pickle
 from collections import Counter
 from assertions import *
-import cdf
 
 
 class Activity():
-    def __init__(self, history):
+    """The number of events of each (name, predicate) of a History, or of
+    many: Activities merge (or add), and save, e.g. to be reduced to those of
+    a whole corpus.
+    """
+    def __init__(self, history=None):
         self.counter = Counter((a.name, a.predicate) for a in
-                assertion_iter(history))
+                assertion_iter(history)) if history is not None else Counter()
 
     def __str__(self):
         string = ""
@@ -19,21 +23,33 @@ class Activity():
             string += "{c}\t{n}({p})\n".format(c=count, n=name, p=pred)
         return string
 
-    def cdf(self):
-        data = list(self.counter.values())
-        cdf.show_cdf(data)
-
-    def to_file(self, filename):
-        with open(filename, 'w') as file:
-            file.write(self.__str__())
-
-
-
-
-
+    def merge(self, other):
+        """Adds the counts of :other: Activity to these"""
+        self.counter.update(other.counter)
+        return self
 
+    def __add__(self, other):
+        return Activity().merge(self).merge(other)
 
+    def ecdf(self):
+        """The cdf.ECDF of the counts, which can be merged with others'"""
+        import cdf  # (of mining-scripts/, so only when needed)
+        return cdf.ECDF(self.counter.values())
 
+    def cdf(self, save=None):
+        self.ecdf().graph(save)
 
+    def to_file(self, filename):
+        with open(filename, 'w') as file:
+            file.write(self.__str__())
 
+    def save(self, filename):
+        with open(filename, 'wb') as file:
+            pickle.dump(self.counter, file)
 
+    @staticmethod
+    def load(filename):
+        activity = Activity()
+        with open(filename, 'rb') as file:
+            activity.counter = pickle.load(file)
+        return activity
@@ -1,9 +1,8 @@
 # functions for producing analyses of History data
 import pickle
-from collections import defaultdict, OrderedDict, Counter, namedtuple
-from itertools import chain, groupby
+from collections import defaultdict, OrderedDict, Counter, namedtuple, deque
+from itertools import chain
 import numpy as np
-import matplotlib.pyplot as plt
 from textwrap import wrap
 from datetime import datetime, timezone, timedelta
 import csv as Csv
@@ -11,12 +10,17 @@ import io
 from enum import Enum
 import numpy as np
 import sys
-from copy import deepcopy
 import re
 
 import logging
+import os
+from array import array
+from functools import lru_cache
 
-from assertions import Change, remove_whitespace
+from assertions import Change, remove_whitespace, StreamHeader, read_stream, \
+        HistoryView
+from columnar import ColumnarHistory, CHANGES
+import sketches
 
 
 class DataPoint():
@@ -62,8 +66,14 @@ class Result():
             self.text = text
             self.func = func
 
+        def __reduce_ex__(self, protocol):
+            # by name, since the funcs can't be pickled
+            return getattr, (self.__class__, self.name)
+
+    rest = None
+
     def __init__(self, id, datapoints, desc, x_label, y_label, sort=None,
-            tail=Tail.Avg):
+            tail=Tail.Avg, rest=None):
         """Prouce Result from list of DataPoints
         :sort:  if given sorting function, then sorts from Biggest to smallest
         :datapoints:    iter(Datapoint)
@@ -73,6 +83,8 @@ class Result():
                     x-sorted, Max ensures we
                     aren't missing anything important, and if y-sorted, Avg
                     ensures that the rest are of little consequence.
+        :rest:      (int, DataPoint) the number, and sums, of any datapoints
+                    left out of :datapoints: (e.g. by a sketch), for the tail
         """
 
         self.id = id
@@ -82,6 +94,7 @@ class Result():
         self.datapoints = datapoints if sort is None else \
                           sorted(datapoints, key=sort, reverse=True)
         self.tail = tail
+        self.rest = rest
 
     def csv(self, save):
         def write_csv(file):
@@ -93,11 +106,29 @@ class Result():
         with open(save, 'w', newline='') as file:
             write_csv(file)
 
+    def rest_datapoint(self, tail):
+        """The tail DataPoint of the :tail: datapoints and the rest"""
+        n, sums = self.rest
+        n += len(tail)
+        values = []
+        for y in ["y_added", "y_removed", "y_combined"]:
+            ys = [getattr(dp, y) for dp in tail]
+            if self.tail is Result.Tail.Max:   # (of those not left out)
+                values.append(self.tail.func(ys))
+            else:
+                total = sum(ys) + getattr(sums, y)
+                values.append(total if self.tail is Result.Tail.Sum else
+                        total / n if n else 0.0)
+        return DataPoint("~{n} Remaining; {t}".format(n=n, t=self.tail.text),
+                *values)
+
     def graph(self, length=None, save=None, filt=None):
         """Produce graph of results. Applies given filters, if available.
         :length:    (int) max number DataPoints to plot
         :save:      (string) instead of displaying out, save under this filename
         :filt:      (pred func) filter out DataPoints that produce False
+        matplotlib is only imported here. Saved graphs are rendered without
+        pyplot (nor a display), so they can be rendered in any process.
         """
 
         # Filter if necessary
@@ -114,11 +145,14 @@ class Result():
         if length is not None: # and length < len(dps): confusing if tail isn't always shown
             dps = dps[:length]
             tail = self.datapoints[length:]
-            tail_dp = DataPoint("{n} Remaining; {t}" \
-                        .format(n=len(tail), t=self.tail.text),
-                    self.tail.func([dp.y_added for dp in tail]),
-                    self.tail.func([dp.y_removed for dp in tail]),
-                    self.tail.func([dp.y_combined for dp in tail]))
+            if self.rest is None:
+                tail_dp = DataPoint("{n} Remaining; {t}" \
+                            .format(n=len(tail), t=self.tail.text),
+                        self.tail.func([dp.y_added for dp in tail]),
+                        self.tail.func([dp.y_removed for dp in tail]),
+                        self.tail.func([dp.y_combined for dp in tail]))
+            else:
+                tail_dp = self.rest_datapoint(tail)
             dps.append(tail_dp)
 
         # Prepare graph
@@ -132,7 +166,15 @@ class Result():
         xs = np.arange(length)    # the x locations for the groups
         width = 0.27              # the width of the bars
 
-        fig, ax = plt.subplots()
+        if save:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.subplots()
+        else:
+            import matplotlib.pyplot as plt
+            fig, ax = plt.subplots()
         rects_adds = ax.bar(xs, y_addeds, width, color='r')
         rects_rems = ax.bar(xs+width, y_removeds, width, color='y')
         rects_coms = ax.bar(xs+(2*width), y_combineds, width, color='g')
@@ -166,15 +208,17 @@ class Result():
 
         if save:
             fig.savefig(save)
-            fig.clf()
         else:
             fig.show()
 
 
+# (seconds, offset) of datetime.min, in UTC. (The timestamp of a naive
+# datetime.min raises a ValueError, as its local time may precede year 1.)
+MIN_TIME = (int(datetime.min.replace(tzinfo=timezone.utc).timestamp()), 0)
+
 class Delta():
     def __init__(self, num_commits=sys.maxsize,
-            last_atime=(int(datetime.min.timestamp()), 0),
-            last_ctime=(int(datetime.min.timestamp()), 0)):
+            last_atime=MIN_TIME, last_ctime=MIN_TIME):
         self.num_commits = num_commits # if sys.maxsize, no asserts found yet
         self.last_atime = last_atime   # if datetime.min, no asserts found yet
         self.last_ctime = last_ctime
@@ -265,14 +309,20 @@ def delta_results(history):
     """Produce result 3-tuple for given history. Output is 2-tuple, made of
     3-tuple counters, and a 2-tuple of linearity and monotonicity scores
     """
-    insert_deltas(history)
-    add_com_ctr, add_atime_ctr, add_ctime_ctr = delta_counts(history, Change.added)
-    rem_com_ctr, rem_atime_ctr, rem_ctime_ctr = delta_counts(history, Change.removed)
-    comb_com_ctr, comb_atime_ctr, comb_ctime_ctr = delta_counts(history)
+    graph = CommitGraph(history)
+    return graph_delta_results(history, graph)
+
+
+def graph_delta_results(history, graph):
+    """As delta_results, from the CommitGraph of the history"""
+    graph.compute_deltas()
+    add_com_ctr, add_atime_ctr, add_ctime_ctr = graph.delta_counts(Change.added)
+    rem_com_ctr, rem_atime_ctr, rem_ctime_ctr = graph.delta_counts(Change.removed)
+    comb_com_ctr, comb_atime_ctr, comb_ctime_ctr = graph.delta_counts()
 
     # for normalizing results (i.e., ignoring rebase-policy repos)
-    linearity = linearity_score(history)
-    monotonicity = monotonicity_score(history)
+    linearity = graph.linearity_score()
+    monotonicity = graph.monotonicity_score()
 
     commit_result = delta_result(history,
             (add_com_ctr, rem_com_ctr, comb_com_ctr),
@@ -309,7 +359,7 @@ def linearity_score(history):
     PRECONDITION: history has been deltaed.
     """
     num_merges = sum(1 for d in history.diffs if d.delta.num_visits > 1)
-    linearity = 1 - (num_merges/len(history.diffs))
+    linearity = 1 - (num_merges/max(len(history.diffs), 1))
     return linearity
 
 
@@ -318,38 +368,58 @@ def monotonicity_score(history):
     linearity, can be used to normailze results. Uses author_time since
     that isn't changed on rebase.
     """
-    out_of_orders = 0
-    total = 0
-
-    diffses = zip(history.diffs, _next_iter(history.diffs))
-    for prev, curr in diffses:
-        prev_time = make_time(prev.author_time)
-        curr_time = make_time(curr.author_time)
-        if curr_time < prev_time:  # are they in order?
-            out_of_orders += 1
-        total += 1
-    return 1 - (out_of_orders/total)
+    atimes, _ = commit_times(history)
+    return 1 - (out_of_orders(atimes)/max(len(atimes) - 1, 1))
 
 def onecommit_score(history):
     """Percentage of commits that have equal author and commit times"""
-    total = sum(1 for d in history.diffs)
-    onecommitted = sum(1 for d in history.diffs if d.author_time == d.commit_time)
-    return onecommitted/total
+    atimes, ctimes = commit_times(history)
+    onecommitted = int(np.count_nonzero((atimes == ctimes).all(axis=1)))
+    return onecommitted/len(atimes)
 
 
+@lru_cache(maxsize=None)
+def _timezone(offset):
+    return timezone(timedelta(minutes=offset))
+
 def make_time(timetz):
-    tz = timezone(timedelta(minutes=timetz[1]))
-    time = datetime.fromtimestamp(timetz[0], tz)
-    return time
+    return datetime.fromtimestamp(timetz[0], _timezone(timetz[1]))
 
 
 def time_diff(time2, time1): # (seconds2, offset2) - (seconds1, offset1)
     """Produce timedelta between time2 and time1"""
-    t2 = make_time(time2)
-    t1 = make_time(time1)
+    # (as between the aware datetimes, where the offsets cancel out)
+    return timedelta(seconds=time2[0] - time1[0])
+
 
-    dtime = t2 - t1
-    return dtime
+def commit_times(history):
+    """Produce the (seconds, offset) author and commit times of the commits of
+    :history:, in order, as two (n, 2) int64 arrays
+    """
+    if isinstance(history, ColumnarHistory):
+        return (np.asarray(history.commit_atime),
+                np.asarray(history.commit_ctime))
+    times = np.fromiter(chain.from_iterable(
+        chain(d.author_time, d.commit_time) for d in history.diffs),
+        dtype=np.int64).reshape(-1, 2, 2)
+    return times[:, 0], times[:, 1]
+
+def time_diffs(times2, times1):
+    """As time_diff over arrays of times, or of their seconds, in seconds"""
+    times2, times1 = np.asarray(times2), np.asarray(times1)
+    if times2.ndim > 1:
+        times2 = times2[..., 0]
+    if times1.ndim > 1:
+        times1 = times1[..., 0]
+    return times2 - times1
+
+def duration_days(seconds):
+    """The whole days (timedelta.days) of durations in seconds"""
+    return np.asarray(seconds) // int(timedelta(days=1).total_seconds())
+
+def out_of_orders(times):
+    """The number of times (or seconds) earlier than the previous one"""
+    return int(np.count_nonzero(time_diffs(times[1:], times[:-1]) < 0))
 
 
 def has_good_assert(diff):
@@ -403,7 +473,7 @@ def insert_deltas(history):
 # exists      None        yes         |   do nothing
 # exists      None        no          |   do nothing
 # exists      val         yes         |   delta.dist/durs = min(d, p.num_commits++; difftime-p.lasts)
-# exists      val         no          |   delta.nc = min(d, pd+1); delta.times = max(d, pd)
+# exists      val         no          |   delta.nc = min(d.nc, pd.nc+1); delta.times = max(d, pd)
 #
 # num_visits == num parents -> do this last: for child in childs:visit_diff(child, delta)
 
@@ -437,14 +507,16 @@ def insert_deltas(history):
             pass
 
         elif not first_visit and seen_assert and has_asserts:
-            diff.delta.commit_dist = min(diff.delta.commit_dist, prev_delta.diff+1)
+            diff.delta.commit_dist = min(diff.delta.commit_dist,
+                    prev_delta.num_commits+1)
             diff.delta.atime_dur = min(diff.delta.atime_dur,
                     time_diff(diff.author_time, prev_delta.last_atime))
             diff.delta.ctime_dur = min(diff.delta.ctime_dur,
                     time_diff(diff.commit_time, prev_delta.last_ctime))
 
         elif not first_visit and seen_assert and not has_asserts:
-            diff.delta.num_commits= min(diff.delta.commit_dist, prev_delta.num_commits+1)
+            diff.delta.num_commits = min(diff.delta.num_commits,
+                    prev_delta.num_commits+1)
             diff.delta.last_atime = max(diff.delta.last_atime, prev_delta.last_atime)
             diff.delta.last_ctime = max(diff.delta.last_ctime, prev_delta.last_ctime)
 
@@ -467,21 +539,186 @@ def insert_deltas(history):
         visit_diff(diff_delta, todo)
 
 
-def activity_result(history):
-    predicates = defaultdict(lambda: DataPoint("", 0,0,0))
-    for a in history.assertions():
-        dp = predicates[remove_whitespace(a.predicate)] # why is this done?
-        dp.x_val = a.predicate
-        if a.change == Change.added:
-            dp.y_added += 1
-            dp.y_combined += 1
-        elif a.change == Change.removed:
-            dp.y_removed += 1
-            dp.y_combined += 1
+CHANGE_BITS = {change: 1 << i for i, change in enumerate(Change)}
+
+class CommitGraph():
+    """The commit DAG of a History, with commits numbered in its order, as
+    arrays: CSR-style parents and children (the commits of i are
+    parents[parents_ptr[i]:parents_ptr[i+1]], in the Diff's order), author and
+    commit times in seconds, and per commit whether has_good_assert, and
+    whether it has (confirmed) assertions of each Change.
+    compute_deltas traverses it as insert_deltas does, into arrays instead of
+    Deltas. Durations are in seconds; NONE marks a commit without a result.
+    If given, :visit: is applied to each File of a History, in order, while
+    it is read, so that other statistics can be computed in the same pass.
+    """
+    NONE = sys.maxsize
+
+    def __init__(self, history, visit=None):
+        if isinstance(history, ColumnarHistory):
+            self._from_columns(history)
         else:
-            logging.warning("{c} found while calculating Activity for {a}"
-                    .format(c=a.change, a=a.info()))
+            self._from_history(history, visit)
+        self.commit_dist = None     # set by compute_deltas
+        self.atime_dur = None
+        self.ctime_dur = None
+        self.num_visits = None
+
+    def __len__(self):
+        return len(self.atime)
+
+    def _from_history(self, history, visit=None):
+        index = {d.rvn_id: i for i, d in enumerate(history.diffs)}
+        parents, children = array("q"), array("q")
+        parents_ptr, children_ptr = array("q", [0]), array("q", [0])
+        atime, ctime = array("q"), array("q")
+        has_assert, changes = array("b"), array("b")  # (a bit per Change)
+        for diff in history.diffs:
+            parents.extend([index.get(p, -1) for p in diff.parents])
+            parents_ptr.append(len(parents))
+            children.extend([index[c] for c in diff.children])
+            children_ptr.append(len(children))
+            atime.append(diff.author_time[0])
+            ctime.append(diff.commit_time[0])
+            if diff.files:
+                if visit is not None:
+                    for file in diff.files:
+                        visit(file)
+                has_assert.append(has_good_assert(diff))
+                changes.append(sum({CHANGE_BITS[a.change] for f in diff.files
+                    for a in f.assertions}))
+            else:
+                has_assert.append(False)
+                changes.append(0)
+
+        self.parents = np.frombuffer(parents, dtype=np.int64)
+        self.parents_ptr = np.frombuffer(parents_ptr, dtype=np.int64)
+        self.children = np.frombuffer(children, dtype=np.int64)
+        self.children_ptr = np.frombuffer(children_ptr, dtype=np.int64)
+        self.atime = np.frombuffer(atime, dtype=np.int64)
+        self.ctime = np.frombuffer(ctime, dtype=np.int64)
+        self.has_assert = np.frombuffer(has_assert, dtype=np.bool_)
+        changes = np.frombuffer(changes, dtype=np.int8)
+        self.has_change = {change: (changes & bit) != 0
+                for change, bit in CHANGE_BITS.items()}
+
+    def _from_columns(self, columns):
+        self.parents = np.asarray(columns.commit_parents, dtype=np.int64)
+        self.parents_ptr = np.asarray(columns.commit_parents_ptr)
+        self.children = np.asarray(columns.commit_children, dtype=np.int64)
+        self.children_ptr = np.asarray(columns.commit_children_ptr)
+        atimes, ctimes = commit_times(columns)
+        self.atime = atimes[:, 0]
+        self.ctime = ctimes[:, 0]
+
+        n = len(columns)
+        confirmed = ~np.asarray(columns.inspect)
+        file_commit = columns.file_commit[columns.assertion_file[confirmed]]
+        good_files = ~columns.file_name_mask("test")
+        good = good_files[columns.assertion_file[confirmed]]
+        self.has_assert = np.bincount(file_commit[good], minlength=n) > 0
+        change = np.asarray(columns.change)[confirmed]
+        self.has_change = {c: np.bincount(file_commit[change == CHANGES.index(c)],
+                    minlength=n) > 0 for c in Change}
+
+    def compute_deltas(self):
+        """As insert_deltas, from the commits without parents (in reverse
+        order, as a stack) through their children. (A non-first visit of a
+        commit with assertions, which doesn't occur as merges have none, takes
+        the minimums of its distances and durations.)
+        """
+        NONE = CommitGraph.NONE
+        n = len(self)
+        parents_ptr = array("q", self.parents_ptr.tobytes())
+        children = array("q", self.children.tobytes())
+        children_ptr = array("q", self.children_ptr.tobytes())
+        atime = array("q", self.atime.tobytes())
+        ctime = array("q", self.ctime.tobytes())
+        has_assert = array("b", self.has_assert.tobytes())
+
+        UNVISITED = -1
+        num_commits = array("q", [UNVISITED]) * n
+        last_atime = array("q", [MIN_TIME[0]]) * n
+        last_ctime = array("q", [MIN_TIME[0]]) * n
+        commit_dist = array("q", [NONE]) * n
+        atime_dur = array("q", [NONE]) * n
+        ctime_dur = array("q", [NONE]) * n
+        num_visits = array("q", [0]) * n
+
+        todo = [(i, NONE, MIN_TIME[0], MIN_TIME[0]) for i in range(n)
+                if parents_ptr[i] == parents_ptr[i+1]]
+        while todo:
+            i, prev_commits, prev_atime, prev_ctime = todo.pop()
+            seen_assert = prev_commits != NONE
+
+            if num_commits[i] == UNVISITED:
+                if has_assert[i]:
+                    num_commits[i] = 0
+                    last_atime[i] = atime[i]
+                    last_ctime[i] = ctime[i]
+                    if seen_assert:
+                        commit_dist[i] = prev_commits + 1
+                        atime_dur[i] = atime[i] - prev_atime
+                        ctime_dur[i] = ctime[i] - prev_ctime
+                elif seen_assert:
+                    num_commits[i] = prev_commits + 1
+                    last_atime[i] = prev_atime
+                    last_ctime[i] = prev_ctime
+                else:
+                    num_commits[i] = NONE
+
+            elif seen_assert and has_assert[i]:
+                commit_dist[i] = min(commit_dist[i], prev_commits + 1)
+                atime_dur[i] = min(atime_dur[i], atime[i] - prev_atime)
+                ctime_dur[i] = min(ctime_dur[i], ctime[i] - prev_ctime)
+
+            elif seen_assert:
+                num_commits[i] = min(num_commits[i], prev_commits + 1)
+                last_atime[i] = max(last_atime[i], prev_atime)
+                last_ctime[i] = max(last_ctime[i], prev_ctime)
+
+            num_visits[i] += 1
+            if num_visits[i] >= parents_ptr[i+1] - parents_ptr[i]:
+                todo.extend((c, num_commits[i], last_atime[i], last_ctime[i])
+                        for c in children[children_ptr[i]:children_ptr[i+1]])
+
+        self.commit_dist = np.frombuffer(commit_dist, dtype=np.int64)
+        self.atime_dur = np.frombuffer(atime_dur, dtype=np.int64)
+        self.ctime_dur = np.frombuffer(ctime_dur, dtype=np.int64)
+        self.num_visits = np.frombuffer(num_visits, dtype=np.int64)
+
+    def delta_counts(self, change=None):
+        """As delta_counts, after compute_deltas"""
+        selected = self.has_change[change] if change is not None else \
+                np.logical_or.reduce(list(self.has_change.values()))
+        selected = selected & (self.commit_dist < CommitGraph.NONE)
+
+        return (Counter(self.commit_dist[selected].tolist()),
+                Counter(duration_days(self.atime_dur[selected]).tolist()),
+                Counter(duration_days(self.ctime_dur[selected]).tolist()))
+
+    def linearity_score(self):
+        """As linearity_score, after compute_deltas"""
+        num_merges = int(np.count_nonzero(self.num_visits > 1))
+        return 1 - (num_merges/max(len(self), 1))
+
+    def monotonicity_score(self):
+        """As monotonicity_score"""
+        return 1 - (out_of_orders(self.atime)/max(len(self) - 1, 1))
+
+
+def activity_result(history, key=remove_whitespace):
+    """:key:    (string -> key) predicates with the same key are grouped, e.g.
+                clusters.PredicateClusters.key for near-duplicates
+    """
+    if isinstance(history, ColumnarHistory):
+        predicates = column_datapoints(history, history.predicate,
+                key=key, what="Activity")
+    else:
+        predicates = activity_datapoints(history, key)
+    return activity_datapoints_result(history, predicates)
 
+def activity_datapoints_result(history, predicates):
     return Result(history.repo_path,
             predicates.values(),
             "Number of assertion events for each predicate, by text comparison",
@@ -490,21 +727,21 @@ def activity_result(history):
             sort=lambda dp: dp.y_combined,
             tail=Result.Tail.Avg)
 
-def names_result(history):
-    names = defaultdict(lambda: DataPoint("", 0,0,0))
+def activity_datapoints(history, key=remove_whitespace):
+    predicates = defaultdict(lambda: DataPoint("", 0,0,0))
     for a in history.assertions():
-        dp = names[a.name]
-        dp.x_val = a.name
-        if a.change == Change.added:
-            dp.y_added += 1
-            dp.y_combined += 1
-        elif a.change == Change.removed:
-            dp.y_removed += 1
-            dp.y_combined += 1
-        else:
-            logging.warning("{c} found while calculating Names for {a}"
-                    .format(c=a.change, a=a.info()))
+        # why is this done?
+        count_event(predicates, key(a.predicate), a.predicate, a, "Activity")
+    return predicates
+
+def names_result(history):
+    if isinstance(history, ColumnarHistory):
+        names = column_datapoints(history, history.name, what="Names")
+    else:
+        names = names_datapoints(history)
+    return names_datapoints_result(history, names)
 
+def names_datapoints_result(history, names):
     return Result(history.repo_path,
             names.values(),
             "Number of assertion events for each assert-function-name",
@@ -513,6 +750,209 @@ def names_result(history):
             sort=lambda dp: dp.y_combined,
             tail=Result.Tail.Avg)
 
+def names_datapoints(history):
+    names = defaultdict(lambda: DataPoint("", 0,0,0))
+    for a in history.assertions():
+        count_event(names, a.name, a.name, a, "Names")
+    return names
+
+def count_event(datapoints, key, x_val, a, what):
+    """Counts the change of assertion :a: in the DataPoint of :key:"""
+    dp = datapoints[key]
+    dp.x_val = x_val
+    if a.change == Change.added:
+        dp.y_added += 1
+        dp.y_combined += 1
+    elif a.change == Change.removed:
+        dp.y_removed += 1
+        dp.y_combined += 1
+    else:
+        logging.warning("{c} found while calculating {w} for {a}"
+                .format(c=a.change, w=what, a=a.info()))
+
+def column_datapoints(columns, codes, key=None, what=""):
+    """Like activity_datapoints and names_datapoints, but computed from the
+    columns of a ColumnarHistory: one DataPoint per distinct key of the given
+    string :codes: (of the assertions of History.assertions()), by key, in
+    order of first occurrence, with the last string of each key as its x_val.
+    :key:   (string -> key) distinct strings with the same key are grouped;
+            otherwise the key is the string
+    """
+    rows = np.flatnonzero(columns.assertion_mask())
+    codes = np.asarray(codes[rows])
+    change = np.asarray(columns.change[rows])
+
+    for row in rows[change == CHANGES.index(Change.none)]:
+        logging.warning("{c} found while calculating {w} for {a}".format(
+            c=Change.none, w=what, a=columns.assertion(row).info()))
+
+    uniques, inverse = np.unique(codes, return_inverse=True)
+    if key is not None:
+        keys = {}
+        groups = np.array([keys.setdefault(key(columns.string(c)), len(keys))
+            for c in uniques.tolist()], dtype=np.int64)
+        inverse = groups[inverse]
+        keys = list(keys)
+    else:
+        keys = [columns.string(c) for c in uniques.tolist()]
+
+    group_ids, first, inverse = np.unique(inverse, return_index=True,
+            return_inverse=True)
+    last = np.zeros(len(group_ids), dtype=np.int64)
+    np.maximum.at(last, inverse, np.arange(len(codes)))
+    added = np.bincount(inverse, change == CHANGES.index(Change.added),
+            len(group_ids)).astype(np.int64)
+    removed = np.bincount(inverse, change == CHANGES.index(Change.removed),
+            len(group_ids)).astype(np.int64)
+
+    datapoints = OrderedDict()
+    for g in np.argsort(first, kind="stable").tolist():
+        datapoints[keys[group_ids[g]]] = DataPoint(columns.string(codes[last[g]]),
+                int(added[g]), int(removed[g]), int(added[g] + removed[g]))
+    return datapoints
+
+
+class Summary():
+    """The counts of the assertion events of a History, by name and by
+    predicate (as names_datapoints and activity_datapoints), without the
+    History. Summaries pickle, and merge (as if the assertions of the other
+    followed), so that those of many repos, made in parallel, can be reduced
+    to the counts of all of them, and their Results.
+    """
+    def __init__(self, history=None, repo_path=""):
+        self.repo_path = repo_path   # (the Results' id)
+        self.repos = []
+        self.names = OrderedDict()       # name -> DataPoint
+        self.predicates = OrderedDict()  # predicate sans whitespace -> DataPoint
+        if history is not None:
+            self.repo_path = repo_path or history.repo_path
+            self.repos.append(history.repo_path)
+            if isinstance(history, ColumnarHistory):
+                self.names = column_datapoints(history, history.name,
+                        what="Names")
+                self.predicates = column_datapoints(history, history.predicate,
+                        key=remove_whitespace, what="Activity")
+            else:
+                self.names = OrderedDict(names_datapoints(history))
+                self.predicates = OrderedDict(activity_datapoints(history))
+
+    def __repr__(self):
+        return "Summary('{r}', <{n} repos> <{nn} names> <{np} predicates>)" \
+                .format(r=self.repo_path, n=len(self.repos),
+                        nn=len(self.names), np=len(self.predicates))
+
+    def merge(self, other):
+        """Adds the counts of :other: Summary to these"""
+        self.repos.extend(other.repos)
+        merge_datapoints(self.names, other.names)
+        merge_datapoints(self.predicates, other.predicates)
+        return self
+
+    def __add__(self, other):
+        return Summary(repo_path=self.repo_path).merge(self).merge(other)
+
+    def names_result(self):
+        return names_datapoints_result(self, self.names)
+
+    def activity_result(self):
+        return activity_datapoints_result(self, self.predicates)
+
+class ApproximateSummary():
+    """Like a Summary, but in constant memory, however many repos are merged
+    into it: only the (approximately) most frequent names and predicates are
+    counted (by sketches.HeavyHitters, with :error:), and the distinct ones
+    are estimated (by sketches.HyperLogLog, with :distinct_error:). Its
+    Results have their datapoints, and the sums of the rest, for graphing
+    (e.g. the top 25 predicates of a whole corpus).
+    """
+    def __init__(self, summary=None, error=0.001, distinct_error=0.01,
+            repo_path=""):
+        self.repo_path = repo_path
+        self.repos = []
+        self.names = sketches.HeavyHitters(error)
+        self.predicates = sketches.HeavyHitters(error)
+        self.distinct_names = sketches.HyperLogLog(distinct_error)
+        self.distinct_predicates = sketches.HyperLogLog(distinct_error)
+        self.names_total = DataPoint("", 0,0,0)
+        self.predicates_total = DataPoint("", 0,0,0)
+        if summary is not None:
+            self.add(summary)
+
+    def __repr__(self):
+        return "ApproximateSummary('{r}', <{n} repos> <~{nn} names> " \
+                "<~{np} predicates>)".format(r=self.repo_path,
+                        n=len(self.repos), nn=len(self.distinct_names),
+                        np=len(self.distinct_predicates))
+
+    def add(self, summary):
+        """Adds the counts of the (exact) :summary:, of a History"""
+        self.repo_path = self.repo_path or summary.repo_path
+        self.repos.extend(summary.repos)
+        for datapoints, sketch, distinct in [
+                (summary.names, self.names, self.distinct_names),
+                (summary.predicates, self.predicates, self.distinct_predicates)]:
+            for key, dp in datapoints.items():
+                sketch.add(key, dp.y_combined, dp.x_val,
+                        (dp.y_added, dp.y_removed))
+            distinct.add(datapoints.keys())
+        self.names_total = sum_datapoints([self.names_total,
+            *summary.names.values()])
+        self.predicates_total = sum_datapoints([self.predicates_total,
+            *summary.predicates.values()])
+        return self
+
+    def merge(self, other):
+        """Adds the counts of :other: ApproximateSummary to these"""
+        self.repos.extend(other.repos)
+        self.names.merge(other.names)
+        self.predicates.merge(other.predicates)
+        self.distinct_names.merge(other.distinct_names)
+        self.distinct_predicates.merge(other.distinct_predicates)
+        self.names_total = sum_datapoints([self.names_total,
+            other.names_total])
+        self.predicates_total = sum_datapoints([self.predicates_total,
+            other.predicates_total])
+        return self
+
+    def names_result(self, k=None):
+        """The names_result of (at most) the :k: most frequent names"""
+        return self._result(names_datapoints_result, self.names,
+                self.distinct_names, self.names_total, k)
+
+    def activity_result(self, k=None):
+        """The activity_result of (at most) the :k: most active predicates"""
+        return self._result(activity_datapoints_result, self.predicates,
+                self.distinct_predicates, self.predicates_total, k)
+
+    def _result(self, datapoints_result, sketch, distinct, total, k):
+        datapoints = OrderedDict((key, DataPoint(value, added, removed,
+            added + removed)) for key, _, value, (added, removed)
+                in sketch.top(k))
+        result = datapoints_result(self, datapoints)
+        listed = sum_datapoints(datapoints.values())
+        result.rest = (max(len(distinct) - len(datapoints), 0), DataPoint("",
+            total.y_added - listed.y_added, total.y_removed - listed.y_removed,
+            total.y_combined - listed.y_combined))
+        return result
+
+def sum_datapoints(datapoints):
+    return DataPoint("", sum(dp.y_added for dp in datapoints),
+            sum(dp.y_removed for dp in datapoints),
+            sum(dp.y_combined for dp in datapoints))
+
+def merge_datapoints(datapoints, other):
+    """Adds the DataPoints of :other: to those of :datapoints:, by key"""
+    for key, dp in other.items():
+        mine = datapoints.get(key)
+        if mine is None:
+            datapoints[key] = DataPoint(*dp)
+        else:
+            mine.x_val = dp.x_val
+            mine.y_added += dp.y_added
+            mine.y_removed += dp.y_removed
+            mine.y_combined += dp.y_combined
+    return datapoints
+
 
 # def function_result(history):
     # # This isn't useful due to inaccuracy of functinon_name
@@ -540,24 +980,68 @@ def names_result(history):
 
 Problematic = namedtuple("Problematic", ["commit_id", "problem", "file", "line", "change", "name", "code"])
 def problematics(history, save=None):
-    problematics = []
-    for a in history.assertions(confirmed=False, problematic=True):
-        problematics.append(Problematic(
+    problematics = [problematic(a) for a in
+            history.assertions(confirmed=False, problematic=True)]
+
+    if save:
+        save_problematics(problematics, save)
+    else:
+        return problematics
+
+def problematic(a):
+    return Problematic(
             commit_id   = a.parent_file.parent_diff.rvn_id,
             problem     = a.problem,
             file        = a.parent_file.name,
             line        = a.file_lineno,
             change      = a.change.prefix,
             name        = a.name,
-            code        = "".join(a.raw_lines).rstrip("\n")))
+            code        = "".join(a.raw_lines).rstrip("\n"))
 
-    if save:
-        with open(save+"problematics.csv", 'w', newline='') as file:
-            writer = Csv.writer(file, quoting=Csv.QUOTE_MINIMAL)
-            writer.writerow(Problematic._fields)
-            writer.writerows(problematics)
+def save_problematics(problematics, save):
+    with open(save+"problematics.csv", 'w', newline='') as file:
+        writer = Csv.writer(file, quoting=Csv.QUOTE_MINIMAL)
+        writer.writerow(Problematic._fields)
+        writer.writerows(problematics)
+
+
+def all_results(history, moves=True):
+    """Produces, in a single pass over the history, the Results of
+    names_result, activity_result and delta_results (by the names walk_repos
+    saves them under), the linearity and monotonicity scores, and the
+    problematics. Unless :moves:, moved assertions are excluded (see
+    without_moves).
+    """
+    if not moves:
+        history = without_moves(history)
+    if isinstance(history, ColumnarHistory):
+        names = column_datapoints(history, history.name, what="Names")
+        predicates = column_datapoints(history, history.predicate,
+                key=remove_whitespace, what="Activity")
+        problems = problematics(history)
+        graph = CommitGraph(history)
     else:
-        return problematics
+        names = defaultdict(lambda: DataPoint("", 0,0,0))
+        predicates = defaultdict(lambda: DataPoint("", 0,0,0))
+        problems = []
+        def visit(file):
+            # (as the History.assertions filters)
+            if "test" in file.name.lower():
+                return
+            for a in file.assertions:
+                count_event(names, a.name, a.name, a, "Names")
+                count_event(predicates, remove_whitespace(a.predicate),
+                        a.predicate, a, "Activity")
+            problems.extend(problematic(a) for a in file.to_inspect)
+        graph = CommitGraph(history, visit)
+
+    results = OrderedDict()
+    results["names"] = names_datapoints_result(history, names)
+    results["activity"] = activity_datapoints_result(history, predicates)
+    (results["distance-commit"], results["duration-author-time"],
+            results["duration-commit-time"]), scores = \
+            graph_delta_results(history, graph)
+    return results, scores, problems
 
 ################################################################################
 # Review
@@ -571,27 +1055,94 @@ def pickaxe_history(old_history):
     mass moves, albeit this is just an approxiate lower bound on assertions events.
     Named after the git pickaxe tool. (Ideally, this could identify moved
     assertions, but that's too hard.)
-    Returns a new History; doesn't change the original.
-    (This hasn't been properly tested.)
+    Returns a HistoryView of the original, which is shared, not copied.
     """
-    history = deepcopy(old_history)
-    for d in history.diffs:
-        for f in d.files:
-            f.assertions = pickaxe_assertions(f.assertions)
-    return history
+    return HistoryView(old_history, pickaxe_assertions)
 
 
 def pickaxe_assertions(assertions):
-    """Produces identical list of assertions, or an empty list in the case
-    of equal adds and removes for each name(predicate) assertions.
+    """Produces identical list of assertions, except without those of each
+    name(predicate) with equal adds and removes.
     """
-    result = []
-    np_asserts = groupby(assertions, key=lambda a: (a.name, a.predicate))
-    for _, asserts in np_asserts:
+    np_asserts = defaultdict(list)
+    for a in assertions:
+        np_asserts[(a.name, a.predicate)].append(a)
+
+    balanced = set()
+    for key, asserts in np_asserts.items():
         adds, rems = add_rem_separate(asserts)
-        if len(adds) != len(rems):
-            result.extend(asserts)
-    return result
+        if len(adds) == len(rems):
+            balanced.add(key)
+    return [a for a in assertions if (a.name, a.predicate) not in balanced]
+
+
+def diff_moves(diff):
+    """Produces the moves of assertions in :diff: between its files, as pairs
+    of the (file, index) of a removed assertion and of an added one, in
+    another file, with the same name and predicate (sans whitespace). Each
+    removed assertion is matched to (at most) one added, in order, by a hash
+    join. (Equal adds and removes within a file are pickaxe_assertions'.)
+    """
+    removed = defaultdict(OrderedDict)  # (name, predicate) -> name -> deque
+    for file in diff.files:
+        for i, a in enumerate(file.assertions):
+            if a.change == Change.removed:
+                key = (a.name, remove_whitespace(a.predicate))
+                files = removed[key]
+                if file.name not in files:
+                    files[file.name] = deque()
+                files[file.name].append((file, i))
+    if not removed:
+        return []
+
+    moves = []
+    for file in diff.files:
+        for i, a in enumerate(file.assertions):
+            if a.change != Change.added:
+                continue
+            files = removed.get((a.name, remove_whitespace(a.predicate)))
+            if not files:
+                continue
+            # (files are dropped once matched, so at most this one is skipped)
+            for name, rems in files.items():
+                if name != file.name:
+                    moves.append((rems.popleft(), (file, i)))
+                    if not rems:
+                        del files[name]
+                    break
+    return moves
+
+
+def moved_assertions(history):
+    """Produces the indices of the moved assertions (see diff_moves) of each
+    file of :history:, by (commit id, file name)
+    """
+    moved = defaultdict(set)
+    for diff in history.diffs:
+        for move in diff_moves(diff):
+            for file, i in move:
+                moved[(diff.rvn_id, file.name)].add(i)
+    return moved
+
+
+def without_moves(history):
+    """Produces a HistoryView of :history: without its moved assertions. The
+    moves are flagged on the view rather than on each Assertion, as its
+    :moved: (see moved_assertions), indices into the files of :history:.
+    """
+    moved = moved_assertions(history)
+
+    def unmoved(assertions):
+        if not assertions:
+            return assertions
+        file = assertions[0].parent_file
+        indices = moved.get((file.parent_diff.rvn_id, file.name))
+        if indices is None:
+            return assertions
+        return [a for i, a in enumerate(assertions) if i not in indices]
+    view = HistoryView(history, unmoved)
+    view.moved = moved
+    return view
 
 
 def add_rem_separate(asserts):
@@ -614,8 +1165,16 @@ def _next_iter(it):
 
 
 def load_history(filename):
+    """Loads a pickled History, or one streamed by assertions.dump_stream, or
+    a columnar one (a directory, see columnar.save_columns)
+    """
+    if os.path.isdir(filename):
+        return ColumnarHistory(filename)
     with open(filename, 'rb') as f:
-        return pickle.load(f)
+        history = pickle.load(f)
+        if isinstance(history, StreamHeader):
+            history = read_stream(history, f)
+        return history
 
 
 _CEXTS = ".*\.[ch]$"
@@ -25,17 +25,31 @@
 
 
 import re
+import os
+import shutil
+import subprocess
+import string
+import fnmatch
+import pickle
 import logging
 import itertools
+import multiprocessing
+import multiprocessing.util
 import traceback
 import sys
 from enum import Enum
-from collections import namedtuple, defaultdict, OrderedDict
+from collections import namedtuple, OrderedDict
 
 import pygit2
 import pycparser
 
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError: # before Python 3.11
+    import sre_parse, sre_constants
+
 import predast
+import profiling
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -53,15 +67,61 @@ FILE_EXTENSIONS = ["c", "h", "cc", "cpp", "c++", "cp", "cxx",
 (We filter them out later, if necessary.)
 """
 
+PATHSPEC = None
+"""If set, a list of fnmatch patterns; only the files whose paths match one
+are diffed. E.g. ["src/*", "include/*"]
+"""
+
+MAX_FILE_SIZE = None
+"""If set, files larger than this (in bytes) before or after a commit are not
+diffed. Mostly for excluding huge generated sources.
+"""
+
 MORE = False
 DONE = True
 
+CHECKPOINT_INTERVAL = 1000
+"""Newly mined commits between the checkpoints of mine_repo."""
+
+FUNCLINE_STARTS = set(string.ascii_letters + "_$")
+"""A line starting with one of these may be the function context of a hunk."""
+
+FUNCLINE_LEN = 80
+"""Max bytes of a function-context line git includes in a hunk header."""
+
+MAX_CHUNKSIZE = 64
+"""Most commits handed to a mining worker process at a time."""
+
 
 ################################################################################
 # Data Definitions
 ################################################################################
 
 
+class Compact():
+    """Base of the data definitions, which keep their attributes in __slots__
+    rather than a __dict__ per instance, since a History may hold millions.
+    They pickle as a dict of their attributes, like before, so Histories
+    pickled before they had __slots__ load as well.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
+# string -> string
+def intern(string):
+    """The same strings (file and function names, predicates, authors, ...)
+    recur throughout a History; keep one copy of each. Pickles share it too.
+    """
+    return sys.intern(string) if string else string
+
+
 class Source():
     """Represents all the assertions in the source files of a given revision,
     organized into files.
@@ -72,13 +132,15 @@ class Source():
         self.files = []
 
 
-class File():
+class File(Compact):
     """A container for relevant and questionable assertions in a given file.
     If :diff: is included, it is its parent Diff from a repository mining.
     """
+    __slots__ = ("name", "assertions", "to_inspect", "parent_diff")
+
     # string (Diff) -> File
     def __init__(self, name, parent_diff=None):
-        self.name = name
+        self.name = intern(name)
         self.assertions = []    # [Assertion]
         self.to_inspect = []    # [Assertion] for difficult-to-parse asserts
         self.parent_diff = parent_diff
@@ -107,6 +169,9 @@ class History():
     def get_diff(self, commit_id):
         return self._diffs.get(commit_id, Diff(commit_id=commit_id))
 
+    def __contains__(self, commit_id):
+        return commit_id in self._diffs
+
     def update_diff(self, diff):
         old_diff = self.get_diff(diff.rvn_id)
         if diff.rvn_id != old_diff.rvn_id:
@@ -166,42 +231,149 @@ class History():
                     if change is not None:
                         assertions = (a for a in assertions if a.change == change)
                     if filterfun is not None:
-                        assertions = (a for a in assertions if custom(a))
+                        assertions = (a for a in assertions if filterfun(a))
 
                     for a in assertions:
                         yield a
 
 
-class Diff():
+class HistoryView():
+    """A History (or ColumnarHistory) whose files' assertions are filtered by
+    :assertion_filter: ([Assertion] -> [Assertion]), applied lazily to each
+    File's assertions as they are read. Nothing is copied: its Diffs, Files and
+    Assertions are views of those of :history:, which is left unchanged, so
+    it can be read wherever a History can (but not updated).
+    """
+    def __init__(self, history, assertion_filter):
+        self.history = history
+        self.repo_path = history.repo_path
+        self.branch = history.branch
+        self.assertion_filter = assertion_filter
+        self._diffs = None
+
+    def __repr__(self):
+        return "HistoryView({h!r}, {f})".format(h=self.history,
+                f=getattr(self.assertion_filter, "__name__",
+                    self.assertion_filter))
+
+    @property
+    def diffs(self):
+        return self._diff_views().values()
+
+    def get_diff(self, commit_id):
+        return self._diff_views().get(commit_id, Diff(commit_id=commit_id))
+
+    def _diff_views(self):
+        if self._diffs is None:
+            self._diffs = OrderedDict((d.rvn_id, DiffView(d, self.assertion_filter))
+                    for d in self.history.diffs)
+        return self._diffs
+
+    def __contains__(self, commit_id):
+        return commit_id in self.history
+
+    __iter__ = History.__iter__
+    show = History.show
+    assertions = History.assertions
+
+
+class DiffView():
+    """A Diff of a HistoryView, with its own (unset) delta"""
+    __slots__ = ("diff", "assertion_filter", "delta")
+
+    def __init__(self, diff, assertion_filter):
+        self.diff = diff
+        self.assertion_filter = assertion_filter
+
+    @property
+    def files(self):
+        return [FileView(f, self.assertion_filter) for f in self.diff.files]
+
+    def __getattr__(self, name):
+        if name in DiffView.__slots__ or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.diff, name)
+
+    def __repr__(self):
+        return "DiffView({d!r})".format(d=self.diff)
+
+
+class FileView():
+    """A File of a HistoryView"""
+    __slots__ = ("file", "assertion_filter")
+
+    def __init__(self, file, assertion_filter):
+        self.file = file
+        self.assertion_filter = assertion_filter
+
+    @property
+    def assertions(self):
+        return self.assertion_filter(self.file.assertions)
+
+    def __getattr__(self, name):
+        if name in FileView.__slots__ or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.file, name)
+
+    def __repr__(self):
+        return "FileView({f!r})".format(f=self.file)
+
+
+class Diff(Compact):
     """The files that had assertion changes in between adjacent revisions, as
     well as the IDs of those revisions. Diff with at most ONE other commit.
+    The commit message isn't stored, but read from :repo_path: when needed
+    (None if it's gone, e.g. when analyzing elsewhere).
     """
-    # pygit2.Commit -> Diff
-    def __init__(self, commit=None, commit_id=None):
+    __slots__ = ("parents", "children", "files", "rvn_id", "author",
+            "commit_time", "author_time", "repo_path", "_msg", "delta")
+
+    # pygit2.Commit [string] -> Diff
+    def __init__(self, commit=None, commit_id=None, repo_path=None):
         """Must have either pygit2.commit or commit_id string"""
         self.parents = []       # commit_ids of parents (earlier)
         self.children = []      # commit_ids of children (later)
         self.files = []     # using filenames of newest revision
+        self.repo_path = intern(repo_path)
+        self._msg = None
 
         if commit:
             self.rvn_id = commit.hex    # newer revision (commit) "hex string"
-            self.author = commit.author.name
+            self.author = intern(commit.author.name)
             self.commit_time = (commit.commit_time, commit.commit_time_offset)
 
             author = commit.author
             self.author_time = (author.time, author.offset)
-            self.msg = commit.message
+            if repo_path is None:
+                self._msg = commit.message
 
         else:
             self.rvn_id = commit_id
 
+    @property
+    def msg(self):
+        if self._msg is None and self.repo_path is not None:
+            try:
+                return open_repository(self.repo_path)[self.rvn_id].message
+            except (KeyError, ValueError, pygit2.GitError):
+                return None
+        return self._msg
+    @msg.setter
+    def msg(self, m):
+        self._msg = m
+
+    def __setstate__(self, state):
+        # (Diffs pickled before __slots__ have neither)
+        self.repo_path = self._msg = None
+        super().__setstate__(state)
+
     def __str__(self):
         return "Diff: {id}".format(id=self.rvn_id)
 
     def __repr__(self):
         return "Diff('{id}', '{auth}', '{m}', <{f} files>)".format(
                 id=self.rvn_id[:7], auth=self.author[:20],
-                m=self.msg[:30].strip(), f=len(self.files))
+                m=(self.msg or "")[:30].strip(), f=len(self.files))
 
 
 class Change(Enum):
@@ -220,14 +392,21 @@ class Change(Enum):
         self.anti_prefix = anti_prefix
 
 
-class Assertion():
+class Assertion(Compact):
     """The location and size within a file of an assertion expression. As well
     as its original parsed string, and a basic abstract syntax tree
     representation for performing basic analysis and comparison operations.
     If :parent_file: exists, it points back to the File this was found in.
     :hunk_lineno: is included to help detect changed assertions, since they
     will likely be nearby.
+    Only problematic assertions keep their original lines of code; the
+    raw_lines of the others are name(predicate).
     """
+    __slots__ = ("file_lineno", "hunk_lineno", "hunkno", "num_lines",
+            "_raw_lines", "name", "predicate", "change", "change_lineno",
+            "problematic", "unparseable", "problem", "parent_file", "ast",
+            "function_name")
+
     # int int int int [string] string string Change -> Assertion
     def __init__(self, hunkno, lineno, hunk_lineno, num_lines, raw_lines, name, predicate,
             change=Change.none, change_lineno=0, problematic=False, problem="",
@@ -236,14 +415,15 @@ class Assertion():
         self.hunk_lineno = hunk_lineno  # index into Hunk where it was found
         self.hunkno = hunkno                # index of Hunk where found
         self.num_lines = num_lines
-        self.raw_lines = raw_lines          # original lines of code of assert
-        self.name = name                    # assert function name
-        self.predicate = reduce_whitespace(predicate) # just pred string
+        self._raw_lines = raw_lines if problematic else None
+                                            # original lines of code of assert
+        self.name = intern(name)            # assert function name
+        self.predicate = intern(reduce_whitespace(predicate)) # just pred string
         self.change = change
         self.change_lineno = change_lineno  # file_lineno for changed line in assertion
         self.problematic = problematic      # True if needs manual inspection
         self.unparseable = False            # an error occurred when parsing
-        self.problem = problem              # If problematic, this is the reason
+        self.problem = intern(problem)      # If problematic, this is the reason
         self.parent_file = parent_file
         self.ast = None # predast.AST
         self.function_name = ""               # C function-name where embedded
@@ -251,6 +431,15 @@ class Assertion():
                                             # only works when small change
                                             #   within preexisting function
 
+    @property
+    def raw_lines(self):
+        if self._raw_lines is None:
+            return [str(self)]
+        return self._raw_lines
+    @raw_lines.setter
+    def raw_lines(self, lines):
+        self._raw_lines = lines
+
     def __str__(self):
         return "{name}({pred})".format(name=self.name, pred=self.predicate)
 
@@ -292,88 +481,283 @@ def reduce_spaces(string):
 # Repo mining
 ################################################################################
 
-# string string string -> History
-def mine_repo(assertion_re, repo_path, branch):
+# string string string [int History string predast.ASTCache profiling.Profile]
+#   -> History
+def mine_repo(assertion_re, repo_path, branch, processes=1, history=None,
+        checkpoint=None, ast_cache=None, profile=None):
     """Given the path to a Git repository and the name of any assertions used
     in this project, produces the History object containing all assertions
     that were added or removed between revisions, for the specified branch.
+    :processes: number of worker processes diffing commits, then parsing
+        predicates. The History produced is identical to that of the serial
+        walk (processes=1).
+    :history:   a History previously mined from this repository. Only the
+        commits missing from it are mined, and it is extended in place.
+    :checkpoint: if given, the History is saved under this filename every
+        CHECKPOINT_INTERVAL newly mined commits, so that an interrupted run
+        can be resumed by passing the saved History back in.
+    :ast_cache: reuses the ASTs of predicates parsed before (e.g. in other
+        runs, if it is persistent). By default, they are only reused within
+        this run.
+    :profile:   if given, the time of each phase of mining, and counts of the
+        commits, hunks, assertions etc. mined, are added to it (see
+        profiling.Profile)
     """
+    profile = profile if profile is not None else profiling.NULL
+    with profile.phase("mine_repo"):
+        return _mine_repo(assertion_re, repo_path, branch, processes, history,
+                checkpoint, ast_cache, profile)
+
+def _mine_repo(assertion_re, repo_path, branch, processes, history,
+        checkpoint, ast_cache, profile):
+    if history is None:
+        history = History(repo_path, branch)
+    if ast_cache is None:
+        ast_cache = predast.ASTCache()
+    parser = pycparser.c_parser.CParser()
 
-    history = History(repo_path, branch)
-    repo = pygit2.Repository(repo_path)
-    for commit in repo.walk(repo.lookup_branch(branch).target, pygit2.GIT_SORT_REVERSE | pygit2.GIT_SORT_TOPOLOGICAL):
-        logging.info("Processing " + commit.hex)
-        diff = generate_diff(commit, repo, assertion_re)
+    new_diffs = []
+    for diff in mine_diffs(assertion_re, repo_path, branch, processes,
+            skip=history, profile=profile):
         history.update_diff(diff)
+        new_diffs.append(diff)
+        if checkpoint and len(new_diffs) >= CHECKPOINT_INTERVAL:
+            complete_diffs(history, new_diffs, parser, ast_cache, processes,
+                    profile)
+            with profile.phase("checkpoint"):
+                save_history(history, checkpoint)
+            new_diffs = []
+
+    complete_diffs(history, new_diffs, parser, ast_cache, processes, profile)
+    return history
+
+# History [Diff] [pycparser.c_parser.CParser predast.ASTCache int
+#   profiling.Profile] -> None
+def complete_diffs(history, diffs, parser=None, ast_cache=None, processes=1,
+        profile=profiling.NULL):
+    """Links the given newly mined diffs to their parents, and parses their
+    assertions. Their parents must have been added to the History already.
+    """
+    with profile.phase("link"):
+        for diff in diffs:
+            history.add_children(diff)
+
+    assertions = [a for diff in diffs for file in diff.files
+                    for a in file.assertions]
+    parse_assertions(assertions, parser, ast_cache, processes, profile)
+
+# [Assertion] [pycparser.c_parser.CParser predast.ASTCache int
+#   profiling.Profile] -> None
+def parse_assertions(assertions, parser=None, ast_cache=None, processes=1,
+        profile=profiling.NULL):
+    """Sets the .ast of each assertion, or flags it as .unparseable. Identical
+    predicates are only parsed once, by a pool of :processes: workers.
+    """
+    ast_cache = ast_cache if ast_cache else predast.ASTCache()
+    counters = (ast_cache.hits, ast_cache.misses, ast_cache.failures,
+            ast_cache.retries)
+    with profile.phase("parse"):
+        asts = ast_cache.parse_all([a.predicate for a in assertions], parser,
+                processes)
+    for name, before, after in zip(["cached predicates", "parsed predicates",
+            "parse failures", "parse retries"], counters, (ast_cache.hits,
+            ast_cache.misses, ast_cache.failures, ast_cache.retries)):
+        profile.count(name, after - before)
+    for a, ast in zip(assertions, asts):
+        if isinstance(ast, predast.ParseError):
+            logging.error("{e}: Unable to generate AST of {a}"
+                    .format(a=a.info(), e=ast))
+            a.ast = None
+            a.unparseable = True
+            profile.count("unparseable")
+        else:
+            a.ast = ast
 
+# History string -> None
+def save_history(history, filename):
+    """Pickles the history. The file is replaced atomically, so that it always
+    holds a complete History, even if interrupted.
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'wb') as f:
+        pickle.dump(history, f)
+    os.replace(tmp_filename, filename)
+
+# string string string [int predast.ASTCache container profiling.Profile]
+#   -> iterator[Diff]
+def stream_repo(assertion_re, repo_path, branch, processes=1, ast_cache=None,
+        skip=(), profile=None):
+    """Like mine_repo, but produces the Diff of each commit as soon as it is
+    mined and its assertions parsed, instead of a History. So only a few
+    Diffs are in memory at once. The Diffs' children aren't linked yet; they
+    are when reading them back into a History (see dump_stream).
+    """
+    profile = profile if profile is not None else profiling.NULL
+    ast_cache = ast_cache if ast_cache else predast.ASTCache()
     parser = pycparser.c_parser.CParser()
-    for diff in history.diffs:
+    for diff in mine_diffs(assertion_re, repo_path, branch, processes, skip,
+            profile):
+        parse_assertions([a for file in diff.files for a in file.assertions],
+                parser, ast_cache, profile=profile)
+        yield diff
+
+
+StreamHeader = namedtuple("StreamHeader", ["repo_path", "branch"])
+
+# iterator[Diff] string string string [string] -> None
+def dump_stream(diffs, repo_path, branch, pickle_file, asserts_file=None):
+    """Writes each Diff to disk as soon as it is produced (e.g. by stream_repo),
+    pickled one after another following a StreamHeader, so that the pickle
+    file can be read back as the equivalent History (see read_stream). If
+    :asserts_file: is given, the info() of every assertion is written there
+    as for a History: the confirmed ones, followed by the problematic ones.
+    """
+    inspects_file = asserts_file + ".inspects" if asserts_file else os.devnull
+    with open(pickle_file, 'wb') as pf, \
+            open(asserts_file or os.devnull, 'w') as af, \
+            open(inspects_file, 'w+') as inf:
+        pickle.dump(StreamHeader(repo_path, branch), pf)
+        for diff in diffs:
+            pickle.dump(diff, pf)
+            for file in diff.files:
+                for a in file.assertions:
+                    af.write(a.info() + "\n")
+                for a in file.to_inspect:
+                    inf.write(a.info() + "\n")
+
+        if asserts_file:
+            inf.seek(0)
+            shutil.copyfileobj(inf, af)
+    if asserts_file:
+        os.remove(inspects_file)
+
+# StreamHeader file -> History
+def read_stream(header, file):
+    """Produces the History of the Diffs pickled in the rest of the file,
+    following its StreamHeader (see dump_stream).
+    """
+    history = History(header.repo_path, header.branch)
+    for diff in iter_stream(file):
+        diff = intern_diff(diff)
+        history.update_diff(diff)
         history.add_children(diff)
-        for file in diff.files:
-            for a in file.assertions:
-                try:
-                    a.ast = predast.AST(a.predicate, parser)
-                except Exception as err:
-                    logging.error("{e}: Unable to generate AST of {a}"
-                            .format(a=a.info(), e=err))
-                    a.ast = None
-                    a.unparseable = True
-
-    find_function_names(history)
     return history
 
-def find_function_names(history):
-    change_map = ChangeMap(history)
-    change_map.insert_function_names()
+# file -> iterator[Diff]
+def iter_stream(file):
+    """Produces the Diffs pickled in the rest of the file one at a time,
+    stopping at the end or at a truncated one (from an interrupted run).
+    """
+    while True:
+        try:
+            yield pickle.load(file)
+        except EOFError:
+            return
+        except pickle.UnpicklingError:
+            logging.warning("Truncated Diff stream in " + str(file.name))
+            return
+
+
+# string string string [int container profiling.Profile] -> iterator[Diff]
+def mine_diffs(assertion_re, repo_path, branch, processes=1, skip=(),
+        profile=profiling.NULL):
+    """Produces the Diff of each commit of the branch, in reverse topological
+    order (oldest first). When :processes: > 1, the commits are diffed by a
+    pool of worker processes, each with its own pygit2.Repository, and their
+    Diffs are yielded in the same order as the serial walk.
+    :skip:  commit ids not to be diffed, e.g. a History already mined
+    :profile: to which the phases of the workers are added too
+    """
+    matcher = AssertionMatcher(assertion_re)
+    repo = pygit2.Repository(repo_path)
+    with profile.phase("revwalk"):
+        commits = repo.walk(repo.lookup_branch(branch).target,
+                pygit2.GIT_SORT_REVERSE | pygit2.GIT_SORT_TOPOLOGICAL)
 
-class ChangeMap():
-    def __init__(self, history):
-        self.history = history
-        # commitid filename change_lineno
-        self.addeds = defaultdict(lambda: defaultdict(dict))
-        self.removeds = defaultdict(lambda: defaultdict(dict))
-        for diff in history.diffs:
-            for file in diff.files:
-                for a in file.assertions:
-                    commits = self.addeds if a.change == Change.added \
-                            else self.removeds
-                    commits[diff.rvn_id][file.name][a.change_lineno] = a
-
-    def insert_function_names(self):
-        """For each assertion, if it is part of a sufficiently small diff
-        that its function-context is accurate -- ie, it sets the function_name
-        to the function where the assertion is embedded. Otherwise
-        it'll set the .function_name to "".
-        """
-        def make_diff(repo, commit):
-            parents = commit.parents
-            if len(parents) == 0:
-                return commit.tree.diff_to_tree(swap=True, context_lines=0)
-            elif len(parents) == 1:
-                return repo.diff(parents[0], commit, context_lines=0)
-            else:
-                # don't diff merges or else we'll 'double-dip' on the assertions
-                return []
-
-        def walk(commits, change):
-            repo = pygit2.Repository(self.history.repo_path)
-            for (commit_id,files) in commits.items():
-                gcommit = repo.revparse_single(commit_id)
-                gdiff = make_diff(repo, gcommit)
-                for patch in gdiff:
-                    filename = patch.delta.new_file.path
-                    if filename in files:
-                        asserts = files[filename]
-                        for hunk in patch.hunks:
-                            for gline in hunk.lines:
-                                lineno = get_file_lineno(gline, change)
-                                if gline.origin == change.prefix and \
-                                        lineno in asserts:
-                                    asserts[lineno].function_name = \
-                                            get_function_context(hunk.header)
-
-        walk(self.addeds, Change.added)
-        walk(self.removeds, Change.removed)
+    if processes <= 1:
+        try:
+            for commit in _timed_iter(commits, profile.phase("revwalk")):
+                if commit.hex in skip:
+                    continue
+                logging.info("Processing " + commit.hex)
+                yield generate_diff(commit, repo, matcher, profile)
+        finally:
+            close_object_sizes()
+        return
+
+    with profile.phase("revwalk"):
+        commit_ids = [commit.hex for commit in commits
+                if commit.hex not in skip]
+    # Big enough chunks to amortize the IPC, small enough to balance the load
+    chunksize = max(1, min(MAX_CHUNKSIZE, len(commit_ids) // (4 * processes)))
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+            initargs=(repo_path, matcher, profile is not profiling.NULL)) \
+            as pool:
+        for diff, worker_profile in pool.imap(_mine_commit, commit_ids,
+                chunksize):
+            if worker_profile is not None:
+                profile.merge(worker_profile)
+            yield intern_diff(diff)
+        # (so that the workers exit, closing their ObjectSizes, rather than
+        # are terminated)
+        pool.close()
+        pool.join()
+
+# iterable profiling.Phase -> iterator
+def _timed_iter(iterable, phase):
+    """Produces the items of :iterable:, timing only the producing of each"""
+    iterator = iter(iterable)
+    while True:
+        with phase:
+            item = next(iterator, _timed_iter)
+        if item is _timed_iter:
+            return
+        yield item
+
+_repositories = {}  # path -> pygit2.Repository
+
+# string -> pygit2.Repository
+def open_repository(path):
+    """The repository at :path:, opened once per process"""
+    if path not in _repositories:
+        _repositories[path] = pygit2.Repository(path)
+    return _repositories[path]
+
+
+_worker = {}    # per-process state of mine_diffs' pool workers
+
+def _init_worker(repo_path, matcher, profiled=False):
+    _worker["repo"] = pygit2.Repository(repo_path)
+    _worker["matcher"] = matcher
+    _worker["profiled"] = profiled
+    multiprocessing.util.Finalize(None, close_object_sizes, exitpriority=0)
+
+# string -> (Diff, profiling.Profile|None)
+def _mine_commit(commit_id):
+    """The Diff of the commit, and the Profile of mining it, if profiled"""
+    repo = _worker["repo"]
+    logging.info("Processing " + commit_id)
+    profile = profiling.Profile() if _worker["profiled"] else None
+    diff = generate_diff(repo[commit_id], repo, _worker["matcher"],
+            profile or profiling.NULL)
+    return diff, profile
+
+# Diff -> Diff
+def intern_diff(diff):
+    """Strings are interned as Diffs are mined, but an unpickled Diff (e.g.
+    from a worker process) has its own copies. Intern them again, which also
+    makes pickling its History produce the same bytes as mining serially.
+    """
+    diff.repo_path = intern(diff.repo_path)
+    diff.author = intern(diff.author)
+    for file in diff.files:
+        file.name = intern(file.name)
+        for a in itertools.chain(file.assertions, file.to_inspect):
+            a.name = intern(a.name)
+            a.predicate = intern(a.predicate)
+            a.problem = intern(a.problem)
+            a.function_name = intern(a.function_name)
+    return diff
 
 
 def get_function_context(header):
@@ -394,7 +778,13 @@ Bad:
     fc = re.match(r"@@.*@@ (.*)", header)
     if fc is None:
         return ""
-    fc = fc.group(1)
+    return get_function_name(fc.group(1))
+
+# string -> string
+def get_function_name(fc):
+    """Extract function name from the function-context line of a hunk
+    header, IF it has an agreeable format. (See get_function_context)
+    """
     if ";" in fc:
         return ""
     if re.search(r"\(.*\) *\w+", fc):
@@ -405,6 +795,37 @@ Bad:
     return fname.group(1)
 
 
+# pygit2.Hunk [[pygit2.DiffLine]] -> [string]
+def function_contexts(hunk, lines=None):
+    """Produce the name of the function each line of the hunk is embedded in
+    ("" for unchanged lines). As the hunk has context lines, its own header is
+    only accurate for its first lines, so each run of changed lines gets the
+    function name git would have put in the header of its hunk, had it been
+    diffed without context lines: that of the closest preceding line of the
+    old file that starts with a letter, '_' or '$'.
+    """
+    contexts = []
+    funcline = None     # latest function-context line in the hunk
+    context = None      # function name of the current run of changed lines
+    for gline in (lines if lines is not None else hunk.lines):
+        if gline.origin == " ":
+            context = None
+            contexts.append("")
+        else:
+            if context is None:
+                context = get_function_name(funcline) if funcline is not None \
+                        else get_function_context(hunk.header)
+            contexts.append(context)
+
+        if gline.origin in " -":
+            line = gline.content.rstrip(" \t\n\v\f\r")
+            if line and (line[0] in FUNCLINE_STARTS):
+                # git truncates these lines in the header
+                funcline = line.encode()[:FUNCLINE_LEN] \
+                        .decode(errors="replace")
+    return contexts
+
+
 # source is suppose)d to print out source: commit, file, lineno
 def print_all_assertions(assertion_re, repo_path, branch, source=False):
     logging.basicConfig(level=logging.DEBUG, filename="assertions.log")
@@ -430,25 +851,29 @@ def assertion_iter(history, inspects=False):
                 yield a
 
 
-# pygit2.Commit pygit2.Repository string -> tressa.Diff
-def generate_diff(commit, repo, assertion_re):
-    """If there are any changed (or uncertain) assertions (matched by
-    assertion_re) in a file in the given Commit, produce Diff containing them.
+# pygit2.Commit pygit2.Repository AssertionMatcher [profiling.Profile]
+#   -> tressa.Diff
+def generate_diff(commit, repo, matcher, profile=profiling.NULL):
+    """If there are any changed (or uncertain) assertions (found by
+    matcher) in a file in the given Commit, produce Diff containing them.
     Otherwise produce None.
     """
-    diff = Diff(commit)
+    profile.count("commits")
+    diff = Diff(commit, repo_path=repo.path)
     parents = commit.parents
-    if len(parents) == 0:
-        gdiff = commit.tree.diff_to_tree(swap=True,
-                context_lines=MAX_LINES - 1)
-    elif len(parents) == 1:
-        gdiff = repo.diff(parents[0], commit, context_lines=MAX_LINES -1)
-        diff.parents = [pid.hex for pid in commit.parent_ids]
-    else:
-        diff.parents = [pid.hex for pid in commit.parent_ids]
-        return diff
+    with profile.phase("diff"):
+        if len(parents) == 0:
+            gdiff = commit.tree.diff_to_tree(swap=True,
+                    context_lines=MAX_LINES - 1)
+        elif len(parents) == 1:
+            gdiff = repo.diff(parents[0], commit, context_lines=MAX_LINES -1)
+            diff.parents = [pid.hex for pid in commit.parent_ids]
+        else:
+            diff.parents = [pid.hex for pid in commit.parent_ids]
+            profile.count("merges")
+            return diff
 
-    files = analyze_diff(gdiff, assertion_re, diff)
+    files = analyze_diff(gdiff, matcher, diff, repo, profile)
     if len(files) == 0:
         return diff
 
@@ -456,32 +881,115 @@ def generate_diff(commit, repo, assertion_re):
     return diff
 
 
-# pygit2.Diff string tressa.Diff -> [Files]
-def analyze_diff(gdiff, assertion_re, diff):
-    """Include File in list if it contains changed assertions"""
+# pygit2.Diff AssertionMatcher tressa.Diff [pygit2.Repository
+#   profiling.Profile] -> [Files]
+def analyze_diff(gdiff, matcher, diff, repo=None, profile=profiling.NULL):
+    """Include File in list if it contains changed assertions.
+    Only the patches of the files selected by wanted_delta are generated.
+    """
     files = []
-    for patch in gdiff:
+    profile.count("files", len(gdiff))
+    for i, delta in enumerate(gdiff.deltas):
+        filename = delta.new_file.path
+        if not wanted_delta(delta, repo):
+            logging.info("\tSkipping " +  filename)
+            continue
+
         try:
-            filename = patch.delta.new_file.path
-            if has_extension(filename, FILE_EXTENSIONS):
-                # only care about files with appropriate extensions
-                logging.info("\t" + filename)
-                file = File(filename, diff)
-                asserts, inspects = analyze_patch(patch, assertion_re, file)
-
-                if len(asserts) + len(inspects) > 0:
-                    file.assertions = asserts
-                    file.to_inspect = inspects
-                    files.append(file)
-                    logging.info("\t\t{a} assertions, {i} to_inspect".format(
-                            a=len(file.assertions), i=len(file.to_inspect)))
+            # libgit2 only produces the patch text now
+            with profile.phase("diff"):
+                patch = gdiff[i]
+            profile.count("patches")
+            logging.info("\t" + filename)
+            file = File(filename, diff)
+            asserts, inspects = analyze_patch(patch, matcher, file, profile)
+
+            if len(asserts) + len(inspects) > 0:
+                file.assertions = asserts
+                file.to_inspect = inspects
+                files.append(file)
+                profile.count("assertions", len(asserts))
+                profile.count("problematic", len(inspects))
+                logging.info("\t\t{a} assertions, {i} to_inspect".format(
+                        a=len(file.assertions), i=len(file.to_inspect)))
         except:
             logging.exception("Unable to process patch")
 
-        else:
-            logging.info("\tSkipping " +  filename)
     return files
 
+# pygit2.DiffDelta [pygit2.Repository] -> Boolean
+def wanted_delta(delta, repo=None):
+    """Produce True if the changed file needs its patch analyzed: it has one
+    of the FILE_EXTENSIONS, matches PATHSPEC, if set, and neither of its
+    blobs exceeds MAX_FILE_SIZE, if set (needs the repo to look them up,
+    by blob_size).
+    """
+    filename = delta.new_file.path
+    if not has_extension(filename, FILE_EXTENSIONS):
+        return False
+
+    if PATHSPEC is not None and \
+            not any(fnmatch.fnmatchcase(filename, p) for p in PATHSPEC):
+        return False
+
+    if MAX_FILE_SIZE is not None and repo is not None:
+        for f in (delta.old_file, delta.new_file):
+            if f.flags & pygit2.GIT_DIFF_FLAG_EXISTS and \
+                    blob_size(f, repo) > MAX_FILE_SIZE:
+                return False
+    return True
+
+# pygit2.DiffFile pygit2.Repository -> int
+def blob_size(file, repo):
+    """The size of the blob of a side of a delta: from the delta, if libgit2
+    knows it, or else from the header of the object, so that a huge blob
+    isn't read (and inflated) just to find out that it's too big to diff.
+    """
+    if file.flags & pygit2.GIT_DIFF_FLAG_VALID_SIZE:
+        return file.size
+    sizes = _object_sizes.get(repo.path)
+    if sizes is None:
+        sizes = _object_sizes[repo.path] = ObjectSizes(repo.path)
+    return sizes.size(file.id)
+
+class ObjectSizes():
+    """Reads the sizes of the objects of a repository from their headers
+    only (which pygit2 can't), with a git cat-file --batch-check process,
+    which close ends
+    """
+    def __init__(self, git_dir):
+        self.process = subprocess.Popen(["git", "--git-dir", git_dir,
+                "cat-file", "--batch-check"], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+
+    # pygit2.Oid -> int
+    def size(self, oid):
+        self.process.stdin.write(str(oid).encode() + b"\n")
+        self.process.stdin.flush()
+        fields = self.process.stdout.readline().split()
+        if len(fields) != 3:    # (<oid> missing)
+            raise KeyError(str(oid))
+        return int(fields[2])
+
+    def close(self):
+        if self.process.returncode is None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_object_sizes = {}  # git dir -> ObjectSizes, opened once per process
+
+def close_object_sizes():
+    """Closes the ObjectSizes opened by blob_size in this process"""
+    while _object_sizes:
+        _object_sizes.popitem()[1].close()
+
 def has_extension(filename, extensions):
     """Produce True if fileame ends in .[any of the extensions]"""
     for ext in extensions:
@@ -489,15 +997,19 @@ def has_extension(filename, extensions):
             return True
     return False
 
-# pygit2.Patch string File -> [Assertion] [Assertion]
-def analyze_patch(patch, assertion_re, file):
+# pygit2.Patch AssertionMatcher File [profiling.Profile]
+#   -> [Assertion] [Assertion]
+def analyze_patch(patch, matcher, file, profile=profiling.NULL):
     """Produce list of changed Assertions found in given patch. Assertions
-    are identified by assertion_re.
+    are identified by matcher.
     """
     asserts, inspects = [], []
-    for i,hunk in enumerate(patch.hunks):
+    with profile.phase("diff"):
+        hunks = patch.hunks
+    profile.count("hunks", len(hunks))
+    for i,hunk in enumerate(hunks):
         try:
-            a, prob_a = generate_assertions(i, hunk, assertion_re, file)
+            a, prob_a = generate_assertions(i, hunk, matcher, file, profile)
             asserts.extend(a)
             inspects.extend(prob_a)
         except:
@@ -505,22 +1017,35 @@ def analyze_patch(patch, assertion_re, file):
 
     return asserts, inspects
 
-# int pygit2.Hunk string File -> [Assertion] [Assertion]
-def generate_assertions(hunk_index, hunk, assertion_re, file):
-    assertions = locate_assertions(hunk_index, hunk, assertion_re, file)
+# int pygit2.Hunk AssertionMatcher File [profiling.Profile]
+#   -> [Assertion] [Assertion]
+def generate_assertions(hunk_index, hunk, matcher, file,
+        profile=profiling.NULL):
+    with profile.phase("scan"):
+        assertions = locate_assertions(hunk_index, hunk, matcher, file)
+    if not assertions:
+        return [], []
+    profile.count("candidates", len(assertions))
+    with profile.phase("function_contexts"):
+        contexts = function_contexts(hunk, assertions[0].lines)
+    with profile.phase("extract"):
+        return extract_assertions(assertions, contexts)
+
+# [HunkAssertion] [string] -> [Assertion] [Assertion]
+def extract_assertions(assertions, contexts):
     asserts, inspects = [], []
     for a in assertions:
         try:
             # if something happens while extracting an assertion, we just
             # want to skip it and keep going, so as to not lose previous results
-            add = a.extract_changed_assertion(Change.added)
+            add = a.extract_changed_assertion(Change.added, contexts)
             if add is not None:
                 if add.problematic:
                     inspects.append(add)
                 else:
                     asserts.append(add)
 
-            rem = a.extract_changed_assertion(Change.removed)
+            rem = a.extract_changed_assertion(Change.removed, contexts)
             if rem is not None:
                 if rem.problematic:
                     inspects.append(rem)
@@ -537,43 +1062,137 @@ def generate_assertions(hunk_index, hunk, assertion_re, file):
     return asserts, inspects
 
 
-# int pygit2.Hunk string File -> [HunkAssertion]
-def locate_assertions(hunkno, hunk, assertion_re, file):
-    """Finds all locations in the given hunk where the given regex identifies
-    an assertion.
+# int pygit2.Hunk AssertionMatcher File -> [HunkAssertion]
+def locate_assertions(hunkno, hunk, matcher, file):
+    """Finds all locations in the given hunk where the given matcher
+    identifies an assertion.
     """
     hunk_ass = []
-    for i, line in enumerate(hunk.lines):
-        matches = match_assertions(assertion_re, line.content)
-        if matches:
-            for m in matches:
-                ha = HunkAssertion(hunk, hunkno, i, m, file)
-                hunk_ass.append(ha)
+    lines = hunk.lines
+    if not matcher.search("".join(line.content for line in lines)):
+        return hunk_ass
+
+    for i, line in enumerate(lines):
+        for m in matcher.finditer(line.content):
+            ha = HunkAssertion(hunk, hunkno, i, m, file, matcher, lines)
+            hunk_ass.append(ha)
 
     return hunk_ass
 
 # string string -> iterable[Match]
 def match_assertions(assertion_re, line):
-    regex = r"\b({asserts})\b".format(asserts=assertion_re)
-    return re.finditer(regex, line)
+    """As AssertionMatcher(assertion_re).finditer(line); to match many lines,
+    make one AssertionMatcher, so that its regexes are compiled once
+    """
+    return AssertionMatcher(assertion_re).finditer(line)
+
+
+class AssertionMatcher():
+    """The compiled regexes identifying assertions (by assertion_re) in a
+    mining run. Hunks are first scanned as a whole, for the literals that
+    any assertion must contain when assertion_re has some (e.g. the macro
+    names of "assert|ASSERT|BUG_ON"), with a single search for any of them,
+    or else for the regex itself. Only the hunks that pass are matched line
+    by line.
+    """
+    # string -> AssertionMatcher
+    def __init__(self, assertion_re):
+        self.assertion_re = assertion_re
+        self.regex = re.compile(r"\b({asserts})\b".format(asserts=assertion_re))
+
+        # '#define ASSERT' should be ignored
+        self.define_re = re.compile(r"[ \t]*#[ \t]*define[ \t]+({a})\b".format(
+                a=self.regex.pattern))
+        # 'extern static unsigned long long ASSERT (X) {}' should be ignored
+        self.decl_re = re.compile(r"((\w+ ){{0,4}}\w+ ({a}))\s*\(".format(
+                a=self.regex.pattern))
+
+        self.literals = required_literals(assertion_re)
+        self.literals_re = re.compile("|".join(map(re.escape, self.literals))) \
+                if self.literals is not None else self.regex
+
+    def __repr__(self):
+        return "AssertionMatcher('{a}', literals={l})".format(
+                a=self.assertion_re, l=self.literals)
+
+    # string -> Boolean
+    def search(self, text):
+        """Produce False if there is no assertion anywhere in the text"""
+        return self.literals_re.search(text) is not None
+
+    # string -> iterable[Match]
+    def finditer(self, line):
+        return self.regex.finditer(line)
+
+
+# string -> [string]|None
+def required_literals(regex):
+    """Produce strings such that any match of the regex contains at least one
+    of them, or None if there aren't any (or it's too complicated to tell).
+    """
+    try:
+        parsed = sre_parse.parse(regex)
+    except Exception:
+        return None
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    literals = _required_literals(parsed)
+    return sorted(literals) if literals else None
+
+def _required_literals(subpattern):
+    """The most selective set of required literals of a parsed sequence"""
+    candidates = []
+    run = ""
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            run += chr(av)
+            continue
+        if run:
+            candidates.append({run})
+            run = ""
+
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, _, p = av
+            if not add_flags & re.IGNORECASE:
+                candidates.append(_required_literals(p))
+        elif op is sre_constants.BRANCH:
+            branches = [_required_literals(p) for p in av[1]]
+            if all(branches):
+                candidates.append(set().union(*branches))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, _, p = av
+            if low > 0:
+                candidates.append(_required_literals(p))
+    if run:
+        candidates.append({run})
+
+    candidates = [c for c in candidates if c]
+    # the shortest literal of a set determines how often it hits by chance
+    return max(candidates, key=lambda c: (min(map(len, c)), -len(c)),
+            default=None)
 
 
 class HunkAssertion():
     """An Assertion statement within a Hunk (a section of a diff's patch)."""
-    def __init__(self, hunk, hunkno, line_index, match, file):
+    def __init__(self, hunk, hunkno, line_index, match, file, matcher,
+            lines=None):
         self.hunk = hunk
         self.hunkno = hunkno
         self.line_index = line_index    # index of line in Hunk
         self.match = match
         self.file = file
+        self.matcher = matcher
+        self.lines = lines if lines is not None else hunk.lines
 
-    # Change -> Assertion|None
-    def extract_changed_assertion(self, change):
+    # Change [[string]] -> Assertion|None
+    def extract_changed_assertion(self, change, contexts=None):
         """Finds the given assertion, assuming it is Added or Removed
         (determined by :change: input). If successful, return create
         Assertion and return it. If it did not change as specified return None.
         If it seems to have changed, but produced parsing difficulties,
         return Assertion with .problematic flag turned on.
+        :contexts: function_contexts of the hunk, to set the .function_name
+        of the Assertion from its first changed line.
 
         problematic:
             - contains string that contains actual newline
@@ -602,7 +1221,7 @@ class HunkAssertion():
 
         """
 
-        first_gline = self.hunk.lines[self.line_index]
+        first_gline = self.lines[self.line_index]
         if (first_gline.origin == change.anti_prefix) or \
             first_gline.content.startswith("#include"):
             return None
@@ -610,14 +1229,18 @@ class HunkAssertion():
         file_lineno = get_file_lineno(first_gline, change)
 
         changed = False            # has the assertion been changed so far?
+        change_index = 0           # index in Hunk of the first changed line
         count = 0
-        extracter = Extracter(change, self.match)
-        for gline in self.hunk.lines[self.line_index:]:
+        extracter = Extracter(change, self.match, self.matcher)
+        lines = self.lines
+        for i in range(self.line_index, len(lines)):
+            gline = lines[i]
             if gline.origin != change.anti_prefix:
                 if gline.origin == change.prefix:
                     changed = True
                     if extracter.change_lineno == 0:
                         extracter.change_lineno = get_file_lineno(gline, change)
+                        change_index = i
                 status = extracter.extract(gline.content)
                 count += 1
                 if status == DONE or count > MAX_LINES:
@@ -646,6 +1269,8 @@ class HunkAssertion():
                 change_lineno=extracter.change_lineno,
                 problematic=extracter.problematic, problem=extracter.problem,
                 parent_file=self.file)
+        if contexts:
+            assertion.function_name = intern(contexts[change_index])
         return assertion
 
 
@@ -675,11 +1300,15 @@ class Extracter():
     #                      1  2   3   4 5  6  7
 
     COMMENT_CLUE = re.compile(r"\s*\*[^/]")
+    QUOTE = re.compile(r'"')
+    COMMENT_END = re.compile(r"\*/")
+    CONTINUATION = re.compile(r"\\\n")
 
-    def __init__(self, change, match):
+    def __init__(self, change, match, matcher):
         self.change = change            # Change
         self.change_lineno = 0          # first file lineno in assert that's changed
         self.match = match              # re.Match
+        self.matcher = matcher          # AssertionMatcher that found match
         self.lines = []                 # pygit lines visited so far
         self.parens = 0                 # num parens seen so far
         self.comment = False
@@ -705,13 +1334,8 @@ class Extracter():
         self.lines.append(line)
 
         if len(self.lines) == 1: # first line
-            assertion_re = self.match.re.pattern
-
-
             # '#define ASSERT' should be ignored
-            define_re = r"[ \t]*#[ \t]*define[ \t]+({a})\b".format(
-                    a=assertion_re)
-            match = re.match(define_re, line)
+            match = self.matcher.define_re.match(line)
             if match:
                 self.valid = False
                 return DONE
@@ -723,8 +1347,7 @@ class Extracter():
             # 'extern static unsigned long long ASSERT (X) {}' should be ignored
             # Sometimes style dictates that the assert name is at the
             # beginning of a line. This will NOT catch these, apologetically.
-            decl_re = r"((\w+ ){{0,4}}\w+ ({a}))\s*\(".format(a=assertion_re)
-            match = re.match(decl_re, line)
+            match = self.matcher.decl_re.match(line)
             if match:
                 self.problematic = True
                 self.problem = "Possible function declaration"
@@ -736,20 +1359,20 @@ class Extracter():
                 if match:
 
                     if match.group() == '"':
-                        m = re.search('"', pre_line[match.end():])
+                        m = Extracter.QUOTE.search(pre_line, match.end())
                         if m is None:
                             self.valid = False
                             return DONE
                         else:
-                            pre_line = pre_line[match.end() + m.end():]
+                            pre_line = pre_line[m.end():]
 
                     elif match.group() == '/*':
-                        m = re.search('\*/', pre_line[match.end():])
+                        m = Extracter.COMMENT_END.search(pre_line, match.end())
                         if m is None:
                             self.valid = False
                             return DONE
                         else:
-                            pre_line = pre_line[match.end() + m.end():]
+                            pre_line = pre_line[m.end():]
 
                     elif match.group() == "//":
                         self.valid = False
@@ -765,11 +1388,11 @@ class Extracter():
             line = line[self.match.end():]
 
         # The macro line continuation backslash messes up the AST parser
-        line = re.sub(r"\\\n", " ", line)
+        line = Extracter.CONTINUATION.sub(" ", line)
 
         if self.comment:
             # We need to find find closing '*/' before moving on
-            m = re.search('\*/', line)
+            m = Extracter.COMMENT_END.search(line)
             if m:
                 line = line[m.end():]
                 self.comment = False
@@ -792,10 +1415,10 @@ class Extracter():
                 return MORE
 
             if match.group() == '"':
-                m = re.search('"', line[match.end():])
+                m = Extracter.QUOTE.search(line, match.end())
                 if m:
-                    self.predicate += line[:match.end() + m.end()]
-                    line = line[match.end() + m.end():]
+                    self.predicate += line[:m.end()]
+                    line = line[m.end():]
                     continue
                 else:
                     self.problematic = True
@@ -804,9 +1427,9 @@ class Extracter():
 
             elif match.group() == '/*':
                 self.predicate += line[:match.start()]
-                m = re.search('\*/', line[match.end():])
+                m = Extracter.COMMENT_END.search(line, match.end())
                 if m:
-                    line = line[match.end() + m.end():]
+                    line = line[m.end():]
                     continue
                 else:
                     self.comment = True
@@ -0,0 +1,401 @@
+# Benchmarks of the hot paths of mining and analysis, on synthetic repos
+# generated with pygit2, at several scales. Each phase's time, throughput
+# (commits/s and assertions/s) and peak (Python heap) memory are reported,
+# and compared with stored baselines, so that regressions are visible.
+#   $ python3 benchmark.py [--save] [scale...]
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import tracemalloc
+from collections import OrderedDict
+
+import pygit2
+
+import assertions
+import analysis
+import contexts
+
+ASSERTION_RE = "assert|ASSERT|BUG_ON"
+
+# Synthetic repos of each scale; see make_repo for the parameters
+SCALES = OrderedDict([
+    ("small", dict(commits=200, files=10)),
+    ("medium", dict(commits=1000, files=40)),
+    ("large", dict(commits=4000, files=100)),
+])
+
+REPEATS = 3         # runs of each (analysis) phase; the fastest is reported
+PROCESSES = 1       # of mine_repo
+SEED = 0            # of the synthetic repos, so each scale's is always the same
+
+BASELINES = "benchmark_baselines.json"
+TOLERANCE = 0.25    # slowdown (or growth of peak memory), as a fraction of the
+                    # baseline, beyond which a phase has regressed
+NOISE = 0.005       # seconds of slowdown too few to be a regression
+
+NAMES = ["assert", "ASSERT", "BUG_ON"]
+VARIABLES = ["len", "size", "count", "idx", "ptr", "buf", "node", "flags",
+        "state", "ref", "head", "tail", "offset", "depth", "mask", "key"]
+OPERATORS = ["==", "!=", "<", "<=", ">", ">="]
+
+
+################################################################################
+# Synthetic repos
+################################################################################
+
+class _Generator():
+    """The contents of the files of a synthetic repo, as blocks of lines
+    (statements, or assertions of one or more lines) in the body of a function
+    per file, and their random edits.
+    """
+    def __init__(self, files, density, multiline, problematic, rng):
+        self.density = density
+        self.multiline = multiline
+        self.problematic = problematic
+        self.rng = rng
+        self.paths = []
+        for i in range(files):
+            if i % 10 == 9:     # (excluded from most statistics)
+                self.paths.append("test/test_{i}.c".format(i=i))
+            elif i % 3 == 2:
+                self.paths.append("include/header_{i}.h".format(i=i))
+            else:
+                self.paths.append("src/module_{i}.c".format(i=i))
+        self.statements = 0
+
+    def initial(self):
+        """The blocks of each file of the first commit"""
+        return {path: [self.block() for _ in range(self.rng.randrange(5, 20))]
+                for path in self.paths}
+
+    def edit(self, files, edits):
+        """Makes :edits: random insertions, deletions or replacements of blocks
+        in :files: (path -> blocks), in place
+        """
+        for _ in range(edits):
+            blocks = files[self.rng.choice(self.paths)]
+            r = self.rng.random()
+            if r < 0.5 or not blocks:
+                blocks.insert(self.rng.randrange(len(blocks) + 1), self.block())
+            elif r < 0.8:
+                del blocks[self.rng.randrange(len(blocks))]
+            else:
+                blocks[self.rng.randrange(len(blocks))] = self.block()
+
+    def block(self):
+        if self.rng.random() >= self.density:
+            self.statements += 1
+            return ("\t{v} = {v} + {n};\n".format(v=self.rng.choice(VARIABLES),
+                    n=self.statements),)
+        name = self.rng.choice(NAMES)
+        r = self.rng.random()
+        if r < self.problematic:
+            if self.rng.random() < 0.5:
+                # (unclosed within MAX_LINES)
+                conjuncts = [self.predicate()
+                        for _ in range(assertions.MAX_LINES + 2)]
+                return tuple(["\t{n}({c} &&\n".format(n=name, c=conjuncts[0])] +
+                        ["\t\t{c} &&\n".format(c=c) for c in conjuncts[1:-1]] +
+                        ["\t\t{c});\n".format(c=conjuncts[-1])])
+            # (mid-comment)
+            return ("\t/*\n", "\t * {n}({p}) must hold\n".format(n=name,
+                    p=self.predicate()), "\t */\n")
+        if r < self.problematic + self.multiline:
+            return ("\t{n}({p} &&\n".format(n=name, p=self.predicate()),
+                    "\t\t{p});\n".format(p=self.predicate()))
+        return ("\t{n}({p});\n".format(n=name, p=self.predicate()),)
+
+    def predicate(self):
+        return "{v} {o} {n}".format(v=self.rng.choice(VARIABLES),
+                o=self.rng.choice(OPERATORS), n=self.rng.randrange(10))
+
+    def content(self, path, blocks):
+        lines = ["int function_{i}(void)\n".format(i=self.paths.index(path)),
+                "{\n"]
+        for block in blocks:
+            lines.extend(block)
+        lines.append("}\n")
+        return "".join(lines).encode()
+
+
+def _write_tree(repo, files):
+    """Writes the tree of :files: (path -> blob id), with their directories"""
+    builder = repo.TreeBuilder()
+    dirs = {}
+    for path, blob in files.items():
+        if "/" in path:
+            head, rest = path.split("/", 1)
+            dirs.setdefault(head, {})[rest] = blob
+        else:
+            builder.insert(path, blob, pygit2.GIT_FILEMODE_BLOB)
+    for head, subfiles in dirs.items():
+        builder.insert(head, _write_tree(repo, subfiles),
+                pygit2.GIT_FILEMODE_TREE)
+    return builder.write()
+
+
+# string [int int int float int int float float int] -> pygit2.Repository
+def make_repo(path, commits=100, files=10, edits=3, density=0.3,
+        merge_every=10, branch_commits=3, multiline=0.1, problematic=0.05,
+        seed=SEED):
+    """Generates a (bare) repository at :path:, whose master branch has
+    :commits: commits (including merges) of about :edits: random edits each
+    to :files: C files, a tenth of which are tests.
+    :density:   the fraction of blocks (statements) that are assertions,
+        of which :multiline: span two lines and :problematic: can't be parsed
+        (e.g. being unclosed within MAX_LINES)
+    :merge_every: every so many commits, a branch of :branch_commits: commits
+        is merged (0 for a linear history)
+    The same parameters and :seed: always generate the same commits.
+    """
+    rng = random.Random(seed)
+    generator = _Generator(files, density, multiline, problematic, rng)
+    repo = pygit2.init_repository(path, bare=True)
+    when = 1500000000
+    blobs = {}      # (path, blocks) -> blob id, so only edited files are written
+
+    def blob(path, blocks):
+        key = (path, tuple(blocks))
+        if key not in blobs:
+            blobs[key] = repo.create_blob(generator.content(path, blocks))
+        return blobs[key]
+
+    def commit(state, parents, message):
+        nonlocal when
+        when += rng.randrange(60, 86400)
+        signature = pygit2.Signature("Benchmark", "benchmark@example.com",
+                when, rng.choice([-300, 0, 60]))
+        tree = _write_tree(repo, {path: blob(path, blocks)
+                for path, blocks in state.items()})
+        return repo.create_commit(None, signature, signature, message, tree,
+                parents)
+
+    state = generator.initial()
+    head = commit(state, [], "Commit 0")
+    made = 1
+    while made < commits:
+        if merge_every and made % merge_every == 0 and \
+                made + branch_commits + 2 <= commits:
+            branch = {path: list(blocks) for path, blocks in state.items()}
+            tip = head
+            for i in range(branch_commits):
+                generator.edit(branch, rng.randrange(1, 2 * edits))
+                tip = commit(branch, [tip], "Branch commit {i}".format(i=i))
+            changed = [path for path in branch if branch[path] != state[path]]
+            generator.edit(state, rng.randrange(1, 2 * edits))
+            head = commit(state, [head], "Commit {n}".format(n=made))
+            # (the branch's version of each file it changed)
+            for path in changed:
+                state[path] = list(branch[path])
+            head = commit(state, [head, tip], "Merge {n}".format(n=made))
+            made += branch_commits + 2
+        else:
+            generator.edit(state, rng.randrange(1, 2 * edits))
+            head = commit(state, [head], "Commit {n}".format(n=made))
+            made += 1
+
+    repo.references.create("refs/heads/master", head)
+    return repo
+
+
+################################################################################
+# Benchmarks
+################################################################################
+
+def _clear_deltas(history):
+    for diff in history.diffs:
+        if hasattr(diff, "delta"):
+            del diff.delta
+
+def _analyses(history):
+    """The analysis phases of a mined :history:, as (name, setup, run)"""
+    return [
+        ("insert_deltas", lambda: _clear_deltas(history),
+            lambda: analysis.insert_deltas(history)),
+        ("CommitGraph", None, lambda: analysis.CommitGraph(history)),
+        ("activity_result", None, lambda: analysis.activity_result(history)),
+        ("names_result", None, lambda: analysis.names_result(history)),
+        ("all_results", None, lambda: analysis.all_results(history)),
+        ("Contexts", None, lambda: contexts.Contexts(history)),
+    ]
+
+def _timed(setup, run, repeats):
+    """The least seconds that :run: took, of :repeats: runs"""
+    best = None
+    for _ in range(repeats):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def _peak(setup, run):
+    """The peak bytes of the Python heap that :run: allocated"""
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _measure(seconds, peak, commits, num_assertions):
+    return OrderedDict([
+        ("seconds", round(seconds, 4)),
+        ("commits_per_s", round(commits / seconds, 1) if seconds else None),
+        ("assertions_per_s",
+            round(num_assertions / seconds, 1) if seconds else None),
+        ("peak_bytes", peak),
+    ])
+
+def count_assertions(history):
+    """The number of assertion events (of all files, problematic included)"""
+    return sum(len(file.assertions) + len(file.to_inspect)
+            for diff in history.diffs for file in diff.files)
+
+
+# string [int] -> OrderedDict
+def benchmark(scale, repeats=REPEATS):
+    """Generates the synthetic repo of :scale: (one of SCALES), mines it and
+    analyzes the History, producing the seconds, throughput and peak memory
+    of each phase (and the seconds the repo took to generate). Peak memory is measured in separate runs, as tracing
+    allocations slows them down.
+    """
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory(prefix="tressa_benchmark_") as tmp:
+        path = os.path.join(tmp, scale + ".git")
+        start = time.perf_counter()
+        make_repo(path, **SCALES[scale])
+        generated = time.perf_counter() - start
+
+        def mine():
+            return assertions.mine_repo(ASSERTION_RE, path, "master",
+                    processes=PROCESSES)
+
+        start = time.perf_counter()
+        history = mine()
+        mined = time.perf_counter() - start
+        commits = len(history.diffs)
+        num_assertions = count_assertions(history)
+        results["mine_repo"] = _measure(mined, _peak(None, mine), commits,
+                num_assertions)
+
+        for name, setup, run in _analyses(history):
+            results[name] = _measure(_timed(setup, run, repeats),
+                    _peak(setup, run), commits, num_assertions)
+    return OrderedDict([("commits", commits), ("assertions", num_assertions),
+            ("make_repo", round(generated, 4)), ("phases", results)])
+
+
+def load_baselines(filename=BASELINES):
+    """The stored results of each scale, or {} if there are none"""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+def save_baselines(results, filename=BASELINES):
+    """Stores the :results: of each scale as its baseline, with a description
+    of this machine (whose baselines only it should be compared with)
+    """
+    baselines = load_baselines(filename)
+    baselines.setdefault("scales", OrderedDict()).update(results)
+    baselines["machine"] = machine()
+    with open(filename, "w") as f:
+        json.dump(baselines, f, indent=2)
+        f.write("\n")
+
+def machine():
+    return OrderedDict([("platform", platform.platform()),
+            ("python", platform.python_version()),
+            ("pygit2", pygit2.__version__), ("cpus", os.cpu_count())])
+
+
+# OrderedDict OrderedDict [float] -> [string]
+def regressions(results, baselines, tolerance=TOLERANCE):
+    """Describes each phase of the :results: of each scale that is slower, or
+    uses more memory, than its baseline by more than :tolerance:
+    """
+    found = []
+    for scale, result in results.items():
+        baseline = baselines.get("scales", {}).get(scale)
+        if baseline is None:
+            continue
+        if baseline["commits"] != result["commits"] or \
+                baseline["assertions"] != result["assertions"]:
+            found.append("{s}: mined {c} commits and {a} assertions, "
+                    "instead of {bc} and {ba}".format(s=scale,
+                    c=result["commits"], a=result["assertions"],
+                    bc=baseline["commits"], ba=baseline["assertions"]))
+        for phase, measures in result["phases"].items():
+            base = baseline["phases"].get(phase)
+            if base is None:
+                continue
+            for measure in ["seconds", "peak_bytes"]:
+                now, then = measures[measure], base[measure]
+                if now is not None and then and \
+                        now > then * (1 + tolerance) and \
+                        (measure != "seconds" or now - then > NOISE):
+                    found.append("{s} {p}: {m} {now} vs {then} ({r:+.0%})"
+                            .format(s=scale, p=phase, m=measure, now=now,
+                            then=then, r=now / then - 1))
+    return found
+
+
+def report(scale, result, baseline=None):
+    """Prints a table of the phases of the :result: of :scale:, with their
+    change from the :baseline:, if any
+    """
+    print("{s}: {c} commits, {a} assertions (generated in {g:.2f}s)".format(
+            s=scale, c=result["commits"], a=result["assertions"],
+            g=result["make_repo"]))
+    print("  {p:<16}{t:>10}{c:>12}{a:>14}{m:>12}{d:>9}".format(p="phase",
+            t="seconds", c="commits/s", a="assertions/s", m="peak MB",
+            d="vs base"))
+    for phase, measures in result["phases"].items():
+        base = (baseline or {}).get("phases", {}).get(phase)
+        change = "{r:+.0%}".format(r=measures["seconds"] / base["seconds"] - 1) \
+                if base and base["seconds"] else ""
+        peak = measures["peak_bytes"]
+        print("  {p:<16}{t:>10.3f}{c:>12}{a:>14}{m:>12}{d:>9}".format(p=phase,
+                t=measures["seconds"], c=measures["commits_per_s"] or "",
+                a=measures["assertions_per_s"] or "",
+                m="{:.1f}".format(peak / 2**20) if peak is not None else "",
+                d=change))
+
+
+if __name__ == '__main__':
+    USAGE = "Usage: " + sys.argv[0] + " [--save] [" + "|".join(SCALES) + "...]"
+
+    args = sys.argv[1:]
+    save = "--save" in args
+    scales = [a for a in args if a != "--save"] or list(SCALES)
+    if any(s not in SCALES for s in scales):
+        print(USAGE)
+        sys.exit(-1)
+
+    baselines = load_baselines()
+    if baselines and baselines.get("machine") != machine():
+        print("The baselines were measured on another machine: " +
+                json.dumps(baselines.get("machine")))
+    results = OrderedDict()
+    for scale in scales:
+        results[scale] = benchmark(scale)
+        report(scale, results[scale], baselines.get("scales", {}).get(scale))
+
+    if save:
+        save_baselines(results)
+        print("Saved the baselines in " + BASELINES)
+    else:
+        found = regressions(results, baselines)
+        for regression in found:
+            print("Regression: " + regression)
+        sys.exit(1 if found else 0)
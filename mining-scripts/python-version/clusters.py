@@ -0,0 +1,134 @@
+# Clusters of near-duplicate predicates (e.g. with a renamed variable), by
+# MinHash signatures of their token shingles and locality-sensitive hashing of
+# bands of those signatures, so that a predicate is only compared with the few
+# whose signatures share a band with its own, rather than with all of them.
+
+import re
+import zlib
+import numpy as np
+
+from assertions import remove_whitespace
+
+SHINGLE_SIZE = 2    # tokens per shingle
+NUM_HASHES = 64     # MinHash functions, in BANDS bands of equal rows
+BANDS = 16
+SIMILARITY = 0.5    # least (estimated Jaccard) similarity within a cluster
+SEED = 0            # of the hash functions, so signatures are reproducible
+CHUNK = 1 << 16     # shingles hashed at a time
+
+TOKEN_RE = re.compile(r"[A-Za-z_]\w*|\d[\w.]*|->|&&|\|\||[=!<>]=|<<|>>|"
+        r"\+\+|--|\S")
+
+
+# string -> [string]
+def shingles(predicate):
+    """The C-token shingles of :predicate:"""
+    tokens = TOKEN_RE.findall(predicate)
+    if len(tokens) <= SHINGLE_SIZE:
+        return [" ".join(tokens)]
+    return [" ".join(tokens[i:i+SHINGLE_SIZE])
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+
+
+class PredicateClusters():
+    """Groups predicates whose shingles have a (MinHash-estimated) Jaccard
+    similarity of at least SIMILARITY, in time linear in their number.
+    Each cluster is represented by the first predicate added to it (its
+    leader), which is placed in the LSH buckets of each band of its
+    signature; a new predicate joins the first leader it shares a bucket with
+    that is similar enough, or else leads a new cluster. Predicates equal
+    sans whitespace are always clustered together.
+    Its key method is the grouping key of activity_result and Contexts; keys
+    of predicates not yet added add them.
+    """
+    # iter(string) -> PredicateClusters
+    def __init__(self, predicates=()):
+        rng = np.random.default_rng(SEED)
+        self._a = rng.integers(1, 1 << 64, NUM_HASHES, dtype=np.uint64,
+                endpoint=False) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 64, NUM_HASHES, dtype=np.uint64,
+                endpoint=False)
+        self._leaders = {}      # sans-whitespace predicate -> leader
+        self._signatures = {}   # leader -> signature
+        self._buckets = [{} for _ in range(BANDS)]   # band bytes -> leader
+        self.add(predicates)
+
+    def __len__(self):
+        """The number of clusters"""
+        return len(self._signatures)
+
+    def __repr__(self):
+        return "PredicateClusters(<{p} predicates> <{c} clusters>)".format(
+                p=len(self._leaders), c=len(self))
+
+    def add(self, predicates):
+        """Clusters the (new) :predicates:"""
+        new = {}
+        for p in predicates:
+            key = remove_whitespace(p)
+            if key not in self._leaders and key not in new:
+                new[key] = p
+        if not new:
+            return
+
+        keys, predicates = list(new), list(new.values())
+        signatures = self.signatures(predicates)
+        width = NUM_HASHES // BANDS * signatures.itemsize
+        for key, predicate, signature in zip(keys, predicates, signatures):
+            row = signature.tobytes()
+            bands = [row[b*width:(b+1)*width] for b in range(BANDS)]
+            leader = None
+            for buckets, band in zip(self._buckets, bands):
+                candidate = buckets.get(band)
+                if candidate is not None and np.count_nonzero(signature ==
+                        self._signatures[candidate]) >= SIMILARITY * NUM_HASHES:
+                    leader = candidate
+                    break
+            if leader is None:
+                leader = predicate
+                self._signatures[leader] = signature
+                for buckets, band in zip(self._buckets, bands):
+                    buckets.setdefault(band, leader)
+            self._leaders[key] = leader
+
+    # [string] -> np.ndarray
+    def signatures(self, predicates):
+        """The (len(predicates), NUM_HASHES) MinHash signatures of the
+        shingles of :predicates:
+        """
+        hashes, starts = [], []
+        for p in predicates:
+            starts.append(len(hashes))
+            hashes.extend(zlib.crc32(s.encode()) for s in shingles(p))
+        hashes = np.array(hashes, dtype=np.uint64)
+        starts = np.array(starts, dtype=np.int64)
+
+        signatures = np.empty((len(predicates), NUM_HASHES), dtype=np.uint32)
+        # (by multiply-shift hashing, in chunks of whole predicates)
+        first = 0
+        while first < len(predicates):
+            last = np.searchsorted(starts, starts[first] + CHUNK, side="right")
+            last = max(last, first + 1)
+            end = starts[last] if last < len(predicates) else len(hashes)
+            h = (hashes[starts[first]:end, None] * self._a + self._b) >> \
+                    np.uint64(32)
+            signatures[first:last] = np.minimum.reduceat(h,
+                    starts[first:last] - starts[first], axis=0)
+            first = last
+        return signatures
+
+    # string -> string
+    def key(self, predicate):
+        """The leader of the cluster of :predicate:"""
+        leader = self._leaders.get(remove_whitespace(predicate))
+        if leader is None:
+            self.add([predicate])
+            leader = self._leaders[remove_whitespace(predicate)]
+        return leader
+
+    def clusters(self):
+        """The predicates (sans whitespace) of each cluster, by leader"""
+        clusters = {}
+        for key, leader in self._leaders.items():
+            clusters.setdefault(leader, []).append(key)
+        return clusters
@@ -0,0 +1,396 @@
+# A columnar, memory-mapped alternative to pickled Histories.
+# A store is a directory of .npy files, one per column of the commit, file and
+# assertion tables, with strings coded as integers into a shared string table.
+# Columns are only read from disk when first used, so e.g. counting assertion
+# events per predicate doesn't load (nor unpickle) the rest of the History.
+
+import os
+import json
+import itertools
+import numpy as np
+
+from assertions import History, Diff, File, Assertion, Change, intern, \
+        open_repository, has_extension, assertion_iter, parse_assertions
+
+VERSION = 1
+CHANGES = list(Change)  # codes of the change column
+
+# History string -> None
+def save_columns(history, dirname):
+    """Writes :history: into the columnar store :dirname:. The ASTs aren't
+    kept; to_history parses them again.
+    """
+    strings = {}    # string -> code
+    def code(s):
+        return -1 if s is None else strings.setdefault(s, len(strings))
+
+    index = {d.rvn_id: i for i, d in enumerate(history.diffs)}
+    columns = {k: [] for k in ["commit_id", "commit_author", "commit_atime",
+        "commit_ctime", "commit_parents", "commit_parents_ptr",
+        "commit_children", "commit_children_ptr", "commit_files_ptr",
+        "file_name", "file_assertions_ptr", "name", "predicate",
+        "function_name", "problem", "raw_lines", "change", "inspect",
+        "problematic", "unparseable", "file_lineno", "hunk_lineno", "hunkno",
+        "num_lines", "change_lineno"]}
+    columns["commit_parents_ptr"].append(0)
+    columns["commit_children_ptr"].append(0)
+    columns["commit_files_ptr"].append(0)
+    columns["file_assertions_ptr"].append(0)
+    diff_repo_path = None
+
+    for diff in history.diffs:
+        diff_repo_path = diff_repo_path or getattr(diff, "repo_path", None)
+        columns["commit_id"].append(diff.rvn_id.encode())
+        columns["commit_author"].append(code(diff.author))
+        columns["commit_atime"].append(diff.author_time)
+        columns["commit_ctime"].append(diff.commit_time)
+        columns["commit_parents"].extend(index[p] for p in diff.parents)
+        columns["commit_parents_ptr"].append(len(columns["commit_parents"]))
+        columns["commit_children"].extend(index[c] for c in diff.children)
+        columns["commit_children_ptr"].append(len(columns["commit_children"]))
+
+        for file in diff.files:
+            columns["file_name"].append(code(file.name))
+            for inspect, a in itertools.chain(
+                    zip(itertools.repeat(False), file.assertions),
+                    zip(itertools.repeat(True), file.to_inspect)):
+                columns["name"].append(code(a.name))
+                columns["predicate"].append(code(a.predicate))
+                columns["function_name"].append(code(a.function_name))
+                columns["problem"].append(code(a.problem
+                    if a.problem is not False else None))
+                columns["raw_lines"].append(code("\0".join(a.raw_lines)
+                    if a.problematic else None))
+                columns["change"].append(CHANGES.index(a.change))
+                columns["inspect"].append(inspect)
+                columns["problematic"].append(a.problematic)
+                columns["unparseable"].append(a.unparseable)
+                for k in ["file_lineno", "hunk_lineno", "hunkno", "num_lines",
+                        "change_lineno"]:
+                    columns[k].append(getattr(a, k))
+            columns["file_assertions_ptr"].append(len(columns["name"]))
+        columns["commit_files_ptr"].append(len(columns["file_name"]))
+
+    os.makedirs(dirname, exist_ok=True)
+    def save(name, values, dtype):
+        np.save(os.path.join(dirname, name + ".npy"),
+                np.array(values, dtype=dtype))
+
+    for name, values in columns.items():
+        if name == "commit_id":
+            width = max((len(v) for v in values), default=1)
+            save(name, values, "S{w}".format(w=width))
+        elif name in ["commit_atime", "commit_ctime"]:
+            save(name, np.array(values, dtype=np.int64).reshape(-1, 2),
+                    np.int64)
+        elif name.endswith("_ptr"):
+            save(name, values, np.int64)
+        elif name in ["inspect", "problematic", "unparseable"]:
+            save(name, values, np.bool_)
+        elif name == "change":
+            save(name, values, np.int8)
+        else:
+            save(name, values, np.int32)
+
+    encoded = [s.encode("utf-8", "surrogateescape") for s in strings]
+    save("strings", np.frombuffer(b"".join(encoded), dtype=np.uint8), np.uint8)
+    save("strings_ptr", np.cumsum([0] + [len(e) for e in encoded]), np.int64)
+
+    with open(os.path.join(dirname, "meta.json"), 'w') as f:
+        json.dump({"version": VERSION, "repo_path": history.repo_path,
+            "branch": history.branch, "diff_repo_path": diff_repo_path}, f)
+
+# string -> ColumnarHistory
+def load_columns(dirname):
+    return ColumnarHistory(dirname)
+
+# ColumnarHistory [predast.ASTCache] -> History
+def to_history(columns, ast_cache=None):
+    """Produces the History stored in :columns:, parsing its ASTs again"""
+    history = History(columns.repo_path, columns.branch)
+    for diff in columns.diffs:
+        history._diffs[diff.rvn_id] = diff.to_diff()
+    parse_assertions(list(assertion_iter(history)), ast_cache=ast_cache)
+    return history
+
+
+class ColumnarHistory():
+    """A History stored by save_columns, whose columns are memory-mapped when
+    first used. It can be used as a (read-only) History: its diffs, files and
+    assertions are views of their rows, created as needed (without ASTs).
+    """
+    # string -> ColumnarHistory
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(os.path.join(dirname, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != VERSION:
+            raise ValueError("Unsupported columnar History version: {v}"
+                    .format(v=meta["version"]))
+        self.repo_path = meta["repo_path"]
+        self.branch = meta["branch"]
+        self.diff_repo_path = meta["diff_repo_path"]
+        self._strings = {}      # code -> string
+        self._diffs = None      # [DiffView], once needed
+
+    def __getattr__(self, column):
+        """Memory-maps the column when first used"""
+        if column in ColumnarHistory.DERIVED:
+            values = ColumnarHistory.DERIVED[column](self)
+        else:
+            path = os.path.join(self.__dict__["dirname"], column + ".npy")
+            if column.startswith("_") or not os.path.exists(path):
+                raise AttributeError(column)
+            values = np.load(path, mmap_mode='r')
+        setattr(self, column, values)
+        return values
+
+    DERIVED = { # columns computed from the stored ones
+        "assertion_file": lambda self: np.repeat(np.arange(len(self.file_name)),
+            np.diff(self.file_assertions_ptr)),    # file row of each assertion
+        "file_commit": lambda self: np.repeat(np.arange(len(self.commit_id)),
+            np.diff(self.commit_files_ptr)),       # commit row of each file
+    }
+
+    def string(self, code):
+        """The string coded as :code: in the string columns"""
+        if code < 0:
+            return None
+        s = self._strings.get(code)
+        if s is None:
+            start, end = self.strings_ptr[code], self.strings_ptr[code+1]
+            s = intern(bytes(self.strings[start:end])
+                    .decode("utf-8", "surrogateescape"))
+            self._strings[code] = s
+        return s
+
+    def __len__(self):
+        return len(self.commit_id)
+
+    # string... -> array[Boolean]
+    def file_name_mask(self, *substrings, lower=False):
+        """Which file rows have a name containing any of the substrings"""
+        codes = np.unique(self.file_name)
+        matching = [c for c in codes if any(s in (self.string(c).lower()
+            if lower else self.string(c)) for s in substrings)]
+        return np.isin(self.file_name, matching)
+
+    # (As History.assertions)
+    def assertion_mask(self, confirmed=True, unparseable=True,
+            problematic=False, change=None, testfiles=False, headers=True):
+        """Which assertion rows History.assertions would produce (without
+        its filterfun)
+        """
+        mask = np.zeros(len(self.name), dtype=np.bool_)
+        if confirmed:
+            mask |= ~self.inspect
+        if problematic:
+            mask |= self.inspect
+        if not unparseable:
+            mask &= ~self.unparseable
+        if change is not None:
+            mask &= self.change == CHANGES.index(change)
+
+        files = np.ones(len(self.file_name), dtype=np.bool_)
+        if not testfiles:
+            files &= ~self.file_name_mask("test", lower=True)
+        if not headers:
+            codes = np.unique(self.file_name)
+            files &= ~np.isin(self.file_name, [c for c in codes
+                if has_extension(self.string(c), ["h", "H"])])
+        return mask & files[self.assertion_file]
+
+    @property
+    def diffs(self):
+        if self._diffs is None:
+            self._diffs = [DiffView(self, i) for i in range(len(self))]
+            self._index = {d.rvn_id: d for d in self._diffs}
+        return self._diffs
+
+    def get_diff(self, commit_id):
+        self.diffs
+        return self._index[commit_id]
+
+    def __contains__(self, commit_id):
+        self.diffs
+        return commit_id in self._index
+
+    def __iter__(self):
+        # (As History: all the confirmed assertions, then the problematic ones)
+        rows = itertools.chain(np.flatnonzero(~self.inspect),
+                np.flatnonzero(self.inspect))
+        return (self.assertion(row) for row in rows)
+
+    def show(self):
+        for a in self:
+            print(a.info())
+
+    def assertions(self, confirmed=True, unparseable=True, problematic=False,
+            change=None, testfiles=False, headers=True, filterfun=None):
+        """As History.assertions"""
+        mask = self.assertion_mask(confirmed, unparseable, problematic, change,
+                testfiles, headers)
+        assertions = (self.assertion(row) for row in np.flatnonzero(mask))
+        if filterfun is not None:
+            assertions = (a for a in assertions if filterfun(a))
+        return assertions
+
+    def assertion(self, row):
+        file = self.assertion_file[row]
+        commit = self.file_commit[file]
+        return AssertionView(FileView(self.diffs[commit], file), row)
+
+    def __repr__(self):
+        return "ColumnarHistory('{d}', <{n} diffs>)".format(
+                d=self.dirname, n=len(self))
+
+
+class DiffView():
+    """A Diff of a ColumnarHistory. Analyses may set its delta."""
+    __slots__ = ("columns", "row", "delta")
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    @property
+    def rvn_id(self):
+        return self.columns.commit_id[self.row].decode()
+
+    @property
+    def author(self):
+        return self.columns.string(self.columns.commit_author[self.row])
+
+    @property
+    def author_time(self):
+        return tuple(self.columns.commit_atime[self.row].tolist())
+
+    @property
+    def commit_time(self):
+        return tuple(self.columns.commit_ctime[self.row].tolist())
+
+    @property
+    def msg(self):
+        return open_repository(self.columns.diff_repo_path)[self.rvn_id].message
+
+    def _commits(self, column, ptr):
+        start, end = ptr[self.row], ptr[self.row+1]
+        return [self.columns.commit_id[c].decode() for c in column[start:end]]
+
+    @property
+    def parents(self):
+        return self._commits(self.columns.commit_parents,
+                self.columns.commit_parents_ptr)
+
+    @property
+    def children(self):
+        return self._commits(self.columns.commit_children,
+                self.columns.commit_children_ptr)
+
+    @property
+    def files(self):
+        ptr = self.columns.commit_files_ptr
+        return [FileView(self, f) for f in range(ptr[self.row], ptr[self.row+1])]
+
+    def to_diff(self):
+        """The equivalent Diff (with Files and Assertions)"""
+        diff = Diff(commit_id=self.rvn_id, repo_path=self.columns.diff_repo_path)
+        diff.author = self.author
+        diff.author_time = self.author_time
+        diff.commit_time = self.commit_time
+        diff.parents = self.parents
+        diff.children = self.children
+        diff.files = [f.to_file(diff) for f in self.files]
+        return diff
+
+    def __str__(self):
+        return "Diff: {id}".format(id=self.rvn_id)
+
+
+class FileView():
+    """A File of a ColumnarHistory"""
+    __slots__ = ("parent_diff", "row")
+
+    def __init__(self, parent_diff, row):
+        self.parent_diff = parent_diff
+        self.row = row
+
+    @property
+    def name(self):
+        columns = self.parent_diff.columns
+        return columns.string(columns.file_name[self.row])
+
+    def _assertions(self, inspect):
+        columns = self.parent_diff.columns
+        ptr = columns.file_assertions_ptr
+        return [AssertionView(self, a) for a in range(ptr[self.row], ptr[self.row+1])
+                if columns.inspect[a] == inspect]
+
+    @property
+    def assertions(self):
+        return self._assertions(False)
+
+    @property
+    def to_inspect(self):
+        return self._assertions(True)
+
+    def to_file(self, diff):
+        file = File(self.name, diff)
+        file.assertions = [a.to_assertion(file) for a in self.assertions]
+        file.to_inspect = [a.to_assertion(file) for a in self.to_inspect]
+        return file
+
+    def __repr__(self):
+        return "File('{n}')".format(n=self.name)
+
+
+class AssertionView():
+    """An Assertion of a ColumnarHistory, without its AST"""
+    __slots__ = ("parent_file", "row")
+
+    def __init__(self, parent_file, row):
+        self.parent_file = parent_file
+        self.row = row
+
+    def _string(self, column):
+        columns = self.parent_file.parent_diff.columns
+        return columns.string(getattr(columns, column)[self.row])
+
+    def _value(self, column):
+        return getattr(self.parent_file.parent_diff.columns, column)[self.row] \
+                .item()
+
+    name = property(lambda self: self._string("name"))
+    predicate = property(lambda self: self._string("predicate"))
+    function_name = property(lambda self: self._string("function_name"))
+    problem = property(lambda self: self._string("problem")
+            if self._value("problem") >= 0 else False)
+    change = property(lambda self: CHANGES[self._value("change")])
+    problematic = property(lambda self: self._value("problematic"))
+    unparseable = property(lambda self: self._value("unparseable"))
+    file_lineno = property(lambda self: self._value("file_lineno"))
+    hunk_lineno = property(lambda self: self._value("hunk_lineno"))
+    hunkno = property(lambda self: self._value("hunkno"))
+    num_lines = property(lambda self: self._value("num_lines"))
+    change_lineno = property(lambda self: self._value("change_lineno"))
+    ast = None
+
+    @property
+    def raw_lines(self):
+        lines = self._string("raw_lines")
+        return [str(self)] if lines is None else lines.split("\0")
+
+    def to_assertion(self, file):
+        """The equivalent Assertion, without its AST"""
+        a = Assertion(self.hunkno, self.file_lineno, self.hunk_lineno,
+                self.num_lines, self.raw_lines, self.name, self.predicate,
+                change=self.change, change_lineno=self.change_lineno,
+                problematic=self.problematic, problem=self.problem,
+                parent_file=file)
+        a.function_name = self.function_name
+        a.unparseable = self.unparseable
+        return a
+
+    __str__ = Assertion.__str__
+    __repr__ = Assertion.__repr__
+    info = Assertion.info
@@ -1,5 +1,4 @@
 from collections import namedtuple
-from itertools import groupby
 from assertions import Change
 from io import StringIO
 
@@ -16,28 +15,76 @@ class Contexts():
     in throughout the history. The :max_add: and :max_rem: fields identify the commits
     that have the most amount of added assertions for the given predicate, as
     well as the most removed. :name: is the assert function-name.
+    The contexts are indexed by predicate, then file, as the assertions are
+    added, so a predicate's contexts are looked up directly (contexts[pred]),
+    and the Diffs of a growing History can be added to them with add_diffs.
+    If given, predicates are grouped by :key: (string -> string) instead, e.g.
+    clusters.PredicateClusters.key for near-duplicates; the :predicate: of a
+    Context is then the key of its predicates.
     """
     Context = namedtuple("Context", ["name", "predicate", "file", "max_add", "max_rem"])
 
-    def __init__(self, history):
+    def __init__(self, history, key=None):
         """Produce most recent context for assert predicates, ordered by most common.
         Includes the assertname for an example assert in a particular file (however,
         other assertnames may also be available.
         """
         self.repo = history.repo_path
-        self.contexts = []
-
-        asserts = sorted(history.assertions(), key=lambda a: a.predicate)
-        pred_asserts = list((pred, list(la)) for pred, la in groupby(asserts, key=lambda a: a.predicate))
-        pred_asserts.sort(key=lambda pred_la: -len(pred_la[1]))
-        for pred, asserts in pred_asserts:
-            by_file = _get_file_asserts(asserts)
-            for name, file, add, rem in by_file:
-                self.contexts.append(Contexts.Context(name, pred, file, add, rem))
+        self.key = key
+        self._index = {}        # predicate -> {filename -> _FileContext}
+        self._counts = {}       # predicate -> number of assertions
+        self._contexts = None
+        self.add_assertions(history.assertions())
+
+    def add_assertions(self, assertions):
+        for a in assertions:
+            predicate = a.predicate if self.key is None else self.key(a.predicate)
+            file_contexts = self._index.get(predicate)
+            if file_contexts is None:
+                file_contexts = self._index[predicate] = {}
+                self._counts[predicate] = 0
+            self._counts[predicate] += 1
+
+            file = a.parent_file
+            context = file_contexts.get(file.name)
+            if context is None:
+                context = file_contexts[file.name] = _FileContext(a.name)
+            context.add(a.change, file.parent_diff.rvn_id)
+        self._contexts = None
+
+    def add_diffs(self, diffs):
+        """Adds the assertions of :diffs:, as History.assertions produces them"""
+        self.add_assertions(a for diff in diffs for file in diff.files
+                if "test" not in file.name.lower() for a in file.assertions)
+
+    @property
+    def contexts(self):
+        """All the Contexts, by predicate, most common first, then by file"""
+        if self._contexts is None:
+            predicates = sorted(self._index,
+                    key=lambda pred: (-self._counts[pred], pred))
+            self._contexts = [c for pred in predicates for c in self[pred]]
+        return self._contexts
+
+    def __getitem__(self, predicate):
+        """The Contexts of :predicate:, by file"""
+        if self.key is not None:
+            predicate = self.key(predicate)
+        file_contexts = self._index.get(predicate, {})
+        return [Contexts.Context(fc.name, predicate, file, fc.max_add, fc.max_rem)
+                for file, fc in sorted(file_contexts.items())]
+
+    def __contains__(self, predicate):
+        if self.key is not None:
+            predicate = self.key(predicate)
+        return predicate in self._index
+
+    def __len__(self):
+        return sum(len(file_contexts) for file_contexts in self._index.values())
 
     def __repr__(self):
         return "Contexts('{r}', length={l})".format(
-                r=self.repo, l=len(self.contexts))
+                r=self.repo, l=len(self))
 
     def __str__(self):
         return self._format()
@@ -58,54 +105,36 @@ class Contexts():
         print(self._format(n))
 
 
-def _get_file_asserts(assertions):
-    """Given list of assertions, return
-    (assertname, filename, added_commit_id, removed_commit_id) for given
-    assertions, for each unique filename.
-    """
-    assertions.sort(key=lambda a: a.parent_file.name)
-    files = groupby(assertions, key=lambda a: a.parent_file.name)
-
-    file_asserts = []
-    for filename, asserts in files:
-        asserts = list(asserts)
-        assertname = asserts[0].name
-        add, rem = _max_add_rem_ids(asserts)
-        file_asserts.append((assertname, filename, add, rem))
-    return file_asserts
-
-
-def _max_add_rem_ids(asserts):
-    """:asserts:    ([Assertions])
-    Produce the id of the commit that contains the most assertion adds, and
-    the commit that has the most removes, of the given assertions.
+class _FileContext():
+    """The counts of the added and removed assertions of a predicate in a file,
+    by commit id, and the (lowest) id of the commit with the most of each.
+    :name: is that of the first assertion.
     """
-    asserts = sorted(asserts, key=lambda a: a.parent_file.parent_diff.rvn_id)
-    add_asserts, rem_asserts = _add_rem_separate(asserts)
-
-    cid_alists_add = list(groupby(add_asserts, key=lambda a: a.parent_file.parent_diff.rvn_id))
-    cid_alists_rem = list(groupby(rem_asserts, key=lambda a: a.parent_file.parent_diff.rvn_id))
-
-    add_max = max(cid_alists_add, key=lambda ca: _len_iter(ca[1]), default=[None])
-    rem_max = max(cid_alists_rem, key=lambda ca: _len_iter(ca[1]), default=[None])
-
-    return add_max[0], rem_max[0]
-
-
-def _add_rem_separate(asserts):
-    add_asserts, rem_asserts = [], []
-
-    for a in asserts:
-        if a.change == Change.added:
-            add_asserts.append(a)
+    __slots__ = ("name", "adds", "rems", "max_add", "max_rem")
+
+    def __init__(self, name):
+        self.name = name
+        self.adds = {}
+        self.rems = {}
+        self.max_add = None
+        self.max_rem = None
+
+    def add(self, change, commit_id):
+        if change == Change.added:
+            self.max_add = _count(self.adds, self.max_add, commit_id)
         else:
-            rem_asserts.append(a)
-
-    return add_asserts, rem_asserts
-
-
-def _len_iter(it):
-    return sum(1 for x in it)
+            self.max_rem = _count(self.rems, self.max_rem, commit_id)
+
+
+def _count(counts, max_id, commit_id):
+    """Counts :commit_id:, producing the new id of the most counted"""
+    count = counts[commit_id] = counts.get(commit_id, 0) + 1
+    if max_id is None:
+        return commit_id
+    max_count = counts[max_id]
+    if count > max_count or (count == max_count and commit_id < max_id):
+        return commit_id
+    return max_id
 
 
 def context_show(pickle):
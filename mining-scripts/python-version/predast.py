@@ -2,6 +2,10 @@
 
 import io
 import re
+import pickle
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
 
 import pycparser
 
@@ -24,6 +28,8 @@ class AST():
         self.ast.show(buf=buf)
         return buf.getvalue()
 
+_stats = {"retries": 0}     # parse_assertion's retries in this process
+
 # string pycparser.c_parser.CParser [Boolean] -> pycparser.c_ast
 def parse_assertion(snippet, parser, num_attempts=0):
     try:
@@ -45,6 +51,7 @@ def parse_assertion(snippet, parser, num_attempts=0):
             raise ParseError(str(err))
 
         snippet = add_typdefs(unknown_types, snippet)
+        _stats["retries"] += 1
         return parse_assertion(snippet, parser, num_attempts+1)
 
 def get_offsetters(snippet):
@@ -70,3 +77,197 @@ def add_typdefs(types, snippet):
     return snippet
 
 
+class ASTCache():
+    """Memoizes the ASTs of predicates, as well as their parse failures.
+    Recently used ones are kept in memory. If given a filename, they are also
+    stored in an SQLite database, so that they can be reused across runs and
+    repositories. The database keeps at most :max_entries: predicates, evicting
+    the least recently used ones. It is emptied when pycparser is upgraded.
+    Usable as a context manager, which closes it.
+    """
+    FLUSH_INTERVAL = 1000   # new or used entries between writes to disk
+    MIN_PARALLEL = 100      # fewer new predicates are parsed serially
+
+    # [string int int] -> ASTCache
+    def __init__(self, filename=None, max_entries=1000000,
+            memory_entries=100000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()     # key -> AST | error string
+        self.new = {}                   # key -> AST | error string, unsaved
+        self.used = set()               # keys to mark as used, unsaved
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0   # of the predicates parsed (misses)
+        self.retries = 0    # parse_assertion's, of the predicates parsed
+
+        self.db = None
+        if filename:
+            self.db = sqlite3.connect(filename, timeout=60)
+            self.db.execute("CREATE TABLE IF NOT EXISTS asts (predicate TEXT "
+                    "PRIMARY KEY, ast BLOB, error TEXT, used INTEGER)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS asts_used ON asts(used)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY "
+                    "KEY, value TEXT)")
+            version = self.db.execute("SELECT value FROM meta WHERE "
+                    "key = 'pycparser'").fetchone()
+            if version is None or version[0] != pycparser.__version__:
+                self.db.execute("DELETE FROM asts")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES "
+                        "('pycparser', ?)", (pycparser.__version__,))
+            self.clock = self.db.execute(
+                    "SELECT COALESCE(MAX(used), 0) FROM asts").fetchone()[0]
+            self.db.commit()
+
+    def __repr__(self):
+        return "ASTCache('{f}', <{m} in memory> <{h} hits> <{s} misses>)".format(
+                f=self.filename, m=len(self.memory), h=self.hits, s=self.misses)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # string [pycparser.c_parser.CParser] -> AST
+    def parse(self, predicate, parser=None):
+        """Produce AST(predicate, parser), reusing the AST of an identical
+        predicate if one was parsed before. Raises ParseError if parsing
+        fails, now or then.
+        """
+        result = self.parse_all([predicate], parser)[0]
+        if isinstance(result, ParseError):
+            raise result
+        return result
+
+    # [string] [pycparser.c_parser.CParser int] -> [AST|ParseError]
+    def parse_all(self, predicates, parser=None, processes=1):
+        """Produce the AST of each predicate, or the ParseError that parsing
+        it raised. The predicates that aren't cached are parsed only once
+        each, by a pool of worker processes if :processes: > 1.
+        """
+        keys = [normalize(p) for p in predicates]
+        results = {}
+        new = OrderedDict()     # key -> predicate
+        for key, predicate in zip(keys, predicates):
+            if key in results or key in new:
+                self.hits += 1
+                continue
+            result = self.get(key)
+            if result is None:
+                self.misses += 1
+                new[key] = predicate
+            else:
+                self.hits += 1
+                results[key] = result
+
+        if processes > 1 and len(new) >= ASTCache.MIN_PARALLEL:
+            chunksize = max(1, len(new) // (4 * processes))
+            with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+                parsed = list(pool.imap(_parse, new.values(), chunksize))
+        else:
+            parser = parser if parser else pycparser.c_parser.CParser()
+            parsed = [_parse(p, parser) for p in new.values()]
+
+        for key, (result, retries) in zip(new, parsed):
+            self.retries += retries
+            if isinstance(result, str):
+                self.failures += 1
+            elif isinstance(result, bytes):
+                result = pickle.loads(result)
+            self.put(key, result)
+            results[key] = result
+
+        return [ParseError(results[key]) if isinstance(results[key], str)
+                else results[key] for key in keys]
+
+    # string -> AST | string | None
+    def get(self, key):
+        """Produce the cached AST or error message of the normalized
+        predicate, or None if it's not cached.
+        """
+        result = self.memory.get(key)
+        if result is not None:
+            self.memory.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute("SELECT ast, error FROM asts WHERE "
+                    "predicate = ?", (key,)).fetchone()
+            if row is not None:
+                result = pickle.loads(row[0]) if row[0] is not None else row[1]
+                self._remember(key, result)
+
+        if result is not None and self.db is not None:
+            self.used.add(key)
+            self._flush_if_full()
+        return result
+
+    # string AST|string -> None
+    def put(self, key, result):
+        self._remember(key, result)
+        if self.db is not None:
+            self.new[key] = result
+            self._flush_if_full()
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _flush_if_full(self):
+        if len(self.new) + len(self.used) >= ASTCache.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write new entries and usage to disk, and evict old entries"""
+        if self.db is None:
+            return
+        self.clock += 1
+        self.db.executemany("INSERT OR REPLACE INTO asts VALUES (?, ?, ?, ?)",
+                ((key, None if isinstance(r, str) else pickle.dumps(r),
+                  r if isinstance(r, str) else None, self.clock)
+                 for key, r in self.new.items()))
+        self.db.executemany("UPDATE asts SET used = ? WHERE predicate = ?",
+                ((self.clock, key) for key in self.used))
+        self.new.clear()
+        self.used.clear()
+
+        count = self.db.execute("SELECT COUNT(*) FROM asts").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute("DELETE FROM asts WHERE predicate IN (SELECT "
+                    "predicate FROM asts ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,))
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+
+_worker = {}    # per-process state of ASTCache.parse_all's pool workers
+
+def _init_worker():
+    _worker["parser"] = pycparser.c_parser.CParser()
+
+# string [pycparser.c_parser.CParser] -> (bytes | string, int)
+def _parse(predicate, parser=None):
+    """Produce the pickled AST of the predicate, or the error message if it
+    fails, and how many times parsing it was retried. ASTs are pickled even
+    when parsed serially, so that they are the same whether parsed in this
+    process, by a worker, or read from disk.
+    """
+    retries = _stats["retries"]
+    try:
+        result = pickle.dumps(AST(predicate,
+            parser if parser else _worker["parser"]))
+    except Exception as err:
+        result = str(err)
+    return result, _stats["retries"] - retries
+
+
+# string -> string
+def normalize(predicate):
+    """Whitespace-insensitive key of a predicate, that preserves its tokens"""
+    return " ".join(predicate.split())
@@ -0,0 +1,149 @@
+# Instrumentation of mining runs: the wall and CPU time of each of their phases
+# (e.g. diffing, scanning hunks, parsing predicates), and counts of what they
+# processed (e.g. commits, hunks, assertions), cheap enough to always record.
+# Profiles merge, so those of worker processes, and of every repo of a corpus,
+# can be added up.
+
+import json
+import time
+from collections import OrderedDict
+
+
+class Profile():
+    """The :phases: of a run, each with its wall and CPU seconds and number
+    of calls, and :counts: of the things it processed. Phases may nest (e.g.
+    "diff" within "mine_repo"), in which case the time of the inner one is
+    also that of the outer one; a phase must not nest within itself. The
+    times of merged Profiles (e.g. of worker processes) are summed, so may
+    exceed the wall time of the run.
+    """
+    def __init__(self):
+        self.phases = OrderedDict()     # name -> Phase
+        self.counts = OrderedDict()     # name -> int
+
+    def __repr__(self):
+        return "Profile(<{p} phases> <{c} counts>)".format(p=len(self.phases),
+                c=len(self.counts))
+
+    def phase(self, name):
+        """The Phase :name:, a context manager that times each call"""
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase()
+        return phase
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other):
+        for name, other_phase in other.phases.items():
+            phase = self.phase(name)
+            phase.wall += other_phase.wall
+            phase.cpu += other_phase.cpu
+            phase.calls += other_phase.calls
+        for name, n in other.counts.items():
+            self.count(name, n)
+        return self
+
+    def __add__(self, other):
+        return Profile().merge(self).merge(other)
+
+    def to_dict(self):
+        return OrderedDict([
+            ("phases", OrderedDict((name, OrderedDict([
+                ("wall", round(phase.wall, 6)), ("cpu", round(phase.cpu, 6)),
+                ("calls", phase.calls)]))
+                for name, phase in self.phases.items())),
+            ("counts", OrderedDict(self.counts)),
+        ])
+
+    @staticmethod
+    def from_dict(d):
+        profile = Profile()
+        for name, p in d["phases"].items():
+            phase = profile.phase(name)
+            phase.wall, phase.cpu, phase.calls = p["wall"], p["cpu"], p["calls"]
+        profile.counts.update(d["counts"])
+        return profile
+
+    def save(self, filename):
+        """Writes the Profile as JSON"""
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+    @staticmethod
+    def load(filename):
+        with open(filename) as f:
+            return Profile.from_dict(json.load(f))
+
+    def report(self):
+        """A table of the phases, and the counts"""
+        lines = ["{p:<20}{w:>12}{c:>12}{n:>12}".format(p="phase", w="wall s",
+                c="cpu s", n="calls")]
+        lines.extend("{p:<20}{w:>12.3f}{c:>12.3f}{n:>12}".format(p=name,
+                w=phase.wall, c=phase.cpu, n=phase.calls)
+                for name, phase in self.phases.items())
+        lines.extend("{n:<20}{c:>12}".format(n=name, c=n)
+                for name, n in self.counts.items())
+        return "\n".join(lines)
+
+
+class Phase():
+    """The total wall and CPU seconds of the calls of a phase, timed by using
+    it as a context manager (as often as it is called, so the Phase is reused
+    rather than one created per call)
+    """
+    __slots__ = ("wall", "cpu", "calls", "_wall", "_cpu")
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+    def __getstate__(self):
+        return (self.wall, self.cpu, self.calls)
+
+    def __setstate__(self, state):
+        self.wall, self.cpu, self.calls = state
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall += time.perf_counter() - self._wall
+        self.cpu += time.process_time() - self._cpu
+        self.calls += 1
+
+
+class NullProfile(Profile):
+    """A Profile that records nothing, for runs that aren't profiled"""
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def count(self, name, n=1):
+        pass
+
+
+class _NullPhase():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_PHASE = _NullPhase()
+NULL = NullProfile()
+
+
+# [string] -> Profile
+def aggregate(filenames):
+    """The sum of the Profiles saved in :filenames:"""
+    total = Profile()
+    for filename in filenames:
+        total.merge(Profile.load(filename))
+    return total
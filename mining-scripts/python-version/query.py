@@ -0,0 +1,160 @@
+# An indexed SQLite table of the assertions of one or more Histories, for
+# answering History.assertions filters, and ad-hoc queries, without walking
+# every diff, file and assertion again.
+
+import sqlite3
+import itertools
+
+from assertions import has_extension
+
+COLUMNS = ["repo", "pos", "commit_id", "file", "extension", "testfile",
+        "header", "name", "predicate", "change", "inspect", "problematic",
+        "unparseable", "file_lineno", "function_name", "problem"]
+INDEXED = ["name", "predicate", "file", "change", "commit_id"]
+
+
+class AssertionIndex():
+    """The assertions of Histories (or ColumnarHistories) added to it, in a
+    table with the columns above, indexed on INDEXED. Each row is an assertion
+    of the repo (a key into the repos table) at the position :pos: in the order
+    of History.assertions; :inspect: is set for those of File.to_inspect, and
+    :testfile: and :header: as History.assertions filters those files.
+    If given a filename, the index is kept in that SQLite database, so that
+    it can be queried again later; adding a History replaces any previous one
+    of the same repo_path. Usable as a context manager, which closes it.
+    """
+    # [string] -> AssertionIndex
+    def __init__(self, filename=":memory:"):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS repos (id INTEGER PRIMARY "
+                "KEY, repo_path TEXT UNIQUE, branch TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS assertions ({c}, PRIMARY "
+                "KEY (repo, pos))".format(c=", ".join(COLUMNS)))
+        for column in INDEXED:
+            self.db.execute("CREATE INDEX IF NOT EXISTS assertions_{c} ON "
+                    "assertions({c})".format(c=column))
+        self.db.commit()
+        self._assertions = {}   # repo_path -> (History, [Assertion])
+
+    def __repr__(self):
+        return "AssertionIndex('{f}')".format(f=self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    # History -> int
+    def add_history(self, history):
+        """Indexes the assertions of :history:, producing its repo key"""
+        self.remove_history(history.repo_path)
+        repo = self.db.execute("INSERT INTO repos (repo_path, branch) VALUES "
+                "(?, ?)", (history.repo_path, history.branch)).lastrowid
+
+        def rows():
+            pos = itertools.count()
+            for diff in history.diffs:
+                for file in diff.files:
+                    testfile = "test" in file.name.lower()
+                    header = has_extension(file.name, ["h", "H"])
+                    basename = file.name.rsplit("/", 1)[-1]
+                    extension = basename.rsplit(".", 1)[-1] \
+                            if "." in basename else ""
+                    for inspect, a in itertools.chain(
+                            zip(itertools.repeat(False), file.assertions),
+                            zip(itertools.repeat(True), file.to_inspect)):
+                        yield (repo, next(pos), diff.rvn_id, file.name,
+                                extension, testfile, header, a.name,
+                                a.predicate, a.change.prefix, inspect,
+                                a.problematic, a.unparseable, a.file_lineno,
+                                a.function_name, a.problem or "")
+
+        self.db.executemany("INSERT INTO assertions VALUES ({p})".format(
+            p=", ".join("?" * len(COLUMNS))), rows())
+        self.db.commit()
+        return repo
+
+    # string -> None
+    def remove_history(self, repo_path):
+        self._assertions.pop(repo_path, None)
+        row = self.db.execute("SELECT id FROM repos WHERE repo_path = ?",
+                (repo_path,)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM assertions WHERE repo = ?", (row[0],))
+            self.db.execute("DELETE FROM repos WHERE id = ?", (row[0],))
+            self.db.commit()
+
+    def query(self, sql, params=()):
+        """Produces the sqlite3.Rows of an ad-hoc query"""
+        return self.db.execute(sql, params).fetchall()
+
+    def assertions(self, history=None, confirmed=True, unparseable=True,
+            problematic=False, change=None, testfiles=False, headers=True,
+            filterfun=None, name=None, predicate=None, file=None,
+            extension=None, where=None, params=()):
+        """As History.assertions, but answered by the index. Given the
+        (indexed) :history:, produces its Assertions; otherwise produces the
+        matching rows of all the repos, as sqlite3.Rows.
+        :name:, :predicate:     include only assertions with this name/predicate
+        :file:                  include only files matching this GLOB pattern
+        :extension:             include only files with this extension
+        :where:, :params:       an additional SQL condition, and its parameters
+        """
+        conditions, values = [], []
+        if history is not None:
+            repo = self.db.execute("SELECT id FROM repos WHERE repo_path = ?",
+                    (history.repo_path,)).fetchone()
+            if repo is None:
+                raise KeyError("History not indexed: " + history.repo_path)
+            conditions.append("repo = ?")
+            values.append(repo[0])
+        if not confirmed:
+            conditions.append("inspect")
+        if not problematic:
+            conditions.append("NOT inspect")
+        if not unparseable:
+            conditions.append("NOT unparseable")
+        if change is not None:
+            conditions.append("change = ?")
+            values.append(change.prefix)
+        if not testfiles:
+            conditions.append("NOT testfile")
+        if not headers:
+            conditions.append("NOT header")
+        for column, value in [("name", name), ("predicate", predicate),
+                ("extension", extension)]:
+            if value is not None:
+                conditions.append(column + " = ?")
+                values.append(value)
+        if file is not None:
+            conditions.append("file GLOB ?")
+            values.append(file)
+        if where is not None:
+            conditions.append("(" + where + ")")
+            values.extend(params)
+
+        rows = self.db.execute("SELECT {c} FROM assertions WHERE {w} "
+                "ORDER BY repo, pos".format(c="pos" if history is not None else "*",
+                    w=" AND ".join(conditions) or "1"), values)
+        if history is not None:
+            assertions = self._history_assertions(history)
+            rows = (assertions[row[0]] for row in rows)
+        if filterfun is not None:
+            rows = (r for r in rows if filterfun(r))
+        return rows
+
+    # History -> [Assertion]
+    def _history_assertions(self, history):
+        """The assertions of :history: by position"""
+        indexed = self._assertions.get(history.repo_path)
+        if indexed is None or indexed[0] is not history:
+            assertions = [a for diff in history.diffs for file in diff.files
+                    for a in itertools.chain(file.assertions, file.to_inspect)]
+            indexed = self._assertions[history.repo_path] = (history, assertions)
+        return indexed[1]
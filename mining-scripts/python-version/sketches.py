@@ -0,0 +1,138 @@
+# Sketches: summaries of unbounded streams in bounded memory, with bounded
+# error, which merge, so that the statistics of a whole corpus of repos can be
+# estimated from those of each, without ever counting every distinct key.
+
+import math
+import hashlib
+import numpy as np
+
+
+# string -> int
+def hash64(key):
+    """A 64-bit hash of :key:, the same in every process (unlike hash)"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(),
+            "little")
+
+
+def _bit_length(x):
+    """The bit lengths of the uint64s :x:"""
+    def bit_length32(x):
+        return np.where(x > 0, np.frexp(x.astype(np.float64))[1], 0)
+    high = x >> np.uint64(32)
+    return np.where(high > 0, 32 + bit_length32(high),
+            bit_length32(x & np.uint64(0xFFFFFFFF)))
+
+
+class HyperLogLog():
+    """Estimates the number of distinct keys added, with a relative standard
+    error of about :error:, in 2**p bytes (p = 14 for 1%)
+    """
+    def __init__(self, error=0.01):
+        self.p = max(4, math.ceil(math.log2((1.04 / error)**2)))
+        self.registers = np.zeros(1 << self.p, dtype=np.uint8)
+
+    def __repr__(self):
+        return "HyperLogLog(p={p}, ~{n})".format(p=self.p, n=round(len(self)))
+
+    def add(self, keys):
+        """Adds the (string) :keys:"""
+        hashes = np.fromiter((hash64(k) for k in keys), dtype=np.uint64)
+        bits = 64 - self.p
+        index = (hashes >> np.uint64(bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        rank = (bits + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("HyperLogLogs of different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def __len__(self):
+        return round(self.count())
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)     # (linear counting)
+        return float(estimate)
+
+
+class HeavyHitters():
+    """The (approximately) most frequent keys of a weighted stream, by the
+    Misra-Gries algorithm, in O(1/:error:) space: every key with more than
+    :error: of the total weight is kept, and each kept key's count is under by
+    at most error_bound() (<= error * total). With each key's count, its
+    :value: (the last added) and :parts: (weights it was added with, since
+    it was last kept) are kept too.
+    """
+    def __init__(self, error=0.001):
+        self.capacity = math.ceil(1 / error)
+        self.counters = {}      # key -> [count, value, parts]
+        self.total = 0
+        self.decremented = 0
+
+    def __repr__(self):
+        return "HeavyHitters(capacity={c}, <{n} keys>)".format(
+                c=self.capacity, n=len(self.counters))
+
+    def __len__(self):
+        return len(self.counters)
+
+    def add(self, key, weight=1, value=None, parts=()):
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is None:
+            self.counters[key] = [weight, value, list(parts)]
+            if len(self.counters) > 2 * self.capacity:
+                self._compact()
+        else:
+            counter[0] += weight
+            counter[1] = value
+            counter[2] = [p + q for p, q in zip(counter[2], parts)]
+
+    def merge(self, other):
+        for key, (count, value, parts) in other.counters.items():
+            counter = self.counters.get(key)
+            if counter is None:
+                self.counters[key] = [count, value, list(parts)]
+            else:
+                counter[0] += count
+                counter[1] = value
+                counter[2] = [p + q for p, q in zip(counter[2], parts)]
+        self.total += other.total
+        self.decremented += other.decremented
+        if len(self.counters) > 2 * self.capacity:
+            self._compact()
+        return self
+
+    def _compact(self):
+        """Subtracts the (capacity+1)th largest count from every count,
+        dropping those that are no longer positive
+        """
+        counts = np.fromiter((c[0] for c in self.counters.values()),
+                dtype=np.int64, count=len(self.counters))
+        threshold = int(np.partition(counts, -(self.capacity + 1))
+                [-(self.capacity + 1)])
+        self.decremented += threshold
+        self.counters = {key: c for key, c in self.counters.items()
+                if c[0] > threshold}
+        for c in self.counters.values():
+            c[0] -= threshold
+
+    def error_bound(self):
+        """The most any kept count is under by"""
+        return self.decremented
+
+    def top(self, k=None):
+        """The (key, count, value, parts) of the k (or all kept) most frequent
+        keys, most first
+        """
+        items = sorted(self.counters.items(), key=lambda kc: -kc[1][0])
+        return [(key, count, value, parts)
+                for key, (count, value, parts) in items[:k]]
@@ -1,7 +1,37 @@
 import unittest
+import pickle
+import pygit2
+import os
+import tempfile
+import io
+import time
+import json
+import contextlib
+import sys
+import csv
+import bisect
+import random
+import multiprocessing
+import resource
+import subprocess
+import predast
+import columnar
+import query
+import analysis
+import contexts
+import clusters
+import activity
+import sketches
+import benchmark
+import profiling
+import assertions
+import walk_repos
 from assertions import *
 from collections import namedtuple
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import cdf
+
 # To run all tests:
 # python3 test_assertions.py
 
@@ -45,6 +75,23 @@ class TestRegex(unittest.TestCase):
         actual_matches = [m.group() for m in matches]
         self.assertEqual(actual_matches, expected_matches)
 
+    def test_required_literals(self):
+        self.assertEqual(required_literals("assert"), ["assert"])
+        self.assertEqual(required_literals("(assert|ASSERT|BUG_ON)"),
+                ["ASSERT", "BUG_ON", "assert"])
+        self.assertEqual(required_literals(
+                    r"\w*(ASSERT|assert|BUG_ON|bug_on|DCHECK)\w*|ut_ad?"),
+                ["ASSERT", "BUG_ON", "DCHECK", "assert", "bug_on", "ut_a"])
+        self.assertIsNone(required_literals("[aA][sS][sS][Ee][Rr][Tt]|BUG_ON"))
+        self.assertIsNone(required_literals("(?i)assert"))
+        self.assertIsNone(required_literals(r"\w+"))
+
+        matcher = AssertionMatcher("assert|BUG_ON")
+        self.assertFalse(matcher.search("int a;\n\tASSERT(a);\n"))
+        self.assertTrue(matcher.search("int a;\n\tBUG_ON(a);\n"))
+        self.assertEqual(matcher.literals_re.pattern, "BUG_ON|assert")
+        self.assertTrue(AssertionMatcher(r"\w+").search("x"))
+
     def test_strip_parens(self):
         self.assertEqual(strip_parens("   (abc)   "), "abc")
         self.assertEqual(strip_parens("(abc)   "), "abc")
@@ -82,6 +129,72 @@ class TestRegex(unittest.TestCase):
         test_header("@@ -53 +53 @@ struct __packed __attribute__((aligned (64))) xsave_struct", "")
 
 
+    def test_function_contexts(self):
+        Hunk = namedtuple("Hunk", ["header", "lines"])
+        Line = namedtuple("Line", ["origin", "content"])
+        hunk = Hunk("@@ -10,12 +10,14 @@ static int outer(int a)\n", [
+            Line("+", "\tassert(a);\n"),
+            Line(" ", "}\n"),
+            Line(" ", "\n"),
+            Line(" ", "void first(int b)\n"),
+            Line(" ", "{\n"),
+            Line("-", "\tASSERT(b == 1);\n"),
+            Line("+", "\tASSERT(b == 2);\n"),
+            Line(" ", "}\n"),
+            Line("-", "int second(void)\n"),
+            Line("+", "int renamed(void)\n"),
+            Line(" ", "{\n"),
+            Line("+", "\tBUG_ON(c);\n")])
+
+        # Each run of changed lines gets the closest preceding function
+        # line of the old file, or else that of the hunk header
+        self.assertEqual(function_contexts(hunk),
+                ["outer", "", "", "", "", "first", "first", "", "first",
+                 "first", "", "second"])
+
+
+class TestASTCache(unittest.TestCase):
+    def test_memoized(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "asts.sqlite")
+            with predast.ASTCache(filename) as cache:
+                ast = cache.parse("a == b")
+                self.assertIs(cache.parse(" a  ==\tb "), ast)
+                with self.assertRaises(predast.ParseError):
+                    cache.parse("a ==")
+                with self.assertRaises(predast.ParseError):
+                    cache.parse("a ==")
+                self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+            # persisted across runs
+            with predast.ASTCache(filename) as cache:
+                self.assertEqual(str(cache.parse("a == b")), str(ast))
+                with self.assertRaises(predast.ParseError):
+                    cache.parse("a ==")
+                self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_parallel(self):
+        predicates = ["a == {n}".format(n=n % 150) for n in range(300)]
+        predicates.append("a ==")
+        serial = predast.ASTCache().parse_all(predicates)
+        parallel = predast.ASTCache().parse_all(predicates, processes=2)
+        self.assertEqual([str(ast) for ast in serial],
+                [str(ast) for ast in parallel])
+        self.assertIsInstance(parallel[-1], predast.ParseError)
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "asts.sqlite")
+            with predast.ASTCache(filename, max_entries=2) as cache:
+                cache.parse("a")
+                cache.flush()
+                cache.parse("b")
+                cache.parse("c")
+            with predast.ASTCache(filename) as cache:
+                self.assertIsNone(cache.get("a"))
+                self.assertIsNotNone(cache.get("c"))
+
+
 class TestMineRepo(unittest.TestCase):
     TEST_REPO = "tressa_test_repo"
 
@@ -521,6 +634,698 @@ class TestCommit():
         tc.files = [TestFile.from_file(f) for f in diff.files]
         return tc
 
+class TestParallelMining(unittest.TestCase):
+    def test_identical_history(self):
+        """Mining with worker processes must pickle to the same bytes as
+        mining serially"""
+        serial = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        parallel = mine_repo("assert", TestMineRepo.TEST_REPO, "master",
+                processes=3)
+        self.assertEqual(pickle.dumps(serial), pickle.dumps(parallel))
+
+
+class TestIncrementalMining(unittest.TestCase):
+    def test_resume(self):
+        """Extending a History missing its latest commits must produce the
+        same History as mining from scratch"""
+        # (sharing the ASTs of identical predicates, as in one run)
+        ast_cache = predast.ASTCache()
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master",
+                ast_cache=ast_cache)
+        expected = pickle.dumps(history)
+
+        for commit_id in reversed(list(history._diffs)[-3:]):
+            diff = history._diffs.pop(commit_id)
+            for parent_id in diff.parents:
+                history.get_diff(parent_id).children.remove(commit_id)
+
+        mine_repo("assert", TestMineRepo.TEST_REPO, "master", history=history,
+                ast_cache=ast_cache)
+        self.assertEqual(pickle.dumps(history), expected)
+
+
+class TestStreamMining(unittest.TestCase):
+    def test_stream(self):
+        """Reading back a streamed repo must produce the mined History"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        diffs = stream_repo("assert", TestMineRepo.TEST_REPO, "master")
+        with tempfile.TemporaryDirectory() as tmp:
+            pickle_file = os.path.join(tmp, "repo.pickle")
+            asserts_file = os.path.join(tmp, "repo.asserts")
+            dump_stream(diffs, TestMineRepo.TEST_REPO, "master", pickle_file,
+                    asserts_file)
+            with open(pickle_file, 'rb') as f:
+                streamed = read_stream(pickle.load(f), f)
+            with open(asserts_file) as f:
+                self.assertEqual(f.read(), "".join(a.info() + "\n"
+                    for a in history))
+
+        self.assertEqual([(d.rvn_id, d.parents, d.children)
+                            for d in streamed.diffs],
+                         [(d.rvn_id, d.parents, d.children)
+                            for d in history.diffs])
+        self.assertEqual([a.info() for a in streamed],
+                         [a.info() for a in history])
+
+
+class TestDeltaFilters(unittest.TestCase):
+    FILES = {"src/a.c": b"assert(a > 0);\n", "other/b.c": b"assert(b > 0);\n",
+            "src/big.c": b"assert(c > 0);\n" + b"/* padding */\n" * 200,
+            "src/d.txt": b"assert(d > 0);\n"}
+
+    def setUp(self):
+        self.addCleanup(setattr, assertions, "PATHSPEC", assertions.PATHSPEC)
+        self.addCleanup(setattr, assertions, "MAX_FILE_SIZE",
+                assertions.MAX_FILE_SIZE)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+        repo = pygit2.init_repository(self.path, bare=True)
+        signature = pygit2.Signature("A", "a@b", 1500000000, 0)
+        parents = []
+        for n in range(2):  # (a root commit, and a diffed one)
+            files = {p: c.replace(b"0)", str(n).encode() + b")")
+                    for p, c in self.FILES.items()}
+            tree = benchmark._write_tree(repo, {p: repo.create_blob(c)
+                for p, c in files.items()})
+            parents = [repo.create_commit(None, signature, signature,
+                "c{n}".format(n=n), tree, parents)]
+        repo.references.create("refs/heads/master", parents[0])
+
+    def mine(self):
+        profile = profiling.Profile()
+        history = mine_repo("assert", self.path, "master", profile=profile)
+        mined = {f.name for d in history.diffs for f in d.files
+                if f.assertions}
+        return mined, profile.counts["patches"]
+
+    def test_extensions(self):
+        self.assertEqual(self.mine(),
+                ({"src/a.c", "other/b.c", "src/big.c"}, 6))
+
+    def test_pathspec_and_size(self):
+        """Excluded and oversized files must not even have their patches
+        generated"""
+        assertions.PATHSPEC = ["src/*"]
+        assertions.MAX_FILE_SIZE = 1000
+        self.assertEqual(self.mine(), ({"src/a.c"}, 2))
+        self.assertEqual(assertions._object_sizes, {})
+
+    def test_blob_size(self):
+        self.addCleanup(assertions.close_object_sizes)
+        repo = pygit2.Repository(self.path)
+        commit = repo.revparse_single("master")
+        for delta in repo.diff(commit.parents[0], commit).deltas:
+            self.assertFalse(delta.new_file.flags &
+                    pygit2.GIT_DIFF_FLAG_VALID_SIZE)
+            self.assertEqual(blob_size(delta.new_file, repo),
+                    repo[delta.new_file.id].size)
+
+    def test_object_sizes_close(self):
+        """The cat-file process must be ended, not left a zombie"""
+        with assertions.ObjectSizes(self.path) as sizes:
+            with self.assertRaises(KeyError):
+                sizes.size(pygit2.Oid(hex="0" * 40))
+        self.assertEqual(sizes.process.returncode, 0)
+
+
+class TestCompact(unittest.TestCase):
+    def test_unslotted_state(self):
+        """Diffs and Assertions pickled before they had __slots__ must load"""
+        diff = Diff.__new__(Diff)
+        diff.__setstate__({"parents": [], "children": [], "files": [],
+                           "rvn_id": "abc", "msg": "Fix\n"})
+        self.assertEqual(diff.msg, "Fix\n")
+
+        a = Assertion(0, 1, 0, 1, ["assert(x);"], "assert", "x")
+        self.assertEqual(a.raw_lines, ["assert(x)"])
+        state = a.__getstate__()
+        del state["_raw_lines"]
+        state["raw_lines"] = ["assert(x);"]
+        a = Assertion.__new__(Assertion)
+        a.__setstate__(state)
+        self.assertEqual(a.raw_lines, ["assert(x);"])
+        self.assertEqual(str(a), "assert(x)")
+
+    def test_msg_without_repo(self):
+        """The message of a Diff analyzed without its repo must be None"""
+        with tempfile.TemporaryDirectory() as tmp:
+            benchmark.make_repo(os.path.join(tmp, "repo.git"), commits=1)
+            for repo_path in [os.path.join(tmp, "repo.git"),
+                              os.path.join(tmp, "gone.git")]:
+                diff = Diff(commit_id="0" * 40, repo_path=repo_path)
+                diff.author = "A"
+                self.assertIsNone(diff.msg)
+                self.assertEqual(repr(diff), "Diff('0000000', 'A', '', <0 files>)")
+
+
+class TestColumnar(unittest.TestCase):
+    def test_roundtrip(self):
+        """A columnar History must have the same assertions as the original,
+        and convert back to it"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        with tempfile.TemporaryDirectory() as tmp:
+            columnar.save_columns(history, tmp)
+            columns = columnar.load_columns(tmp)
+            self.assertEqual([a.info() for a in columns],
+                             [a.info() for a in history])
+            self.assertEqual(
+                [a.info() for a in columns.assertions(problematic=True)],
+                [a.info() for a in history.assertions(problematic=True)])
+
+            converted = columnar.to_history(columns)
+            self.assertEqual([(d.rvn_id, d.parents, d.children, d.author_time)
+                                for d in converted.diffs],
+                             [(d.rvn_id, d.parents, d.children, d.author_time)
+                                for d in history.diffs])
+            self.assertEqual([(a.info(), str(a.ast)) for a in converted],
+                             [(a.info(), str(a.ast)) for a in history])
+
+
+class TestAssertionIndex(unittest.TestCase):
+    def test_filters(self):
+        """The index must produce the same assertions as History.assertions"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        with query.AssertionIndex() as index:
+            index.add_history(history)
+            for kwargs in [{}, {"problematic": True, "testfiles": True},
+                    {"confirmed": False, "problematic": True},
+                    {"unparseable": False, "headers": False},
+                    {"change": Change.removed, "testfiles": True}]:
+                self.assertEqual(list(index.assertions(history, **kwargs)),
+                                 list(history.assertions(**kwargs)))
+            rows = index.assertions(change=Change.added, testfiles=True)
+            self.assertEqual([r["predicate"] for r in rows],
+                    [a.predicate for a in history.assertions(
+                        change=Change.added, testfiles=True)])
+
+
+class TestCommitGraph(unittest.TestCase):
+    def test_delta_counts(self):
+        """The CommitGraph must count the same deltas as insert_deltas"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        graph = analysis.CommitGraph(history)
+        graph.compute_deltas()
+        analysis.insert_deltas(history)
+        for change in [Change.added, Change.removed, None]:
+            self.assertEqual(graph.delta_counts(change),
+                             analysis.delta_counts(history, change))
+        self.assertEqual(graph.linearity_score(),
+                         analysis.linearity_score(history))
+
+    def test_all_results(self):
+        """The single pass must produce the same results as each analysis"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        results, scores, problems = analysis.all_results(history)
+        deltas, delta_scores = analysis.delta_results(history)
+        expected = [analysis.names_result(history),
+                    analysis.activity_result(history)] + list(deltas)
+        self.assertEqual([list(r.datapoints) for r in results.values()],
+                         [list(r.datapoints) for r in expected])
+        self.assertEqual(scores, delta_scores)
+        self.assertEqual(problems, analysis.problematics(history))
+
+    def test_merge(self):
+        """At a merge, the distance to an assertion is along the shorter path:
+        0 (assert) -> 1 -> 2 -> 4 (merge) -> 5 (assert) -> 6 (merge, assert),
+        0 -> 3 -> 4, and 3 -> 6
+        """
+        history = History("", "")
+        parents = {"0": [], "1": ["0"], "2": ["1"], "3": ["0"],
+                   "4": ["2", "3"], "5": ["4"], "6": ["3", "5"]}
+        for commit_id, commit_parents in parents.items():
+            diff = Diff(commit_id=commit_id)
+            t = (100 * int(commit_id), 0)
+            diff.author_time = diff.commit_time = t
+            diff.parents = commit_parents
+            diff.children = [c for c, ps in parents.items() if commit_id in ps]
+            if commit_id in "056":
+                file = File("a.c", diff)
+                file.assertions.append(Assertion(0, 0, 0, 1, [], "assert",
+                    "x", Change.added, parent_file=file))
+                diff.files.append(file)
+            history.update_diff(diff)
+
+        graph = analysis.CommitGraph(history)
+        graph.compute_deltas()
+        self.assertEqual(graph.commit_dist.tolist()[5:], [3, 1])
+        self.assertEqual(graph.atime_dur.tolist()[5:], [500, 100])
+        analysis.insert_deltas(history)
+        self.assertEqual([history.get_diff(c).delta.commit_dist
+                          for c in "56"], [3, 1])
+        self.assertEqual(graph.delta_counts(), analysis.delta_counts(history))
+
+    def test_short_histories(self):
+        """Histories of fewer than two commits are monotonic and linear"""
+        history = History("", "")
+        for i in range(2):
+            graph = analysis.CommitGraph(history)
+            graph.compute_deltas()
+            self.assertEqual(graph.monotonicity_score(), 1.0)
+            self.assertEqual(graph.linearity_score(), 1.0)
+            self.assertEqual(analysis.monotonicity_score(history), 1.0)
+            self.assertEqual(analysis.linearity_score(history), 1.0)
+            diff = Diff(commit_id=str(i))
+            diff.author_time = diff.commit_time = (100, 0)
+            history.update_diff(diff)
+            analysis.insert_deltas(history)
+
+    def test_times(self):
+        """The vectorized times must agree with those of make_time"""
+        history = History("", "")
+        times = [((100, 60), (100, 60)), ((50, -120), (200, 0)),
+                 ((86500, 0), (86400, 0)), ((86300, 30), (86300, 30))]
+        for i, (atime, ctime) in enumerate(times):
+            diff = Diff(commit_id=str(i))
+            diff.author_time, diff.commit_time = atime, ctime
+            history.update_diff(diff)
+        atimes, ctimes = analysis.commit_times(history)
+        self.assertEqual(analysis.out_of_orders(atimes), 2)
+        self.assertEqual(analysis.monotonicity_score(history), 1 - 2/3)
+        self.assertEqual(analysis.onecommit_score(history), 0.5)
+        for t2, t1 in zip(atimes.tolist(), ctimes.tolist()):
+            dtime = analysis.make_time(t2) - analysis.make_time(t1)
+            self.assertEqual(analysis.time_diff(t2, t1), dtime)
+            self.assertEqual(analysis.duration_days(
+                analysis.time_diffs([t2], [t1]))[0], dtime.days)
+
+
+class TestContexts(unittest.TestCase):
+    def test_incremental(self):
+        """Contexts built from a History's Diffs in parts must be the same"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        whole = contexts.Contexts(history)
+        self.assertTrue(whole.contexts)
+        parts = contexts.Contexts(History(history.repo_path, history.branch))
+        diffs = list(history.diffs)
+        parts.add_diffs(diffs[:len(diffs)//2])
+        parts.add_diffs(diffs[len(diffs)//2:])
+        self.assertEqual(parts.contexts, whole.contexts)
+
+        predicate = whole.contexts[0].predicate
+        self.assertIn(predicate, whole)
+        self.assertEqual(whole[predicate], [c for c in whole.contexts
+                                            if c.predicate == predicate])
+        self.assertEqual(whole["no such predicate"], [])
+
+    def test_max_add_rem(self):
+        history = History("", "")
+        for i, changes in enumerate([["+", "+", "-"], ["+", "-", "-"], ["+"]]):
+            diff = Diff(commit_id=str(i))
+            file = File("a.c", diff)
+            for change in changes:
+                file.assertions.append(Assertion(0, 0, 0, 1, [], "assert", "a",
+                    Change.added if change == "+" else Change.removed,
+                    parent_file=file))
+            diff.files.append(file)
+            history.update_diff(diff)
+        self.assertEqual(contexts.Contexts(history).contexts,
+                         [contexts.Contexts.Context("assert", "a", "a.c", "0", "1")])
+
+
+class TestHistoryView(unittest.TestCase):
+    def test_pickaxe(self):
+        """Balanced adds and removes must be filtered out, without copying"""
+        history = History("", "")
+        diff = Diff(commit_id="0")
+        file = File("a.c", diff)
+        for name, change in [("a", Change.added), ("b", Change.added),
+                             ("a", Change.removed)]:
+            file.assertions.append(Assertion(0, 0, 0, 1, [], "assert", name,
+                change, parent_file=file))
+        diff.files.append(file)
+        history.update_diff(diff)
+
+        view = analysis.pickaxe_history(history)
+        self.assertEqual([a.predicate for a in view.assertions()], ["b"])
+        self.assertEqual(len(file.assertions), 3)
+        view_file = next(iter(view.diffs)).files[0]
+        self.assertEqual(view_file.name, "a.c")
+        self.assertIs(view_file.assertions[0], file.assertions[1])
+        self.assertEqual(contexts.Contexts(view).contexts,
+                [contexts.Contexts.Context("assert", "b", "a.c", "0", None)])
+
+    def test_moves(self):
+        """Assertions removed from one file and added to another are moves"""
+        history = History("", "")
+        diff = Diff(commit_id="0")
+        for filename, changes in [("a.c", [("x", Change.removed),
+                                           ("y", Change.removed),
+                                           ("x", Change.added)]),
+                                  ("b.c", [("y", Change.added),
+                                           ("x ", Change.added),
+                                           ("x", Change.added)])]:
+            file = File(filename, diff)
+            for predicate, change in changes:
+                file.assertions.append(Assertion(0, 0, 0, 1, [], "assert",
+                    predicate, change, parent_file=file))
+            diff.files.append(file)
+        history.update_diff(diff)
+
+        a, b = diff.files
+        self.assertEqual(analysis.diff_moves(diff), [((a, 1), (b, 0)),
+                                                     ((a, 0), (b, 1))])
+        view = analysis.without_moves(history)
+        self.assertEqual([a.predicate for a in view.assertions()], ["x", "x"])
+        self.assertEqual(dict(view.moved), {("0", "a.c"): {0, 1},
+                                            ("0", "b.c"): {0, 1}})
+
+
+class TestPredicateClusters(unittest.TestCase):
+    def test_clusters(self):
+        c = clusters.PredicateClusters(["x < y && y < z", "buf != NULL",
+                                        "x<y && y<z", "x < y && y < w"])
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.key("x < y && y < w"), "x < y && y < z")
+        self.assertEqual(c.key("buf != NULL"), "buf != NULL")
+        self.assertEqual(c.key("len > 0"), "len > 0")   # added
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.clusters()["x < y && y < z"],
+                         ["x<y&&y<z", "x<y&&y<w"])
+
+    def test_signatures(self):
+        """Signatures must agree with the similarity of the shingles"""
+        c = clusters.PredicateClusters()
+        a, b, d = c.signatures(["a->b == c->d && e", "a->b == c->d && f",
+                                "foo(bar) != 42"])
+        self.assertTrue((a == c.signatures(["a->b == c->d && e"])[0]).all())
+        self.assertGreater((a == b).mean(), (a == d).mean())
+
+
+class TestSummary(unittest.TestCase):
+    def test_merge(self):
+        """Merged summaries must count the events of all their histories"""
+        history = mine_repo("assert", TestMineRepo.TEST_REPO, "master")
+        summary = analysis.Summary(history)
+        self.assertEqual(list(summary.names.values()),
+                         list(analysis.names_datapoints(history).values()))
+
+        merged = pickle.loads(pickle.dumps(summary)) + summary
+        self.assertEqual(merged.repos, [history.repo_path] * 2)
+        for dp, merged_dp in zip(summary.predicates.values(),
+                                 merged.predicates.values()):
+            self.assertEqual(merged_dp.x_val, dp.x_val)
+            self.assertEqual(merged_dp.y_combined, 2 * dp.y_combined)
+
+        counts = activity.Activity(history)
+        self.assertEqual((counts + counts).counter,
+                         counts.counter + counts.counter)
+
+
+class TestECDF(unittest.TestCase):
+    DATA = random.Random(0).choices([0, 1, 1, 2, 3, 5, 8, 13, 100], k=500)
+
+    def test_discrete_cdf(self):
+        """The ECDF must be that of the former discrete_cdf (the fraction of
+        the sorted data before each point, by bisect), at every point it was
+        graphed at, and beyond"""
+        data = sorted(self.DATA)
+        points = list(range(-1, max(data) + 2))
+        expected = [bisect.bisect_left(data, p) / float(len(data))
+                for p in points]
+        self.assertEqual(cdf.ECDF(self.DATA)(points).tolist(), expected)
+        self.assertEqual(cdf.discrete_cdf(data)(13), expected[14])
+
+    def test_merge(self):
+        a, b = self.DATA[:200], self.DATA[200:] + [7, 1000]
+        whole = cdf.ECDF(a + b)
+        for ecdf in [cdf.ECDF(a).merge(cdf.ECDF(b)), cdf.ECDF(a) + cdf.ECDF(b),
+                cdf.ECDF(a).update(b), cdf.ECDF().update(a).update(iter(b)),
+                cdf.ECDF().merge(whole)]:
+            self.assertEqual(ecdf.values.tolist(), whole.values.tolist())
+            self.assertEqual(ecdf.counts.tolist(), whole.counts.tolist())
+            self.assertEqual(ecdf.cumulative.tolist(),
+                    whole.cumulative.tolist())
+        self.assertEqual(len(whole), len(a) + len(b))
+
+    def test_quantile(self):
+        ecdf = cdf.ECDF(self.DATA)
+        data = sorted(self.DATA)
+        self.assertEqual(ecdf.quantile(0), data[0])
+        self.assertEqual(ecdf.quantile(1), data[-1])
+        self.assertEqual(ecdf.quantile([0.5, 0.9]).tolist(),
+                [data[249], data[449]])
+        self.assertEqual(cdf.ECDF([4]).quantile([0, 1]).tolist(), [4, 4])
+
+    def test_to_csv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "cdf.csv")
+            cdf.ECDF([3, 1, 3, 2]).to_csv(filename)
+            with open(filename, newline="") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(rows, [["x", "count", "cdf"], ["1", "1", "0.25"],
+                ["2", "1", "0.5"], ["3", "2", "1.0"]])
+
+
+class TestSketches(unittest.TestCase):
+    def test_hyperloglog(self):
+        a, b = sketches.HyperLogLog(0.01), sketches.HyperLogLog(0.01)
+        a.add("k{n}".format(n=n) for n in range(20000))
+        b.add("k{n}".format(n=n) for n in range(10000, 30000))
+        self.assertAlmostEqual(a.merge(b).count(), 30000, delta=30000 * 0.04)
+        self.assertEqual(len(sketches.HyperLogLog().add(["a", "b", "a"])), 2)
+
+    def test_heavy_hitters(self):
+        """Keys more frequent than the error must be kept, and counted"""
+        hh = sketches.HeavyHitters(0.1)
+        for n in range(1000):
+            hh.add("rare{n}".format(n=n))
+            if n % 4 == 0:
+                hh.add("frequent", 2, "f", (2, 0))
+        self.assertLessEqual(len(hh), 2 * hh.capacity)
+        key, count, value, parts = hh.top(1)[0]
+        self.assertEqual((key, value), ("frequent", "f"))
+        self.assertLessEqual(500 - count, hh.error_bound())
+        self.assertLessEqual(hh.error_bound(), 0.1 * hh.total)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_make_repo(self):
+        """Synthetic repos must have the commits, merges and problematic
+        assertions asked for, and always the same ones"""
+        with tempfile.TemporaryDirectory() as tmp:
+            histories = []
+            for name in ["a.git", "b.git"]:
+                path = os.path.join(tmp, name)
+                benchmark.make_repo(path, commits=60, files=5, merge_every=20)
+                histories.append(mine_repo(benchmark.ASSERTION_RE, path,
+                    "master"))
+        history = histories[0]
+        self.assertEqual(len(history.diffs), 60)
+        self.assertEqual(sum(len(d.parents) == 2 for d in history.diffs), 2)
+        self.assertTrue(list(history.assertions(confirmed=False,
+            problematic=True)))
+        self.assertEqual([a.info() for a in history],
+                [a.info() for a in histories[1]])
+
+    def test_regressions(self):
+        phases = {"mine_repo": {"seconds": 1.0, "peak_bytes": 1000}}
+        baselines = {"scales": {"small": {"commits": 10, "assertions": 5,
+            "phases": phases}}}
+        result = {"commits": 10, "assertions": 5, "phases": {"mine_repo":
+            {"seconds": 1.1, "peak_bytes": 2000}}}
+        found = benchmark.regressions({"small": result}, baselines)
+        self.assertEqual(len(found), 1)
+        self.assertIn("peak_bytes", found[0])
+
+
+class TestProfiling(unittest.TestCase):
+    def test_mine_profile(self):
+        """A mining run's Profile must count what it mined, the same with
+        worker processes as without"""
+        with tempfile.TemporaryDirectory() as tmp:
+            benchmark.make_repo(tmp, commits=40, files=4)
+            profiles = [profiling.Profile(), profiling.Profile()]
+            history = mine_repo(benchmark.ASSERTION_RE, tmp, "master",
+                    profile=profiles[0])
+            mine_repo(benchmark.ASSERTION_RE, tmp, "master", processes=2,
+                    profile=profiles[1])
+        counts = profiles[0].counts
+        self.assertEqual(counts["commits"], len(history.diffs))
+        self.assertEqual(counts["assertions"], sum(len(f.assertions)
+            for d in history.diffs for f in d.files))
+        self.assertEqual(counts, profiles[1].counts)
+        self.assertEqual(profiles[0].phases["mine_repo"].calls, 1)
+        self.assertEqual(profiles[0].phases["extract"].calls,
+                profiles[1].phases["extract"].calls)
+
+        total = profiling.Profile.from_dict(profiles[0].to_dict()) + \
+                profiles[1]
+        self.assertEqual(total.counts["hunks"], 2 * counts["hunks"])
+
+    def test_parse_retries(self):
+        cache = predast.ASTCache()
+        cache.parse_all(["(foo_t)x > 0", "offsetof(S, x) == 0", "a &&", "b"])
+        self.assertEqual((cache.misses, cache.failures, cache.retries),
+                (4, 1, 5))
+
+
+def resource_usage():
+    """The bytes of (virtual) memory this process uses"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+def _record_repo(d, stream, processes):
+    with open("order.txt", "a") as f:
+        f.write(d + "\n")
+
+def _hang_repo(d, stream, processes):
+    with multiprocessing.Pool(1) as pool:
+        with open(d + ".pid", "w") as f:
+            f.write(str(pool._pool[0].pid))
+        pool.apply(time.sleep, (60,))
+
+def _allocate_repo(d, stream, processes):
+    bytearray(2 * 2**30)
+
+def _record_limit(d, stream, processes):
+    with open("limit.txt", "w") as f:
+        f.write(str(resource.getrlimit(resource.RLIMIT_AS)[0]))
+
+def _fail_repo(d, stream, processes):
+    raise ValueError(d)
+
+
+class TestWalkRepos(unittest.TestCase):
+    """walk_repos.mine, run in a directory of synthetic repos"""
+    def setUp(self):
+        for name in ["PROCESSES", "REPO_PROCESSES", "REPO_TIMEOUT",
+                "REPO_MEMORY", "mine_repo_process"]:
+            self.addCleanup(setattr, walk_repos, name,
+                    getattr(walk_repos, name))
+        walk_repos.PROCESSES = walk_repos.REPO_PROCESSES = 1
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        os.mkdir("results")
+
+    def make_repos(self, sizes):
+        for d, commits in sizes.items():
+            repo = benchmark.make_repo(d, commits=commits, files=4)
+            repo.references.create("refs/heads/" + walk_repos.BRANCH,
+                    repo.references["refs/heads/master"].target)
+
+    def mine(self):
+        """The statuses of the repos (and what mine printed)"""
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            walk_repos.mine()
+        return {d: m["status"] for d, m in walk_repos.load_manifest().items()}, \
+                out.getvalue()
+
+    def test_largest_first(self):
+        self.make_repos({"small": 5, "large": 60, "medium": 20})
+        walk_repos.mine_repo_process = _record_repo
+        self.mine()
+        with open("order.txt") as f:
+            self.assertEqual(f.read().split(), ["large", "medium", "small"])
+
+    def test_statuses(self):
+        """Timed-out repos must be killed with their pool workers, and
+        failures and running out of memory recorded"""
+        self.make_repos({"hangs": 5})
+        walk_repos.REPO_TIMEOUT = 2
+        walk_repos.mine_repo_process = _hang_repo
+        self.assertEqual(self.mine()[0], {"hangs": "timeout"})
+        with open("hangs.pid") as f:
+            worker = int(f.read())
+        for _ in range(50):
+            try:
+                with open("/proc/{p}/stat".format(p=worker)) as f:
+                    if f.read().split(") ")[1].startswith("Z"):
+                        break
+            except FileNotFoundError:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail("pool worker {p} is still running".format(p=worker))
+
+        walk_repos.REPO_TIMEOUT = None
+        walk_repos.REPO_MEMORY = 2**30 + resource_usage()
+        walk_repos.mine_repo_process = _allocate_repo
+        self.assertEqual(self.mine()[0], {"hangs": "memory"})
+        walk_repos.mine_repo_process = _fail_repo
+        self.assertEqual(self.mine()[0], {"hangs": "failed"})
+
+    def test_memory_shared(self):
+        """REPO_MEMORY must be split between a repo's process and the
+        workers of both of its pools"""
+        self.make_repos({"a": 5})
+        walk_repos.PROCESSES = 2
+        walk_repos.REPO_MEMORY = 5 * (2**30 + resource_usage())
+        walk_repos.mine_repo_process = _record_limit
+        self.mine()
+        with open("limit.txt") as f:
+            self.assertEqual(int(f.read()), walk_repos.REPO_MEMORY // 5)
+
+    def test_resume(self):
+        """Repos done must be skipped, unless their branch has moved, and
+        mined again if it was rewritten"""
+        self.make_repos({"a": 20, "b": 10})
+        self.assertEqual(self.mine()[0], {"a": "done", "b": "done"})
+        self.assertIn("0 repos to mine, 2 already done", self.mine()[1])
+
+        repo = pygit2.Repository("a")
+        tip = repo.lookup_branch(walk_repos.BRANCH).target
+        signature = pygit2.Signature("A", "a@b", 1600000000, 0)
+        tree = benchmark._write_tree(repo, {"src/new.c":
+            repo.create_blob(b"assert(x);\n")})
+        new_tip = repo.create_commit("refs/heads/" + walk_repos.BRANCH,
+                signature, signature, "new", tree, [tip])
+
+        self.assertIn("1 repos to mine, 1 already done", self.mine()[1])
+        self.assertEqual(walk_repos.load_manifest()["a"]["tip"], new_tip.hex)
+        history = analysis.load_history("results/a.pickle")
+        self.assertEqual(len(history.diffs), 21)
+        self.assertIn(new_tip.hex, history)
+
+        rewrite = repo.create_commit(None, signature, signature, "rewrite",
+                tree, [tip])
+        repo.references["refs/heads/" + walk_repos.BRANCH].set_target(rewrite)
+        self.assertIn("a   rewritten", self.mine()[1])
+        history = analysis.load_history("results/a.pickle")
+        self.assertEqual(len(history.diffs), 21)
+        self.assertIn(rewrite.hex, history)
+        self.assertNotIn(new_tip.hex, history)
+
+class TestAnalyze(unittest.TestCase):
+    def test_csv_only(self):
+        """Analysis without rendering must write the CSVs and Results, but no
+        graphs, without importing matplotlib (even in its pool's workers),
+        which rendering then uses"""
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, "results"))
+            benchmark.make_repo(os.path.join(tmp, "repo.git"), commits=40)
+            save_history(mine_repo(benchmark.ASSERTION_RE,
+                os.path.join(tmp, "repo.git"), "master"),
+                os.path.join(tmp, "results", "repo.pickle"))
+            script = "; ".join(["import sys", "sys.path.insert(0, {d!r})",
+                "sys.modules['matplotlib'] = None", "import walk_repos",
+                "walk_repos.PROCESSES = 1", "walk_repos.analyze(render=False)"])
+            # (failures of the pool's workers are only printed)
+            run = subprocess.run([sys.executable, "-c", script.format(
+                d=os.path.dirname(os.path.abspath(__file__)))], cwd=tmp,
+                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                universal_newlines=True)
+            self.assertNotIn("Traceback", run.stderr)
+
+            files = os.listdir(os.path.join(tmp, "results"))
+            self.assertIn("repo_names.csv", files)
+            self.assertIn("repo_activity.csv", files)
+            self.assertIn("repo.results", files)
+            self.assertFalse([f for f in files if f.endswith(".png")])
+
+            self.addCleanup(os.chdir, os.getcwd())
+            os.chdir(tmp)
+            self.addCleanup(setattr, walk_repos, "PROCESSES",
+                    walk_repos.PROCESSES)
+            walk_repos.PROCESSES = 1
+            with contextlib.redirect_stdout(io.StringIO()):
+                walk_repos.render_all()
+            self.assertIn("repo_names.png", os.listdir("results"))
+
+
 class TestGraph(unittest.TestCase):
     """For use in comparing children/parent relationships.
         Children are later commits than parents.
@@ -11,88 +11,407 @@ import traceback
 import itertools
 import time
 import datetime
+import json
+from collections import OrderedDict
+import resource
+import multiprocessing
+import multiprocessing.connection
+import signal
+import functools
+
+import pygit2
 
 import analysis
+import activity
+import predast
+import columnar
+import query
+import profiling
 
 
 # Linux and Xen have BUG_ONs
 # From Github Replication paper: ut_ad in mysq/innobase; DCHECK in over a dozen
 ASSERT_FMT = "\w*(ASSERT|assert|BUG_ON|bug_on|DCHECK)\w*|ut_ad?"
 
-def mine():
+BRANCH = "Tressa"   # of each repo, mined
+
+PROCESSES = os.cpu_count() or 1 # worker processes used for mining
+REPO_PROCESSES = PROCESSES  # repos mined at the same time
+
+REPO_TIMEOUT = None # if set, seconds after which a repo's mining is abandoned
+REPO_MEMORY = None  # if set, bytes of (virtual) memory each repo's mining
+                    # may use, e.g. 8 * 2**30, split evenly between its
+                    # process and its pool workers
+
+MANIFEST = "results/manifest.json" # status of each repo mined
+
+PROFILE = "results/profile.json" # the time of each phase of mining, and counts
+                                 # of what was mined, summed over all repos
+                                 # (each repo's is in results/<repo>.profile.json)
+
+AST_CACHE = "results/ast_cache.sqlite" # predicate ASTs shared by all repos
+
+INDEX = "results/assertions.sqlite" # assertions of all repos, for queries
+
+CORPUS = "results/corpus_" # prefix of the merged statistics of all repos
+SKETCH_ERROR = 0.001    # of the approximate corpus statistics: of the counts,
+DISTINCT_ERROR = 0.01   # as a fraction of all, and of the numbers of distinct
+
+EXCLUDE_MOVES = False   # if set, assertions moved within a commit (removed
+                        # and added again) are excluded from the statistics
+
+def mine(stream=False):
+    """Mines each repo into results/, REPO_PROCESSES repos at a time, each in
+    its own process (which uses the rest of the PROCESSES), largest first so
+    that the last ones to finish are short. Each repo's outcome is recorded in
+    the MANIFEST, with the tip of its BRANCH; when run again, the repos done
+    are skipped unless their BRANCH has moved since, in which case only their
+    new commits are mined (or, if it was rewritten, all of them again).
+    With :stream:, each commit's Diff is written out as soon as it is mined
+    rather than kept in a History, which bounds memory use for huge repos;
+    such a run always starts from scratch.
+    Each repo's mining is profiled (see profiling.Profile), and their Profiles
+    are summed into PROFILE at the end.
+    """
     logging.basicConfig(level=logging.DEBUG, filename="walk_repos_mine.log")
 
     dirs = os.listdir(".")
     dirs = itertools.filterfalse(lambda d: d.endswith(".py") or d.endswith(".log")
                                     or d in ['results', '__pycache__'], dirs)
-    dirs = list(dirs)
+    dirs = [d for d in dirs if os.path.isdir(d)]
+
+    manifest = load_manifest()
+    tips = {d: branch_tip(d) for d in dirs}
+    todo = [d for d in dirs if manifest.get(d, {}).get("status") != "done"
+            or manifest[d].get("tip") != tips[d]]
+    for d in todo:
+        if rewritten(d, manifest.get(d, {}).get("tip"), tips[d]):
+            # (the History mined would keep the Diffs of the commits gone)
+            print("{d}   rewritten, mining it again".format(d=d), flush=True)
+            if os.path.exists('results/' + d + '.pickle'):
+                os.remove('results/' + d + '.pickle')
+    todo.sort(key=repo_size, reverse=True)
+    processes = max(1, PROCESSES // REPO_PROCESSES) # for each repo
+    print("{n} repos to mine, {s} already done".format(n=len(todo),
+        s=len(dirs) - len(todo)), flush=True)
 
     starttime = time.time()
-    lasttime = starttime
-    for i,d in enumerate(dirs):
-        print("{d}   {i}/{n}".format(d=d, i=i+1, n=len(dirs)), flush=True)
-        try:
-            hist = assertions.mine_repo(ASSERT_FMT, d, "Tressa")
-            with open('results/' + d + '.pickle', 'wb') as f:
-                pickle.dump(hist, f)
-            with open('results/' + d + '.asserts', 'w') as f:
-                for a in hist:
-                    f.write(a.info() + "\n")
-        except:
-            traceback.print_exc()
-        thistime = time.time()
-        print("\t{d}, total {t}".format(
-                d=datetime.timedelta(seconds=thistime-lasttime),
-                t=datetime.timedelta(seconds=thistime-starttime)),
-            flush=True)
-        lasttime = thistime
-
-def analyze():
-    """Assumes results/ dir populates with pickled files as from mining above.
-    Produces csv and png of graphs for some statistics
+    running = {}    # sentinel -> (repo, Process, starting time)
+    finished = 0
+    while todo or running:
+        while todo and len(running) < REPO_PROCESSES:
+            d = todo.pop(0)
+            p = multiprocessing.Process(target=repo_process, name=d,
+                    args=(d, stream, processes))
+            p.start()
+            running[p.sentinel] = (d, p, time.time())
+            print("{d}   started".format(d=d), flush=True)
+
+        timeout = None
+        if REPO_TIMEOUT is not None:
+            deadline = min(t for _, _, t in running.values()) + REPO_TIMEOUT
+            timeout = max(0, deadline - time.time())
+        ready = multiprocessing.connection.wait(list(running), timeout)
+
+        now = time.time()
+        for sentinel, (d, p, t) in list(running.items()):
+            if sentinel in ready:
+                p.join()
+                status = EXIT_STATUSES.get(p.exitcode, "killed")
+            elif REPO_TIMEOUT is not None and now - t >= REPO_TIMEOUT:
+                kill_repo_process(p)
+                status = "timeout"
+            else:
+                continue
+            del running[sentinel]
+            finished += 1
+            manifest[d] = {"status": status, "seconds": round(now - t, 1),
+                    "tip": tips[d]}
+            save_manifest(manifest)
+            print("{d}   {s}   {i}/{n}\n\t{t}, total {tt}".format(d=d, s=status,
+                    i=finished, n=finished + len(running) + len(todo),
+                    t=datetime.timedelta(seconds=now-t),
+                    tt=datetime.timedelta(seconds=now-starttime)),
+                flush=True)
+
+    profile()
+
+EXIT_STATUSES = {0: "done", 1: "failed", 3: "memory"}
+
+def repo_process(d, stream, processes):
+    """Mines repo :d: by mine_repo_process, in a process of its own, which
+    leads a process group of its own (so that it can be killed along with its
+    pool workers) and, with them, may use at most REPO_MEMORY. It exits with
+    the code of its status in EXIT_STATUSES.
     """
-
-    logging.basicConfig(level=logging.DEBUG, filename="walk_repos_analyze.log")
-
+    os.setsid()
+    if REPO_MEMORY is not None:
+        # The limit is of each process, and its pool workers inherit it. At
+        # checkpoints, the workers parsing run alongside those diffing.
+        workers = 2 * processes if processes > 1 else 0
+        limit = REPO_MEMORY // (workers + 1)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        mine_repo_process(d, stream, processes)
+    except MemoryError:
+        traceback.print_exc()
+        sys.exit(3)
+    except:
+        traceback.print_exc()
+        sys.exit(1)
+
+def kill_repo_process(p):
+    """Kills the repo_process :p:, and all the processes it started"""
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError: # (before it had its own process group)
+        p.kill()
+    p.join()
+
+def mine_repo_process(d, stream, processes):
+    """Mines repo :d: into results/"""
+    prof = profiling.Profile()
+    with predast.ASTCache(AST_CACHE) as ast_cache:
+        pickle_file = 'results/' + d + '.pickle'
+        if stream:
+            diffs = assertions.stream_repo(ASSERT_FMT, d, BRANCH,
+                    processes, ast_cache=ast_cache, profile=prof)
+            with prof.phase("stream_repo"):
+                assertions.dump_stream(diffs, d, BRANCH,
+                        pickle_file + ".tmp", 'results/' + d + '.asserts')
+            os.replace(pickle_file + ".tmp", pickle_file)
+        else:
+            # Extend the History of any previous (or interrupted) run
+            with prof.phase("load"):
+                hist = analysis.load_history(pickle_file) \
+                        if os.path.exists(pickle_file) else None
+            hist = assertions.mine_repo(ASSERT_FMT, d, BRANCH, processes,
+                    history=hist, checkpoint=pickle_file,
+                    ast_cache=ast_cache, profile=prof)
+            with prof.phase("save"):
+                assertions.save_history(hist, pickle_file)
+                with open('results/' + d + '.asserts', 'w') as f:
+                    for a in hist:
+                        f.write(a.info() + "\n")
+    prof.save(profile_file(d))
+
+def branch_tip(d):
+    """The id of the commit at the tip of the BRANCH of repo :d:, or None if
+    it has none
+    """
+    try:
+        branch = pygit2.Repository(d).lookup_branch(BRANCH)
+    except pygit2.GitError:
+        return None
+    return branch.target.hex if branch is not None else None
+
+def rewritten(d, old_tip, tip):
+    """Whether the BRANCH of repo :d: was rewritten (e.g. force-pushed) since
+    it was at :old_tip:, so that its :tip: doesn't descend from it
+    """
+    if old_tip is None or tip is None or old_tip == tip:
+        return False
+    try:
+        return not pygit2.Repository(d).descendant_of(tip, old_tip)
+    except (KeyError, ValueError, pygit2.GitError): # (old_tip is gone)
+        return True
+
+def profile_file(d):
+    return 'results/' + d + '.profile.json'
+
+def profile():
+    """Sums the Profiles of the repos mined (of their latest runs) into
+    PROFILE, and prints it
+    """
+    files = ["results/" + f for f in sorted(os.listdir("results"))
+            if f.endswith(".profile.json")]
+    total = profiling.aggregate(files)
+    total.count("repos", len(files))
+    total.save(PROFILE)
+    print(total.report())
+
+def repo_size(d):
+    """The bytes in the git directory of repo :d:, as an estimate of how long
+    it takes to mine
+    """
+    git_dir = os.path.join(d, ".git")
+    root = git_dir if os.path.isdir(git_dir) else d
+    return sum(os.path.getsize(os.path.join(path, f))
+            for path, _, files in os.walk(root) for f in files)
+
+def load_manifest():
+    """The status of each repo mined so far: {repo: {"status", "seconds",
+    "tip"}}"""
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST) as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    with open(MANIFEST + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(MANIFEST + ".tmp", MANIFEST)
+
+def histories():
+    """The History files in results/: pickled ones, as from mining above, or
+    their columnar versions, when converted since (which are used instead)
+    """
+    def mtime(f):
+        return os.path.getmtime("results/" + f) if f in files else -1
     files = os.listdir("results")
-    files = [f for f in files if f.endswith(".pickle")]
+    repos = {os.path.splitext(f)[0] for f in files
+                if f.endswith(".pickle") or f.endswith(".columns")}
+    return [r + ".columns" if mtime(r + ".columns") >= mtime(r + ".pickle")
+            else r + ".pickle" for r in sorted(repos)]
 
-    starttime = time.time()
-    lasttime = starttime
+def columnize():
+    """Converts the pickled Histories in results/ to columnar ones"""
+    logging.basicConfig(level=logging.DEBUG, filename="walk_repos_columnize.log")
 
+    files = [f for f in histories() if f.endswith(".pickle")]
     for i, file in enumerate(files):
         print("{d}   {i}/{n}".format(d=file, i=i+1, n=len(files)), flush=True)
-
         try:
             h = analysis.load_history("results/" + file)
+            columnar.save_columns(h, "results/" + file[:-len(".pickle")] + ".columns")
+        except:
+            traceback.print_exc()
 
-            repo = file[:-len(".pickle")]
+def index():
+    """Indexes the assertions of all the Histories in results/ in INDEX (see
+    query.AssertionIndex)
+    """
+    logging.basicConfig(level=logging.DEBUG, filename="walk_repos_index.log")
+
+    files = histories()
+    with query.AssertionIndex(INDEX) as assertion_index:
+        for i, file in enumerate(files):
+            print("{d}   {i}/{n}".format(d=file, i=i+1, n=len(files)), flush=True)
+            try:
+                assertion_index.add_history(analysis.load_history("results/" + file))
+            except:
+                traceback.print_exc()
+
+def analyze(render=True):
+    """Assumes results/ dir populates with pickled files as from mining above.
+    Produces csv of some statistics for each, across a pool of PROCESSES, and
+    saves their Results (in results/<repo>.results). Then, if :render:, the
+    png of their graphs (see render, which can also be run later instead).
+    """
 
-            def result_save(result, filename):
-                prefix = "results/{repo}_{stat}".format(repo=repo, stat=filename)
-                result.graph(25, prefix + ".png")
-                result.csv(prefix + ".csv")
+    logging.basicConfig(level=logging.DEBUG, filename="walk_repos_analyze.log")
 
-            result_save(analysis.names_result(h), "names")
-            result_save(analysis.activity_result(h), "activity")
+    files = histories()
+    pool_map(analyze_history, files)
+    if render:
+        render_all()
 
-            (com_res, atime_res, ctime_res), (lin, mon) = analysis.delta_results(h)
-            result_save(com_res, "distance-commit")
-            result_save(atime_res, "duration-author-time")
-            result_save(ctime_res, "duration-commit-time")
-            with open("results/{repo}_linearity-monotonicity.float".format(repo=repo), "w") as linf:
-                linf.write(str(lin) + "\n" + str(mon))
-            analysis.problematics(h, "results/{r}_".format(r=repo))
+def analyze_history(file):
+    """Produces the csvs of the statistics of the History in results/:file:,
+    and saves their Results for rendering
+    """
+    h = analysis.load_history("results/" + file)
+
+    repo = os.path.splitext(file)[0]
+    results, (lin, mon), problems = analysis.all_results(h,
+            moves=not EXCLUDE_MOVES)
+
+    for stat, result in results.items():
+        result.csv("results/{repo}_{stat}.csv".format(repo=repo, stat=stat))
+    with open("results/{repo}_linearity-monotonicity.float".format(repo=repo), "w") as linf:
+        linf.write(str(lin) + "\n" + str(mon))
+    analysis.save_problematics(problems, "results/{r}_".format(r=repo))
+
+    with open("results/{repo}.results".format(repo=repo), "wb") as f:
+        pickle.dump(results, f)
+
+def render_all():
+    """Produces the png of the graph of each Result saved by analyze"""
+    logging.basicConfig(level=logging.DEBUG, filename="walk_repos_render.log")
+
+    files = [f for f in os.listdir("results") if f.endswith(".results")]
+    pool_map(render_results, files)
+
+def render_results(file):
+    repo = os.path.splitext(file)[0]
+    with open("results/" + file, "rb") as f:
+        results = pickle.load(f)
+    for stat, result in results.items():
+        result.graph(25, "results/{repo}_{stat}.png".format(repo=repo, stat=stat))
+
+def corpus(approximate=False):
+    """Summarizes the History of each repo in results/ (in results/<repo>.summary),
+    across a pool of PROCESSES, then merges the summaries, one at a time, into
+    the statistics of all of them: the csvs of their names and activity
+    Results (also saved, for render, as results/corpus.results), and the
+    activity counts (see activity.Activity, and cdf.py).
+    If :approximate:, only the most frequent names and predicates are counted
+    (see analysis.ApproximateSummary), in constant memory, and not the
+    activity counts.
+    """
+    logging.basicConfig(level=logging.DEBUG, filename="walk_repos_corpus.log")
 
-        except:
-            traceback.print_exc()
+    files = histories()
+    pool_map(summarize_history, files)
 
-        thistime = time.time()
-        print("\t{d}, total {t}".format(
-            d=datetime.timedelta(seconds=thistime-lasttime),
-            t=datetime.timedelta(seconds=thistime-starttime)),
-            flush=True)
-        lasttime = thistime
+    if approximate:
+        summary = analysis.ApproximateSummary(error=SKETCH_ERROR,
+                distinct_error=DISTINCT_ERROR, repo_path="corpus")
+    else:
+        summary = analysis.Summary(repo_path="corpus")
+        activities = activity.Activity()
+    for file in files:
+        try:
+            with open("results/" + summary_file(file), "rb") as f:
+                repo_summary, repo_activity = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            logging.warning("No summary of " + file)
+            continue
+        if approximate:
+            summary.add(repo_summary)
+        else:
+            summary.merge(repo_summary)
+            activities.merge(repo_activity)
+
+    results = OrderedDict([("names", summary.names_result()),
+        ("activity", summary.activity_result())])
+    for stat, result in results.items():
+        result.csv(CORPUS + stat + ".csv")
+    with open(CORPUS.rstrip("_") + ".results", "wb") as f:
+        pickle.dump(results, f)
+    if not approximate:
+        activities.to_file(CORPUS + "activity-count.txt")
+        activities.save(CORPUS + "activity.pickle")
+
+def summarize_history(file):
+    h = analysis.load_history("results/" + file)
+    with open("results/" + summary_file(file), "wb") as f:
+        pickle.dump((analysis.Summary(h), activity.Activity(h)), f)
+
+def summary_file(file):
+    return os.path.splitext(file)[0] + ".summary"
+
+def pool_map(func, files):
+    """Applies :func: to each of the files across a pool of PROCESSES,
+    reporting progress as they finish
+    """
+    starttime = time.time()
+    with multiprocessing.Pool(PROCESSES) as pool:
+        for i, (file, seconds) in enumerate(pool.imap_unordered(
+                functools.partial(timed, func), files)):
+            print("{d}   {i}/{n}\n\t{t}, total {tt}".format(d=file, i=i+1,
+                    n=len(files), t=datetime.timedelta(seconds=seconds),
+                    tt=datetime.timedelta(seconds=time.time()-starttime)),
+                flush=True)
+
+def timed(func, file):
+    """Applies :func: to :file:, producing the file and the seconds it took"""
+    starttime = time.time()
+    try:
+        func(file)
+    except:
+        traceback.print_exc()
+    return file, time.time() - starttime
 
 def custom(func):
     """Given a function that takes a History and Filename, and produces a
@@ -103,8 +422,7 @@ def custom(func):
 
     logging.basicConfig(level=logging.DEBUG, filename="walk_repos_custom.log")
 
-    files = os.listdir("results")
-    files = [f for f in files if f.endswith(".pickle")]
+    files = histories()
 
     starttime = time.time()
     lasttime = starttime
@@ -115,7 +433,7 @@ def custom(func):
         try:
             h = analysis.load_history("results/" + file)
 
-            repo = file[:-len(".pickle")]
+            repo = os.path.splitext(file)[0]
             basename = "results/{repo}_".format(repo=repo)
             func(h, basename)
 
@@ -154,16 +472,26 @@ def cprojects(path):
 
 
 if __name__ == '__main__':
-    USAGE = "Usage: " + sys.argv[0] + " [mine|analyze|custom|[oncecommit|cprojects] <path>]"
+    USAGE = "Usage: " + sys.argv[0] + " [mine [--stream]|profile|columnize|index|analyze [--csv]|render|corpus [--approximate]|custom|[oncecommit|cprojects] <path>]"
 
     if len(sys.argv) != 2 and len(sys.argv) != 3:
         print(USAGE)
         sys.exit(-1)
 
     if sys.argv[1] == "mine":
-        mine()
+        mine(stream=sys.argv[2:] == ["--stream"])
+    elif sys.argv[1] == "profile":
+        profile()
+    elif sys.argv[1] == "columnize":
+        columnize()
+    elif sys.argv[1] == "index":
+        index()
     elif sys.argv[1] == "analyze":
-        analyze()
+        analyze(render=sys.argv[2:] != ["--csv"])
+    elif sys.argv[1] == "render":
+        render_all()
+    elif sys.argv[1] == "corpus":
+        corpus(approximate=sys.argv[2:] == ["--approximate"])
     elif sys.argv[1] == "custom":
         custom(analysis.problematics)
     elif sys.argv[1] == "onecommit":